@@ -0,0 +1,57 @@
+import argparse
+
+
+def create_args_parser(add_help: bool = True) -> argparse.ArgumentParser:
+    # Options shared by main.py and the daemon, kept apart so the daemon client only imports argparse
+    args_parser = argparse.ArgumentParser(
+        prog="main.py", description="Python HTML to JS transcriptor", add_help=add_help
+    )
+    bool_choices = ["yes", "no"]
+
+    args_parser.add_argument("-c", "--config", action="store_true", help="Specifies that a file is a config file")
+    args_parser.add_argument("-f", "--file", action="append", required=True,
+                             help="Specify a config, directory or HTML file path")
+    args_parser.add_argument("-b", "--behavior", default="ret",
+                             help="What the script does, return or replace HTMLElements")
+    args_parser.add_argument("-id", "--idrepl", action="append", help="Replacement ID")
+    args_parser.add_argument("-uid", "--uidrepl", help="Replacement ID for all components")
+    args_parser.add_argument("-p", "--params", help="Parameters used inside the HTML")
+    args_parser.add_argument("-o", "--onload", choices=bool_choices, help="Whether the script should run onload")
+    args_parser.add_argument("-w", "--watch", choices=bool_choices,
+                             help="Whether PyWST should watch for filesystem changes")
+    args_parser.add_argument("--cache", choices=bool_choices,
+                             help="Whether PyWST should skip files that did not change since the last run")
+    args_parser.add_argument("-m", "--minify", choices=bool_choices,
+                             help="Whether PyWST should minify generated scripts")
+    args_parser.add_argument("--watchdelay", type=int,
+                             help="Milliseconds to wait for more changes before transcribing a watched file")
+    args_parser.add_argument("--watcher", choices=["auto", "watchdog", "poll"],
+                             help="Whether watch mode uses watchdog or rescans directories periodically")
+    args_parser.add_argument("--pollinterval", type=int,
+                             help="Milliseconds between rescans of watched directories when polling")
+    args_parser.add_argument("-j", "--jobs", type=int,
+                             help="Amount of processes used to transcribe files in parallel")
+    args_parser.add_argument("--exclude",
+                             help="Glob patterns of files and directories to skip, separated by commas")
+    args_parser.add_argument("--bundle", help="Write all components into this file instead of one file each")
+    args_parser.add_argument("--bundlereport", choices=bool_choices,
+                             help="Whether PyWST should write the size of every bundled component to a JSON file")
+    args_parser.add_argument("--shared", choices=bool_choices,
+                             help="Whether subtrees repeated across bundled components are created by shared functions")
+    args_parser.add_argument("--output", choices=["elements", "template"],
+                             help="Whether functions create every element or clone a template built once")
+    args_parser.add_argument("--update", choices=bool_choices,
+                             help="Whether components with parameters get an update function")
+    args_parser.add_argument("--ictag", choices=bool_choices,
+                             help="Whether PyWST should ignore invalid characters inside closing tags")
+    args_parser.add_argument("--mctag", choices=bool_choices,
+                             help="Whether PyWST should ignore mismatching closing tags")
+    args_parser.add_argument("--entdec", choices=bool_choices,
+                             help="Whether PyWST should decode HTML entities found in text")
+    args_parser.add_argument("--engine", choices=["state", "regex"], help="HTML tokenizer implementation")
+    args_parser.add_argument("--diagnostics", choices=["off", "report", "emit"],
+                             help="Whether PyWST should report every problem in a file at once")
+    args_parser.add_argument("--wholefile", choices=bool_choices,
+                             help="Whether PyWST should tokenize every file as a single buffer")
+
+    return args_parser
@@ -1,8 +1,13 @@
 from pathlib import Path
 import questionary
 import logging
+import sys
 import re
 
+# utilities is inside the PyWST directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import utilities  # noqa: E402
+
 
 def valid_path(directory: str) -> bool:
     p = Path(directory)
@@ -39,19 +44,10 @@ def config_not_taken(name: str):
 
 
 def retrieve_files(path: str) -> tuple[bool, list[str]]:
+    # Same files FILE = * would process, relative to path
     try:
         parent = Path(path).resolve()
-        directories = [parent]
-        _files = []
-        while directories:
-            directory = directories.pop(0)
-            for element in directory.iterdir():
-                if element.is_file() and element.suffix.lower() == ".html":
-                    name = str(element.resolve()).replace(str(parent), "")
-                    _files.append(name[1:] if name.startswith("/") else name)
-                elif element.is_dir():
-                    directories.append(element)
-
+        _files = [str(f.relative_to(parent)) for f in utilities.iter_html_files(parent)]
         return len(_files) > 0, _files
     except PermissionError as e:
         logging.error(e)
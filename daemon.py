@@ -0,0 +1,110 @@
+"""
+Long-running transcription daemon that keeps a warm pool of worker processes.
+
+    python3 daemon.py start [-j JOBS] [--root DIR]  # Serve requests until stopped
+    python3 daemon.py run [main.py options]         # Transcribe files through the daemon
+    python3 daemon.py stop                          # Stop the daemon
+
+The daemon listens on a Unix domain socket (~/.cache/pywst/daemon.sock by default)
+or on localhost when --port is given. Every request and response is a JSON object
+in a single line, requests can be sent one after another without waiting for
+responses, responses carry the id of their request and may arrive in any order.
+
+Requests:
+    {"id": 1, "html": "<div>...</div>", "name": "card", "config": {...}}
+    {"id": 2, "path": "/abs/card.html", "config": {...}, "write": true}
+    {"id": 3, "run": ["-m", "no", "-f", "cards/"], "cwd": "/abs"}
+    {"id": 4, "command": "ping"} or {"id": 5, "command": "stop"}
+
+config holds the properties of a single file, the same ones a config block has (BEHAVIOR, PARAMS,
+MINIFY_CODE, ...), REPL_ID and PARAMS are lists with the value for the file. They are verified the
+same way as config files. Responses contain "js" (HTML or path with write = false), "output" and
+"digest" (path with write = true) or "error" with its "type" and "message".
+
+run takes main.py arguments, relative paths start at cwd. Its response contains "files", the response
+of every file found along with its "path", and "log", the level and message of everything logged while
+reading the arguments and config file. WATCH, BUNDLE, CACHE and JOBS are ignored with a warning.
+
+Only files inside the directory the daemon serves (--root, the working directory by default) can be
+read or written, any other path is answered with a PermissionError.
+
+Only the server imports the transcriber, so running files through the daemon
+doesn't pay for importing it.
+"""
+
+from daemon_client import DaemonClient, DEFAULT_SOCKET
+from cli import create_args_parser
+import argparse
+import logging
+import sys
+import os
+
+
+def run_files(client: DaemonClient, argv: list[str]) -> int:
+    # Transcribes the files given with main.py options, returns the amount of errors
+    response = client.run(argv)
+    if "error" in response:
+        logging.fatal(response["error"]["message"])
+        return 1
+
+    for level, message in response["log"]:
+        logging.log(level, message)
+
+    errors = 0
+    for result in response["files"]:
+        if "error" in result:
+            errors += 1
+            logging.info("Error produced in " + result["path"])
+            logging.fatal(result["error"]["message"])
+        else:
+            logging.info(f"{os.path.basename(result['path'])} transcribed into {result['output']}")
+
+    return errors
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(module)s:%(levelname)s: %(message)s", datefmt="%d %b %H:%M:%S"
+    )
+
+    address_parser = argparse.ArgumentParser(add_help=False)
+    address_parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix domain socket path")
+    address_parser.add_argument("--port", type=int, help="Use a localhost TCP port instead of a Unix socket")
+
+    args_parser = argparse.ArgumentParser(prog="daemon.py", description="PyWST transcription daemon")
+    commands = args_parser.add_subparsers(dest="command", required=True)
+    start_parser = commands.add_parser("start", parents=[address_parser], help="Start the daemon")
+    start_parser.add_argument("-j", "--jobs", type=int, help="Amount of worker processes")
+    start_parser.add_argument("--root", default=".", help="Directory whose files can be transcribed")
+    commands.add_parser(
+        "run", parents=[address_parser, create_args_parser(add_help=False)],
+        help="Transcribe files through the daemon, takes the same options as main.py"
+    )
+    commands.add_parser("stop", parents=[address_parser], help="Stop the daemon")
+
+    arguments = args_parser.parse_args()
+    daemon_address = arguments.port if arguments.port is not None else arguments.socket
+
+    if arguments.command == "start":
+        from daemon_server import serve
+        from pathlib import Path
+
+        try:
+            serve(daemon_address, arguments.jobs, Path(arguments.root))
+        except (ValueError, OSError) as ex:
+            logging.fatal(ex.__str__())
+            exit(1)
+        exit(0)
+
+    try:
+        daemon_client = DaemonClient(daemon_address)
+        if arguments.command == "stop":
+            daemon_client.stop()
+            exit(0)
+
+        # The daemon reads the arguments again, without the ones choosing the daemon
+        _, main_argv = address_parser.parse_known_args(sys.argv[2:])
+        exit(1 if run_files(daemon_client, main_argv) else 0)
+    except OSError as ex:
+        logging.fatal(f"Couldn't reach the daemon at {daemon_address}: {ex}")
+        exit(1)
@@ -0,0 +1,82 @@
+"""
+Client of the transcription daemon, daemon.py describes the protocol.
+
+Kept apart from the transcriber, so sending requests doesn't pay for importing it.
+"""
+
+import threading
+import socket
+import json
+import os
+
+DEFAULT_SOCKET = os.path.join(os.path.expanduser("~"), ".cache", "pywst", "daemon.sock")
+
+
+def connect(address) -> socket.socket:
+    # address is the path of a Unix domain socket or a localhost TCP port
+    if isinstance(address, int):
+        return socket.create_connection(("127.0.0.1", address))
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(os.fspath(address))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class DaemonClient:
+    """
+    Sends requests to a running daemon, see daemon.py for their format.
+
+    Raises OSError if the daemon isn't running.
+    """
+
+    def __init__(self, address=DEFAULT_SOCKET):
+        self.address = address
+
+    def request(self, requests: list[dict]) -> list[dict]:
+        # Responses are returned in the same order as requests
+        requests = [dict(request, id=i) for i, request in enumerate(requests)]
+        responses: list = [None] * len(requests)
+
+        with connect(self.address) as sock, sock.makefile("rb") as rfile:
+            def send():
+                # Sent from another thread, otherwise both sides could block writing
+                with sock.makefile("wb") as wfile:
+                    for r in requests:
+                        wfile.write(json.dumps(r).encode() + b"\n")
+                sock.shutdown(socket.SHUT_WR)
+
+            sender = threading.Thread(target=send, daemon=True)
+            sender.start()
+            received = 0
+            while received < len(requests):
+                line = rfile.readline()
+                if not line:
+                    raise ConnectionError("The daemon closed the connection")
+
+                response = json.loads(line)
+                if response["id"] is None:
+                    raise ValueError(response["error"]["message"])
+
+                responses[response["id"]] = response
+                received += 1
+            sender.join()
+
+        return responses
+
+    def transcribe_string(self, html: str, name: str, config: dict = None) -> str:
+        # Raises ValueError with the message of the daemon if the HTML couldn't be transcribed
+        response = self.request([{"html": html, "name": name, "config": config}])[0]
+        if "error" in response:
+            raise ValueError(response["error"]["message"])
+        return response["js"]
+
+    def run(self, argv: list[str], cwd: str = None) -> dict:
+        # Transcribes the files given by main.py arguments, relative paths start at cwd
+        return self.request([{"run": argv, "cwd": cwd or os.getcwd()}])[0]
+
+    def stop(self):
+        self.request([{"command": "stop"}])
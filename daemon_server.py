@@ -0,0 +1,267 @@
+"""
+Transcription daemon server, daemon.py describes the protocol.
+
+Only imported by daemon.py start, so the client doesn't import the transcriber.
+"""
+
+from parsing.html_to_js import transcribe_html, transcribe_string
+from concurrent.futures import ProcessPoolExecutor, Future
+from daemon_client import connect
+from cli import create_args_parser
+from typing import Optional, Union
+from pathlib import Path
+import socketserver
+import utilities
+import threading
+import logging
+import json
+import time
+import main
+import os
+
+_DEFAULT_CONFIG = {"BEHAVIOR": "return", "REPL_ID": [], "UN_REPL_ID": "", "ONLOAD": False, "PARAMS": None}
+
+
+def _error(error_type: str, message: str) -> dict:
+    return {"error": {"type": error_type, "message": message}}
+
+
+def _warm_up(_: int):
+    pass
+
+
+def _verify_inside(_file: Path, root: Path):
+    # Any process able to connect could otherwise make the daemon read and write files anywhere
+    if not _file.is_relative_to(root):
+        raise PermissionError(f"{_file} is outside of {root}, the directory served by the daemon")
+
+
+def _transcribe_path(_file: Path, config: dict, write: bool = True) -> dict:
+    options = utilities.get_options(config)
+    if not write:
+        return {"js": str(transcribe_html(_file, config, options))}
+
+    output = utilities.OutputFile(main.output_path(_file))
+    try:
+        transcribe_html(_file, config, options, output)
+    except BaseException:
+        output.discard()
+        raise
+
+    return {"output": str(output.file), "digest": output.commit()}
+
+
+def run_request(request: dict, root: Path) -> dict:
+    # Runs inside a worker process, paths must be inside root
+    try:
+        if "html" not in request and "path" not in request:
+            return _error("ValueError", "Requests need either html and name or a path")
+
+        name = f"[{request.get('name') or request.get('path')}]"
+        config = dict(_DEFAULT_CONFIG)
+        with main._collected_records():
+            # What would be logged about a config block with one file doesn't matter to the client
+            config.update(utilities.verify_config(dict({"BEHAVIOR": "return"}, **(request.get("config") or {})), name))
+        if "html" in request:
+            return {"js": transcribe_string(request["html"], request["name"], utilities.get_options(config), config)}
+
+        _file = Path(request["path"]).resolve()
+        _verify_inside(_file, root)
+        return _transcribe_path(_file, config, request.get("write", True))
+    except AssertionError:
+        return _error("AssertionError", "Specified file doesn't contain valid HTML data")
+    except (ValueError, ReferenceError, OSError, KeyError, TypeError) as e:
+        return _error(type(e).__name__, str(e))
+
+
+def find_files(argv: list[str], cwd: str, root: Path) -> dict:
+    # Runs inside a worker process, returns the files given by main.py arguments along with their config
+    # and the messages logged while reading them. The working directory is changed while reading them,
+    # so relative paths start at cwd, only the files found must be inside root
+    previous_cwd = os.getcwd()
+    try:
+        os.chdir(cwd)
+        with main._collected_records() as records:
+            arguments = create_args_parser().parse_args(argv)
+            if not arguments.config:
+                blocks = [utilities.args_to_config(arguments)]
+            elif len(arguments.file) != 1:
+                raise ValueError("Only one config file can be processed at a time")
+            else:
+                config_file = Path(arguments.file[0]).resolve()
+                _verify_inside(config_file, root)
+                blocks = utilities.parse_config(config_file)
+
+            files = []
+            for block in blocks:
+                if "WATCH" in block and block["WATCH"]:
+                    logging.warning(f"WATCH is ignored by the daemon in {block['NAME']}")
+                if "BUNDLE" in block:
+                    logging.warning(f"BUNDLE is ignored by the daemon in {block['NAME']}")
+                if "CACHE" in block and block["CACHE"]:
+                    logging.warning(f"CACHE is ignored by the daemon in {block['NAME']}, every file is transcribed")
+                if "JOBS" in block:
+                    logging.warning(f"JOBS is ignored by the daemon in {block['NAME']}, its workers are used instead")
+
+                for _f, config in main._file_configs(block, main.block_files(block)):
+                    _f = Path(_f).resolve()
+                    _verify_inside(_f, root)
+                    files.append((str(_f), config))
+
+        return {"files": files, "log": [[record.levelno, record.getMessage()] for record in records]}
+    except SystemExit:
+        return _error("ValueError", f"Invalid arguments {' '.join(argv)}")
+    except (ValueError, OSError, KeyError, TypeError) as e:
+        return _error(type(e).__name__, str(e))
+    finally:
+        os.chdir(previous_cwd)
+
+
+def transcribe_file(path: str, config: dict) -> dict:
+    # Runs inside a worker process, transcribes a file found by find_files
+    try:
+        return dict(_transcribe_path(Path(path), config), path=path)
+    except AssertionError:
+        return dict(_error("AssertionError", "Specified file doesn't contain valid HTML data"), path=path)
+    except (ValueError, ReferenceError, OSError, KeyError, TypeError) as e:
+        return dict(_error(type(e).__name__, str(e)), path=path)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self._write_lock = threading.Lock()
+        self._pending = threading.Condition()
+        self._running = 0
+
+    def _send(self, response: dict):
+        data = json.dumps(response).encode() + b"\n"
+        with self._write_lock:
+            try:
+                self.wfile.write(data)
+                self.wfile.flush()
+            except OSError:
+                pass  # The client went away
+
+    def _finish(self, request_id, response: dict):
+        response["id"] = request_id
+        self._send(response)
+        with self._pending:
+            self._running -= 1
+            self._pending.notify_all()
+
+    def _done(self, request_id, start_time: float, name: str, future: Future):
+        try:
+            response = future.result()
+        except Exception as e:  # A broken worker must not leave the client waiting
+            response = _error(type(e).__name__, str(e))
+
+        if "error" in response:
+            logging.info(f"Error produced in {name}")
+            logging.fatal(response["error"]["message"])
+        else:
+            logging.info(f"{name} processed in {(time.perf_counter() - start_time) * 1000: .0f} ms")
+
+        self._finish(request_id, response)
+
+    def _run(self, request_id, request: dict):
+        # Waits for the workers in its own thread, files are found by a worker since it changes its
+        # working directory, then they are transcribed in parallel
+        start_time = time.perf_counter()
+        executor = self.server.executor
+        try:
+            response = executor.submit(find_files, request["run"], request.get("cwd"), self.server.root).result()
+            if "error" not in response:
+                futures = [executor.submit(transcribe_file, path, config) for path, config in response["files"]]
+                response["files"] = [f.result() for f in futures]
+                logging.info(
+                    f"{len(futures)} files processed in {(time.perf_counter() - start_time) * 1000: .0f} ms"
+                )
+        except Exception as e:
+            response = _error(type(e).__name__, str(e))
+
+        self._finish(request_id, response)
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("Requests must be JSON objects")
+            except ValueError as e:
+                self._send({"id": None, **_error("ValueError", str(e))})
+                continue
+
+            request_id = request.get("id")
+            command = request.get("command")
+            if command == "ping":
+                self._send({"id": request_id, "version": utilities.VERSION})
+                continue
+            if command == "stop":
+                self._send({"id": request_id, "stopped": True})
+                threading.Thread(target=self.server.shutdown).start()
+                break
+            if command is not None:
+                self._send({"id": request_id, **_error("ValueError", f"Unknown command '{command}'")})
+                continue
+
+            with self._pending:
+                self._running += 1
+
+            if "run" in request:
+                threading.Thread(target=self._run, args=(request_id, request), daemon=True).start()
+                continue
+
+            name = request.get("name") or request.get("path") or "<unknown>"
+            future = self.server.executor.submit(run_request, request, self.server.root)
+            future.add_done_callback(
+                lambda f, i=request_id, t=time.perf_counter(), n=name: self._done(i, t, n, f)
+            )
+
+        # Keep the connection open until every response is sent
+        with self._pending:
+            self._pending.wait_for(lambda: self._running == 0)
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(address: Union[str, int], jobs: Optional[int] = None, root: Path = Path(".")):
+    # Serves requests until a stop command is received, files outside root can't be read or written
+    jobs = jobs or os.cpu_count() or 1
+    if isinstance(address, int):
+        server = _TCPServer(("127.0.0.1", address), _RequestHandler)
+    else:
+        address = Path(address)
+        address.parent.mkdir(parents=True, exist_ok=True)
+        if address.exists():
+            try:
+                with connect(address):
+                    raise ValueError(f"A daemon is already listening on {address}")
+            except OSError:
+                address.unlink()  # Left behind by a daemon that didn't stop cleanly
+
+        server = _UnixServer(str(address), _RequestHandler)
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=main._init_worker) as executor:
+        # Start every worker now, so the first requests don't pay for it
+        list(executor.map(_warm_up, range(jobs)))
+        server.executor = executor
+        server.root = root.resolve()
+        logging.info(f"Listening on {address} with {jobs} workers, serving {server.root}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if isinstance(address, Path):
+                address.unlink(missing_ok=True)
+
+    logging.info("Daemon stopped")
@@ -1,26 +1,91 @@
-from parsing.html_to_js import transcribe_html
-from typing import Optional
+from parsing.html_to_js import transcribe_html, component_name, Subtrees, CONFIG_PROPERTIES
+from tools.bundle import Bundle, BundledComponent, share_subtrees
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Optional, Iterator, Iterable, Callable
+from tools.profiling import Profile, summarize
+from tools.cache import BuildCache, MANIFESTS_MAX_BYTES, project_manifest
+from tools.watch import WatchService
+from contextlib import contextmanager
+from cli import create_args_parser
 from pathlib import Path
 import utilities
+import collections
 import threading
-import argparse
+import itertools
+import cProfile
 import logging
+import json
 import time
 
 
-_lock = threading.Lock()
-_observers = []
+_watch_service = WatchService()
+_watch_pools: list[ProcessPoolExecutor] = []
 
+# Per-file profiles, only collected with --profile
+_profiles: Optional[list[dict]] = None
+_profiler: Optional[cProfile.Profile] = None
 
-def process_html(_file: Path, config: Optional[dict] = None):
+
+def output_path(_file: Path) -> Path:
+    js_name = _file.name.replace(_file.suffix, ".js") if _file.suffix else f"{_file.name}.js"
+    return _file.with_name(js_name)
+
+
+def process_html(
+        _file: Path, config: Optional[dict] = None, is_current: Optional[Callable[[], bool]] = None,
+        profile: Optional[Profile] = None
+) -> Optional[str]:
+    # Returns the SHA-256 of the generated script or None if the file couldn't be transcribed.
+    # If is_current returns False once transcribed, the result is outdated and discarded
+    start_time = time.time()
+    output = _transcribe_output(_file, config, profile)
+    if output is None:
+        return None
+
+    return _commit_output(_file, output, start_time, is_current, profile)
+
+
+def _transcribe_output(
+        _file: Path, config: Optional[dict] = None, profile: Optional[Profile] = None
+) -> Optional[utilities.OutputFile]:
+    # Returns the closed output of _file, not committed yet, or None if the file couldn't be transcribed
+    options = utilities.get_options(config if config is not None else {})
+    output = None
     try:
-        start_time = time.time()
+        output = utilities.OutputFile(output_path(_file))
+        transcribe_html(_file, config, options, output, profile)
+        output.close()
+        return output
+    except (ValueError, ReferenceError, AssertionError, OSError) as e:
+        if output is not None:
+            output.discard()
+        _log_error(_file, e, options)
+        # raise  # debug
+    except BaseException:
+        if output is not None:
+            output.discard()
+        raise
+
+    return None
+
 
-        js_name = _file.name.replace(_file.suffix, ".js") if _file.suffix else f"{_file.name}.js"
-        js = transcribe_html(_file, config)
-        js.minify = utilities.MINIFY_CODE
-        with open(_file.with_name(js_name), "w") as f:
-            f.write(str(js))
+def _commit_output(
+        _file: Path, output: utilities.OutputFile, start_time: float, is_current: Optional[Callable[[], bool]] = None,
+        profile: Optional[Profile] = None
+) -> Optional[str]:
+    try:
+        if is_current is not None and not is_current():
+            logging.info(f"{_file.name} changed while being processed, discarding result")
+            return None
+
+        if profile is None:
+            output_digest = output.commit()
+        else:
+            with profile.stage("write"):
+                output_digest = output.commit()
+            profile.count("output_bytes", output.size)
+            profile.transcribed = True
+        output = None
 
         end_time = time.time()
         elapsed_time = end_time - start_time
@@ -28,104 +93,463 @@ def process_html(_file: Path, config: Optional[dict] = None):
             logging.info(f"{_file.name} processed in {elapsed_time: .2f} seconds")
         else:
             logging.info(f"{_file.name} processed in {elapsed_time * 1000: .0f} ms")
-    except ValueError as e:
-        logging.info("Error produced in " + str(_file.resolve()))
-        logging.fatal(e.__str__())
-        # raise  # debug
-    except ReferenceError as e:
-        logging.info("Error produced in " + str(_file.resolve()))
-        if utilities.IGNORE_MISMATCHING_CLOSING_TAGS:
-            logging.warning("This error might be caused by IGNORE_MISMATCHING_CLOSING_TAGS")
+
+        return output_digest
+    except OSError as e:
+        logging.info("Error produced in " + str(_file))
         logging.fatal(e.__str__())
-        # raise  # debug
-    except AssertionError:
-        logging.info("Error produced in " + str(_file.resolve()))
+    finally:
+        if output is not None:
+            output.discard()
+
+    return None
+
+
+def _log_error(_file: Path, error: Exception, options: utilities.Options):
+    if isinstance(error, OSError):
+        logging.info("Error produced in " + str(_file))
+        logging.fatal(error.__str__())
+        return
+
+    logging.info("Error produced in " + str(_file.resolve()))
+    if isinstance(error, AssertionError):
         logging.fatal("Specified file doesn't contain valid HTML data")
-        # raise  # debug
+        return
+
+    if isinstance(error, ReferenceError) and options.ignore_mismatching_closing_tags:
+        logging.warning("This error might be caused by IGNORE_MISMATCHING_CLOSING_TAGS")
+    logging.fatal(error.__str__())
+
+
+def bundle_component(
+        _file: Path, config: dict, shared: Optional[dict[int, str]] = None
+) -> Optional[BundledComponent]:
+    # Transcribes a file to be added to a bundle, returns None if it couldn't be transcribed.
+    # shared holds the shared function that creates each element id, if any
+    options = utilities.get_options(config)
+    try:
+        start_time = time.time()
+        helpers = set()
+        code = str(transcribe_html(_file, config, options, helpers=helpers, shared=shared))
+        logging.info(f"{_file.name} processed in {(time.time() - start_time) * 1000: .0f} ms")
+        return BundledComponent(
+            component_name(_file.name), code, frozenset(helpers), frozenset(shared.values() if shared else ())
+        )
+    except (ValueError, ReferenceError, AssertionError, OSError) as e:
+        _log_error(_file, e, options)
+
+    return None
+
+
+def find_subtrees(_file: Path, config: dict) -> Optional[Subtrees]:
+    # Finds the subtrees of a file that could be shared with other components,
+    # returns None if it couldn't be transcribed
+    options = utilities.get_options(config)
+    try:
+        subtrees = Subtrees()
+        transcribe_html(_file, config, options._replace(minify_code=False), helpers=set(), subtrees=subtrees)
+        return subtrees
+    except (ValueError, ReferenceError, AssertionError, OSError) as e:
+        _log_error(_file, e, options)
+
+    return None
+
+
+def _file_config(block: dict, index: int) -> dict:
+    # Pairs a file with its own REPL_ID and PARAMS, the same way
+    # rotating both lists after each file does
+    config = dict(block)
+    for prop in ["REPL_ID", "PARAMS"]:
+        if prop in block:
+            config[prop] = [block[prop][index % len(block[prop])]]
+    return config
+
+
+def _file_configs(block: dict, files: list[Path]) -> Iterator[tuple[Path, dict]]:
+    for i, _f in enumerate(files):
+        yield _f, _file_config(block, i)
+
+
+class _RecordCollector(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records: list[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.records.append(record)
+
+
+def _init_worker():
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.setLevel(logging.INFO)
+
+
+@contextmanager
+def _collected_records() -> Iterator[list[logging.LogRecord]]:
+    # Inside worker processes, logs are sent back to be handled in order
+    collector = _RecordCollector()
+    root = logging.getLogger()
+    root.addHandler(collector)
+    try:
+        yield collector.records
+    finally:
+        root.removeHandler(collector)
+
+
+def _process_html_job(
+        _file: Path, config: dict, profiling: bool = False
+) -> tuple[list[logging.LogRecord], Optional[str], Optional[dict]]:
+    profile = Profile(str(_file)) if profiling else None
+    with _collected_records() as records:
+        output_digest = process_html(_file, config, profile=profile)
 
+    return records, output_digest, profile.to_dict() if profile is not None else None
 
-def watch_files(block: dict):
-    global _lock
 
-    from watchdog.events import DirModifiedEvent, FileModifiedEvent
-    from watchdog.events import DirCreatedEvent, FileCreatedEvent
-    from watchdog.events import FileSystemEventHandler
-    from watchdog.observers import Observer
+def _transcribe_job(
+        _file: Path, config: dict, profiling: bool = False
+) -> tuple[list[logging.LogRecord], float, Optional[utilities.OutputFile], Optional[Profile]]:
+    # process_html without committing the output, the caller commits it unless it's outdated
+    start_time = time.time()
+    profile = Profile(str(_file)) if profiling else None
+    with _collected_records() as records:
+        output = _transcribe_output(_file, config, profile)
 
+    return records, start_time, output, profile
+
+
+def _bundle_job(function: Callable, *arguments) -> tuple[list[logging.LogRecord], object]:
+    with _collected_records() as records:
+        result = function(*arguments)
+
+    return records, result
+
+
+def _bundle_jobs(jobs: int, function: Callable, arguments: list[tuple]) -> list:
+    # Calls function with every tuple of arguments, inside worker processes if there are several jobs
+    if jobs == 1 or len(arguments) < 2:
+        return [function(*a) for a in arguments]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as executor:
+        for records, result in executor.map(_bundle_job, itertools.repeat(function), *zip(*arguments)):
+            for record in records:
+                logging.getLogger(record.name).handle(record)
+            results.append(result)
+
+    return results
+
+
+def _profiled_html(
+        _file: Path, config: dict, is_current: Optional[Callable[[], bool]] = None
+) -> Optional[str]:
+    # process_html that adds the profile of _file to the summary when profiling
+    if _profiles is None:
+        return process_html(_file, config, is_current)
+
+    profile = Profile(str(_file))
+    output_digest = process_html(_file, config, is_current, profile)
+    _profiles.append(profile.to_dict())
+    return output_digest
+
+
+def _options_key(config: dict) -> str:
+    properties = {prop: config[prop] for prop in CONFIG_PROPERTIES if prop in config}
+    return json.dumps([properties, utilities.get_options(config)], default=str, sort_keys=True)
+
+
+def _check_cache(cache: BuildCache, _file: Path, config: dict) -> Optional[dict]:
+    try:
+        return cache.check(_file, output_path(_file), _options_key(config))
+    except OSError:
+        # Let process_html report the problem without storing anything
+        return {}
+
+
+def _store_cache(cache: BuildCache, _file: Path, pending: dict, output_digest: Optional[str]):
+    if output_digest is not None and pending:
+        cache.store(_file, pending, output_path(_file), output_digest)
+
+
+def _finish_job(cache: Optional[BuildCache], _file: Path, pending: dict, future: Future):
+    records, output_digest, profile = future.result()
+    for record in records:
+        logging.getLogger(record.name).handle(record)
+    if profile is not None:
+        _profiles.append(profile)
+    if cache is not None:
+        _store_cache(cache, _file, pending, output_digest)
+
+
+def process_files(block: dict, files: Iterable[Path], cache: Optional[BuildCache] = None):
+    # Files are transcribed as they're given, so a directory can be processed while it's being searched
+    total = 0
+    skipped = 0
+
+    def outdated() -> Iterator[tuple[Path, dict, Optional[dict]]]:
+        nonlocal total, skipped
+        for _file, _config in _file_configs(block, files):
+            total += 1
+            _pending = _check_cache(cache, _file, _config) if cache is not None else {}
+            if _pending is None:
+                skipped += 1
+                continue
+            yield _file, _config, _pending
+
+    jobs = block["JOBS"] if "JOBS" in block else 1
+    file_configs = outdated()
+    first = list(itertools.islice(file_configs, 2))
+    if jobs == 1 or len(first) < 2:
+        for _f, config, pending in itertools.chain(first, file_configs):
+            output_digest = _profiled_html(_f, config)
+            if cache is not None:
+                _store_cache(cache, _f, pending, output_digest)
+    else:
+        profiling = _profiles is not None
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as executor:
+            # Logs are handled in the same order files were found
+            running = collections.deque()
+            for _f, config, pending in itertools.chain(first, file_configs):
+                running.append((_f, pending, executor.submit(_process_html_job, _f, config, profiling)))
+                while running and running[0][2].done():
+                    _finish_job(cache, *running.popleft())
+
+            while running:
+                _finish_job(cache, *running.popleft())
+
+    if skipped:
+        logging.info(f"{skipped} of {total} files are up-to-date in {block['NAME']}")
+
+    if cache is not None:
+        cache.save()
+
+
+def block_files(block: dict) -> Iterable[Path]:
+    # FILE or the HTML files found inside PATH when FILE = *
+    if block["FILE"] != "*":
+        return block["FILE"]
+
+    return utilities.iter_html_files(block["PATH"], block["EXCLUDE"] if "EXCLUDE" in block else None)
+
+
+def process_bundle(block: dict, file_configs: Iterable[tuple[Path, dict]], bundle: Optional[Bundle] = None) -> Bundle:
+    # Transcribes files into the bundle of the block, then writes it.
+    # Files that can't be transcribed keep their previous version in the bundle.
+    # With SHARED_SUBTREES, subtrees repeated in file_configs are created by shared functions
+    if bundle is None:
+        bundle = Bundle(block["BUNDLE"], utilities.get_options(block).minify_code)
+
+    jobs = block["JOBS"] if "JOBS" in block else 1
+    file_configs = list(file_configs)
+    shared = {}
+    if "SHARED_SUBTREES" in block and block["SHARED_SUBTREES"]:
+        found = _bundle_jobs(jobs, find_subtrees, file_configs)
+        subtrees = {_f: s for (_f, _), s in zip(file_configs, found) if s is not None}
+        file_configs = [(_f, config) for _f, config in file_configs if _f in subtrees]
+
+        reserved = [component_name(_f.name) for _f, _ in file_configs] + [c.name for c in bundle.components.values()]
+        shared, functions = share_subtrees(subtrees, utilities.get_options(block), reserved)
+        bundle.shared_functions.update(functions)
+        if functions:
+            logging.info(f"{len(functions)} subtrees shared between components of {bundle.output.name}")
+
+    components = _bundle_jobs(jobs, bundle_component, [(_f, config, shared.get(_f)) for _f, config in file_configs])
+    for (_f, _), component in zip(file_configs, components):
+        if component is None:
+            continue
+        try:
+            bundle.add(_f, component)
+        except ValueError as e:
+            logging.info("Error produced in " + str(_f))
+            logging.fatal(e.__str__())
+
+    if not bundle.components:
+        return bundle
+
+    try:
+        bundle.write()
+        logging.info(f"{len(bundle.components)} components bundled into {bundle.output}")
+        if "BUNDLE_REPORT" in block and block["BUNDLE_REPORT"]:
+            report = bundle.output.with_suffix(".report.json")
+            with open(report, "w") as f:
+                json.dump(bundle.report(), f, indent=2)
+    except OSError as e:
+        logging.info("Error produced in " + str(bundle.output))
+        logging.fatal(e.__str__())
+
+    return bundle
+
+
+def watch_files(block: dict, cache: Optional[BuildCache] = None):
+    # Observing starts once wait_observers runs the watch service, the initial build runs meanwhile
     files = block["FILE"]
     any_file = files and files[0] == "*"
+    ignore_rules = utilities.IgnoreRules.for_directory(block["PATH"], block["EXCLUDE"] if "EXCLUDE" in block else None)
+    jobs = block["JOBS"] if "JOBS" in block else 1
+
+    any_file_config = _file_config(block, 0)
+    file_configs = {} if any_file else {_f: _file_config(block, i) for i, _f in enumerate(files)}
 
-    _lock.acquire()
-    utilities.update_properties(block)
-    for f in files if not any_file else utilities.list_html_files(block["PATH"]):
-        process_html(f, block)
-        if "REPL_ID" in block:
-            block["REPL_ID"].append(block["REPL_ID"].pop(0))
-        if "PARAMS" in block:
-            block["PARAMS"].append(block["PARAMS"].pop(0))
-    _lock.release()
-
-    def process(src_path: str):
-        _lock.acquire()
-        utilities.update_properties(block)
+    def excluded(src_path: str) -> bool:
+        try:
+            return ignore_rules.ignored_path(Path(src_path).relative_to(block["PATH"]))
+        except ValueError:
+            return False
+
+    def accepts(src_path: str) -> Optional[Path]:
         _f = Path(src_path).resolve()
-        if _f.suffix == ".html" and (any_file or _f in block["FILE"]):
-            if not any_file:
-                f_index = block["FILE"].index(_f)
-                block["FILE"].insert(0, block["FILE"].pop(f_index))
-                if "REPL_ID" in block:
-                    block["REPL_ID"].insert(0, block["REPL_ID"].pop(f_index))
-                if "PARAMS" in block:
-                    block["PARAMS"].insert(0, block["PARAMS"].pop(f_index))
-
-            process_html(_f, block)
-        _lock.release()
-
-    class TranscriptEventHandler(FileSystemEventHandler):
-        def on_modified(self, event: DirModifiedEvent | FileModifiedEvent):
-            if event.is_directory:
-                return
-            process(event.src_path)
+        if _f.suffix.lower() != ".html":
+            return None
 
-        def on_created(self, event: DirCreatedEvent | FileCreatedEvent):
-            if event.is_directory:
-                return
-            process(event.src_path)
+        if any_file and not excluded(src_path) or _f in file_configs:
+            return _f
+        return None
+
+    watcher = (
+        block["WATCHER"] if "WATCHER" in block else utilities.WATCHER,
+        (block["POLL_INTERVAL"] if "POLL_INTERVAL" in block else utilities.POLL_INTERVAL) / 1000,
+        ignore_rules
+    )
+
+    def file_config(_f: Path) -> dict:
+        return any_file_config if any_file else file_configs[_f]
 
-    event_handler = TranscriptEventHandler()
-    observer = Observer()
-    observer.schedule(event_handler, block["PATH"], recursive=True)
-    _observers.append(observer)
-    observer.start()
+    if "BUNDLE" in block:
+        bundle = Bundle(block["BUNDLE"], utilities.get_options(block).minify_code)
+        bundle_lock = threading.Lock()
+
+        def build_bundle(_: Callable[[Path], bool]):
+            with bundle_lock:
+                process_bundle(block, _file_configs(block, block_files(block)), bundle)
+
+        def process_bundled(_f: Path, _: Callable[[], bool]):
+            with bundle_lock:
+                if "SHARED_SUBTREES" in block and block["SHARED_SUBTREES"]:
+                    # Shared subtrees are found among every file of the block
+                    process_bundle(block, _file_configs(block, block_files(block)), bundle)
+                else:
+                    process_bundle(block, [(_f, file_config(_f))], bundle)
+
+        _watch_service.watch(
+            block["PATH"], accepts, process_bundled, build_bundle, None, _watch_delay(block), 1, *watcher
+        )
+        return
+
+    pool = None
+    if jobs > 1:
+        pool = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker)
+        _watch_pools.append(pool)
+
+    counts_lock = threading.Lock()
+    counts = {"total": 0, "skipped": 0, "building": True}
+
+    def process(_f: Path, is_current: Callable[[], bool]):
+        config = file_config(_f)
+        pending = {}
+        if cache is not None:
+            pending = _check_cache(cache, _f, config)
+            with counts_lock:
+                counts["total"] += 1
+                counts["skipped"] += pending is None
+            if pending is None:
+                return
 
+        if pool is None:
+            output_digest = _profiled_html(_f, config, is_current)
+        else:
+            # The worker doesn't commit the output, so it's discarded here if the file changed meanwhile
+            records, start_time, output, profile = pool.submit(
+                _transcribe_job, _f, config, _profiles is not None
+            ).result()
+            for record in records:
+                logging.getLogger(record.name).handle(record)
+            output_digest = None
+            if output is not None:
+                output_digest = _commit_output(_f, output, start_time, is_current, profile)
+            if profile is not None:
+                _profiles.append(profile.to_dict())
+
+        if cache is not None:
+            _store_cache(cache, _f, pending, output_digest)
+
+        if cache is not None and not counts["building"]:
+            cache.save()
+
+    def build(submit: Callable[[Path], bool]):
+        for _f in block_files(block):
+            if not submit(Path(_f).resolve()):
+                break
+
+    def built():
+        with counts_lock:
+            counts["building"] = False
+            if counts["skipped"]:
+                logging.info(f"{counts['skipped']} of {counts['total']} files are up-to-date in {block['NAME']}")
+        if cache is not None:
+            cache.save()
+
+    _watch_service.watch(block["PATH"], accepts, process, build, built, _watch_delay(block), jobs, *watcher)
+
+
+def _watch_delay(block: dict) -> float:
+    # Seconds to wait for more changes before transcribing a watched file
+    return (block["WATCH_DELAY"] if "WATCH_DELAY" in block else utilities.WATCH_DELAY) / 1000
+
+
+def process_config_block(block: dict, cache: Optional[BuildCache] = None):
+    if "CACHE" not in block or not block["CACHE"]:
+        cache = None
+
+    if _profiler is not None and "JOBS" in block and block["JOBS"] > 1:
+        # cProfile only sees the current process, the stats would mostly be the time spent waiting for workers
+        logging.warning(f"JOBS = {block['JOBS']} is ignored with --pstats in {block['NAME']}, using one job")
+        block = dict(block, JOBS=1)
 
-def process_config_block(block: dict):
     if "WATCH" in block and block["WATCH"]:
-        watch_files(block)
+        watch_files(block, cache)
         return
 
-    utilities.update_properties(block)
-    files = block["FILE"] if block["FILE"] != "*" else utilities.list_html_files(block["PATH"])
+    if "BUNDLE" in block:
+        process_bundle(block, _file_configs(block, block_files(block)))
+        return
 
-    for _f in files:
-        process_html(_f, block)
-        if "REPL_ID" in block:
-            block["REPL_ID"].append(block["REPL_ID"].pop(0))
-        if "PARAMS" in block:
-            block["PARAMS"].append(block["PARAMS"].pop(0))
+    process_files(block, block_files(block), cache)
 
 
 def wait_observers():
-    global _observers
-    if _observers:
-        try:
-            for obs in _observers:
-                obs.join()
-        except KeyboardInterrupt:
-            pass
-        finally:
-            for obs in _observers:
-                obs.stop()
+    # Runs the watch service until interrupted, then waits for running jobs
+    if not _watch_service.watching:
+        return
+
+    try:
+        _watch_service.run()
+    finally:
+        for pool in _watch_pools:
+            pool.shutdown()
+
+
+def start_profiling(stages: bool, use_cprofile: bool):
+    global _profiles, _profiler
+    if stages:
+        _profiles = []
+    if use_cprofile:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def stop_profiling(summary: Optional[Path], pstats: Optional[Path]):
+    # Writes the JSON summary of the collected profiles and the cProfile stats
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(pstats)
+        logging.info(f"cProfile stats written to {pstats}")
+
+    if _profiles is not None:
+        with open(summary, "w") as f:
+            json.dump(summarize(_profiles), f, indent=2)
+        logging.info(f"Profile of {len(_profiles)} files written to {summary}")
 
 
 def process_config(_file: Path):
@@ -137,8 +561,9 @@ def process_config(_file: Path):
         # raise  # debug
         return
 
+    cache = BuildCache(_file.with_name(f".{_file.name}.pywstcache"), utilities.VERSION)
     for block in config_data:
-        process_config_block(block)
+        process_config_block(block, cache)
 
     wait_observers()
 
@@ -148,28 +573,11 @@ if __name__ == "__main__":
         level=logging.INFO, format="%(asctime)s %(module)s:%(levelname)s: %(message)s", datefmt="%d %b %H:%M:%S"
     )
 
-    args_parser = argparse.ArgumentParser(prog="main.py", description="Python HTML to JS transcriptor")
-    bool_choices = ["yes", "no"]
-
-    args_parser.add_argument("-c", "--config", action="store_true", help="Specifies that a file is a config file")
-    args_parser.add_argument("-f", "--file", action="append", required=True,
-                             help="Specify a config, directory or HTML file path")
-    args_parser.add_argument("-b", "--behavior", default="ret",
-                             help="What the script does, return or replace HTMLElements")
-    args_parser.add_argument("-id", "--idrepl", action="append", help="Replacement ID")
-    args_parser.add_argument("-uid", "--uidrepl", help="Replacement ID for all components")
-    args_parser.add_argument("-p", "--params", help="Parameters used inside the HTML")
-    args_parser.add_argument("-o", "--onload", choices=bool_choices, help="Whether the script should run onload")
-    args_parser.add_argument("-w", "--watch", choices=bool_choices,
-                             help="Whether PyWST should watch for filesystem changes")
-    args_parser.add_argument("-m", "--minify", choices=bool_choices,
-                             help="Whether PyWST should minify generated scripts")
-    args_parser.add_argument("--ictag", choices=bool_choices,
-                             help="Whether PyWST should ignore invalid characters inside closing tags")
-    args_parser.add_argument("--mctag", choices=bool_choices,
-                             help="Whether PyWST should ignore mismatching closing tags")
-    args_parser.add_argument("--entdec", choices=bool_choices,
-                             help="Whether PyWST should add a function to decode HTML entities")
+    args_parser = create_args_parser()
+    args_parser.add_argument("--profile", type=Path,
+                             help="Write the time spent in every stage for each file to a JSON file")
+    args_parser.add_argument("--pstats", type=Path,
+                             help="Run PyWST inside cProfile and write the stats to a .pstats file")
 
     arguments = args_parser.parse_args()
 
@@ -189,7 +597,9 @@ if __name__ == "__main__":
             logging.fatal("Specified path is not a config file")
             exit(1)
 
+        start_profiling(arguments.profile is not None, arguments.pstats is not None)
         process_config(file)
+        stop_profiling(arguments.profile, arguments.pstats)
         exit(0)
 
     try:
@@ -200,5 +610,10 @@ if __name__ == "__main__":
         # raise  # debug
         exit(1)
 
-    process_config_block(config_args)
+    cli_cache = BuildCache(
+        project_manifest(config_args["PATH"]), utilities.VERSION, max_directory_bytes=MANIFESTS_MAX_BYTES
+    )
+    start_profiling(arguments.profile is not None, arguments.pstats is not None)
+    process_config_block(config_args, cli_cache)
     wait_observers()
+    stop_profiling(arguments.profile, arguments.pstats)
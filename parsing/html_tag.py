@@ -1,173 +1,207 @@
-from parsing.html_tokenize import HTMLToken, HTMLTokenType
+from parsing.html_tokenize import HTMLToken, HTMLTokenType, Tag
 from utilities import *
-from enum import Enum
+import sys
 
 
-class TagInfo(Enum):
-    TAG_NAME = 0
-    ATTRIBUTE_NAME = 1
-    ATTRIBUTE = 2
+_OPENING_QUOTES = frozenset(['"', "'", '{'])
+# Characters that can't be part of unquoted values
+_QUOTES = _OPENING_QUOTES | {'}'}
 
 
-class TagToken:
-    def __init__(self, data_type: TagInfo, value: str):
-        self.data_type: TagInfo = data_type
-        self.value: str = value
+def _attribute(lexeme: str) -> tuple[str, str]:
+    equal_position = lexeme.index("=")
+    return sys.intern(lexeme[:equal_position]), lexeme[equal_position + 1:]
 
-    def __str__(self):
-        return "<" f"{self.data_type}, {self.value}" ">"
 
+class TagTokenizer:
+    def __init__(self):
+        self.state = 0
+        self.quote = None
+        # Problems are recorded here instead of raised when given
+        self.diagnostics: Optional[list[Diagnostic]] = None
+        self._line = -1
 
-_state = 0
-_quote = None
+    def reset(self):
+        self.state = 0
+        self.quote = None
 
-
-def _generate_tokens(data: str) -> list[TagToken]:
-    global _state, _quote
-
-    generated_tokens: list[TagToken] = []
-
-    lexeme = ""
-    i = 0
-    while i < len(data):
-        c = data[i]
-        i += 1
-
-        if _state == 0:
-            if c == '<':
-                lexeme += c
-                _state = 1
-            elif c.isalpha():
-                lexeme += c
-                _state = 4
-            elif c == '/':
-                _state = 14
-            elif c != ' ' and c != '>':
-                raise_error(data, c, i)
-
-        elif _state == 1:
-            if c.isalpha():
-                lexeme += c
-                _state = 2
-            else:
-                raise_error(data, c, i)
-
-        elif _state == 2:
-            if c == ' ' or c == '>':
-                generated_tokens.append(TagToken(TagInfo.TAG_NAME, lexeme[1:]))
-                lexeme = ""
-                _state = 0
-            elif c == '-' or c.isalnum():
-                lexeme += c
-            elif c == '/':
-                _state = 12
-            else:
-                raise_error(data, c, i)
-
-        elif _state == 4:
-            if c == '>':
-                generated_tokens.append(TagToken(TagInfo.ATTRIBUTE_NAME, lexeme))
-                lexeme = ""
-                _state = 0
-            elif c == '=':
-                lexeme += c
-                _state = 8
-            elif c == ' ':
-                _state = 9
-            elif c == '-' or c == ':' or c.isalnum():
-                lexeme += c
-            elif c == '/':
-                _state = 13
-            else:
-                raise_error(data, c, i)
-
-        elif _state == 6:
-            lexeme += c
-            if c == _quote != '{' or _quote == '{' and c == '}':
-                generated_tokens.append(TagToken(TagInfo.ATTRIBUTE, lexeme))
-                lexeme = ""
-                _state = 0
-
-        elif _state == 8:
-            if c in ['"', "'", '{']:
-                lexeme += c
-                _state = 6
-                _quote = c
-            elif c == '=':
-                raise_error(data, c, i)
-            elif c != ' ':
-                lexeme += c
-                _state = 10
-
-        elif _state == 9:
-            if c == '=':
+    def _raise_error(self, data: str, c: str, i: int):
+        # When collecting diagnostics the error is recorded and the caller recovers
+        if self.diagnostics is None:
+            raise_error(data, c, i)
+        self.diagnostics.append(Diagnostic(self._line, i, format_error(data, c, i, self._line)))
+
+    def _generate_tag(self, data: str) -> Tag:
+        # Character by character split of tags the tokenizer left as text
+        name = ""
+        attributes = []
+        self_closing = False
+
+        lexeme = ""
+        i = 0
+        while i < len(data):
+            c = data[i]
+            i += 1
+
+            if self.state == 0:
+                if c == '<':
+                    lexeme += c
+                    self.state = 1
+                elif c.isalpha():
+                    lexeme += c
+                    self.state = 4
+                elif c == '/':
+                    self.state = 14
+                elif c != ' ' and c != '>':
+                    self._raise_error(data, c, i)  # Skipped
+
+            elif self.state == 1:
+                if c.isalpha():
+                    lexeme += c
+                    self.state = 2
+                else:
+                    self._raise_error(data, c, i)
+                    lexeme = ""
+                    self.state = 0
+
+            elif self.state == 2:
+                if c == ' ' or c == '>':
+                    name = sys.intern(lexeme[1:].lower())
+                    lexeme = ""
+                    self.state = 0
+                elif c == '-' or c.isalnum():
+                    lexeme += c
+                elif c == '/':
+                    self.state = 12
+                else:
+                    self._raise_error(data, c, i)
+                    name = sys.intern(lexeme[1:].lower())
+                    lexeme = ""
+                    self.state = 0
+
+            elif self.state == 4:
+                if c == '>':
+                    attributes.append((sys.intern(lexeme), None))
+                    lexeme = ""
+                    self.state = 0
+                elif c == '=':
+                    lexeme += c
+                    self.state = 8
+                elif c == ' ':
+                    self.state = 9
+                elif c == '-' or c == ':' or c.isalnum():
+                    lexeme += c
+                elif c == '/':
+                    self.state = 13
+                else:
+                    self._raise_error(data, c, i)
+                    attributes.append((sys.intern(lexeme), None))
+                    lexeme = ""
+                    self.state = 0
+
+            elif self.state == 6:
                 lexeme += c
-                _state = 8
-            elif c != ' ':
-                generated_tokens.append(TagToken(TagInfo.ATTRIBUTE_NAME, lexeme))
+                if c == self.quote != '{' or self.quote == '{' and c == '}':
+                    attributes.append(_attribute(lexeme))
+                    lexeme = ""
+                    self.state = 0
+
+            elif self.state == 8:
+                if c in _OPENING_QUOTES:
+                    lexeme += c
+                    self.state = 6
+                    self.quote = c
+                elif c == '=':
+                    self._raise_error(data, c, i)  # Skipped
+                elif c != ' ':
+                    lexeme += c
+                    self.state = 10
+
+            elif self.state == 9:
+                if c == '=':
+                    lexeme += c
+                    self.state = 8
+                elif c != ' ':
+                    attributes.append((sys.intern(lexeme), None))
+                    lexeme = ""
+                    self.state = 0
+                    i -= 1
+
+            elif self.state == 10:
+                if c == ' ' or c == '>':
+                    attributes.append(_attribute(lexeme))
+                    lexeme = ""
+                    self.state = 0
+                elif c not in _QUOTES:
+                    lexeme += c
+                else:
+                    self._raise_error(data, c, i)
+                    attributes.append(_attribute(lexeme))
+                    lexeme = ""
+                    self.state = 0
+
+            elif self.state == 12:
+                if c == '>':
+                    name = sys.intern(lexeme[1:].lower())
+                    self_closing = True
+                    lexeme = ""
+                    self.state = 0
+                    continue
+
+                self._raise_error(data, c, i)
+                name = sys.intern(lexeme[1:].lower())
                 lexeme = ""
-                _state = 0
+                self.state = 0
                 i -= 1
 
-        elif _state == 10:
-            if c == ' ' or c == '>':
-                generated_tokens.append(TagToken(TagInfo.ATTRIBUTE, lexeme))
-                lexeme = ""
-                _state = 0
-            elif c not in ['"', "'", '{', '}']:
-                lexeme += c
-            else:
-                raise_error(data, c, i)
+            elif self.state == 13:
+                if c == '>':
+                    attributes.append((sys.intern(lexeme), None))
+                    self_closing = True
+                    lexeme = ""
+                    self.state = 0
+                    continue
 
-        elif _state == 12:
-            if c == '>':
-                generated_tokens.append(TagToken(TagInfo.TAG_NAME, lexeme[1:]))
+                self._raise_error(data, c, i)
+                attributes.append((sys.intern(lexeme), None))
                 lexeme = ""
-                _state = 0
-                continue
-
-            raise_error(data, c, i)
-
-        elif _state == 13:
-            if c == '>':
-                generated_tokens.append(TagToken(TagInfo.ATTRIBUTE_NAME, lexeme))
-                lexeme = ""
-                _state = 0
-                continue
-
-            raise_error(data, c, i)
-
-        elif _state == 14:
-            if c == '>':
-                _state = 15
-                continue
-
-            raise_error(data, c, i)
-
-        elif _state == 15:
-            raise_error(data, c, i)
-
-    return generated_tokens
+                self.state = 0
+                i -= 1
 
+            elif self.state == 14:
+                if c == '>':
+                    self_closing = True
+                    self.state = 15
+                    continue
 
-def reset_html_tag_tokenize():
-    global _state, _quote
-    _state = 0
-    _quote = None
+                self._raise_error(data, c, i)
+                self.state = 0
+                i -= 1
 
+            elif self.state == 15:
+                self._raise_error(data, c, i)
+                self.state = 0
 
-def tokenize_html_token(token: HTMLToken) -> list[TagToken]:
-    global _state
+        return Tag(name, attributes, self_closing)
 
-    if token.token_type != HTMLTokenType.TAG:
-        return []
+    def tokenize_html_token(self, token: HTMLToken) -> Optional[Tag]:
+        # Sets the tag of a TAG token
+        if token.token_type != HTMLTokenType.TAG:
+            return None
 
-    tokens = _generate_tokens(token.lexeme)
+        if self.diagnostics is not None:
+            self._line = token.line
+        token.tag = self._generate_tag(token.lexeme)
 
-    if _state == 6:
-        raise ValueError(f"Unbalanced quote or curly brace in\n    {token.lexeme}")
+        if self.state == 6:
+            if self.diagnostics is None:
+                raise ValueError(f"Unbalanced quote or curly brace in\n    {token.lexeme}")
+            self.diagnostics.append(Diagnostic(
+                self._line, 0, f"Unbalanced quote or curly brace, line {self._line}\n    {token.lexeme}"
+            ))
+            self.state = 0
 
-    if _state == 15:
-        _state = 0
+        if self.state == 15:
+            self.state = 0
 
-    return tokens
+        return token.tag
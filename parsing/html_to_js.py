@@ -1,20 +1,33 @@
-from parsing.html_tokenize import HTMLTokenType, HTMLToken, tokenize_file, reset_html_tokenize
-from parsing.html_tag import tokenize_html_token, TagToken, TagInfo, reset_html_tag_tokenize
-from typing import Union, Optional
+from parsing.html_tokenize import HTMLTokenType, HTMLToken, Tag, create_tokenizer
+from parsing.html_tag import TagTokenizer
+from utilities import Options, Diagnostic, DiagnosticsError, read_file
+from typing import NamedTuple, Union, Optional, TextIO, Iterable, Iterator
+from tools.profiling import Profile, stage, staged
+from tools.minify import Minifier
 from tools.code import Code
 from pathlib import Path
-import utilities
+import itertools
+import hashlib
+import logging
+import html
+import io
 import re
 
-_id = 0
-_html_entity_detected = False
+# Block properties that change the generated code besides Options
+CONFIG_PROPERTIES = ["BEHAVIOR", "REPL_ID", "UN_REPL_ID", "ONLOAD", "PARAMS"]
 
 # From http://xahlee.info/js/html5_non-closing_tag.html
-SELF_CLOSING_TAGS = [
+SELF_CLOSING_TAGS = frozenset([
     "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"
-]
+])
 
-LISTENERS = [
+# Elements created in the SVG namespace
+SVG_TAGS = frozenset(["svg", "path"])
+
+# Elements whose text is used as written, HTML entities aren't decoded inside them
+RAW_TEXT_TAGS = frozenset(["script", "style"])
+
+LISTENERS = frozenset([
     "abort", "afterprint", "animationend", "animationiteration", "animationstart", "beforeprint", "beforeunload",
     "blur", "canplay", "canplaythrough", "change", "click", "contextmenu", "copy", "cut", "dblclick", "drag",
     "dragend", "dragenter", "dragleave", "dragover", "dragstart", "drop", "durationchange", "ended", "error", "focus",
@@ -25,301 +38,786 @@ LISTENERS = [
     "reset", "scroll", "search", "seeked", "seeking", "select", "show", "stalled", "storage", "submit", "suspend",
     "timeupdate", "toggle", "touchcancel", "touchend", "touchmove", "touchstart", "transitionend", "unload",
     "volumechange", "waiting", "wheel"
-]
-
-
-def _filter_data_tokens(tokens: list[HTMLToken]) -> list:
-    # Join all continuous DATA tokens and delete empty ones
-    i = 0
-    start = -1
-    data_token = None
-    while i < len(tokens):
-        t: HTMLToken = tokens[i]
-        if t.token_type != HTMLTokenType.DATA:
-            if start == -1:
-                t.lexeme = re.sub(r"\n+", " ", t.lexeme)
-                i += 1
-                continue
+])
 
-            data_token.lexeme = re.sub(r"^\n+", "", re.sub(r"\n+$", "", data_token.lexeme))
-            if data_token.lexeme:
-                tokens = tokens[:start + 1] + tokens[i:]
-                tokens[start] = data_token
-                i = start + 1
-            else:
-                tokens = tokens[:start] + tokens[i:]
-                i = start
 
-            start = -1
-            continue
+# Functions used by generated components, written after the component that uses them
+HELPERS = {
+    # From https://stackoverflow.com/questions/6155595/how-do-i-convert-an-html-entity-number-into-a-character
+    # -using-plain-javascript-o
+    "dec": [
+        "function dec(data) {", "const e = document.createElement('p');", "e.innerHTML = data;",
+        "return e.textContent;", "}"
+    ]
+}
+
+
+_NEWLINES = re.compile(r"\n+")
+
 
-        if start == -1:
-            data_token = t
-            start = i
-            i += 1
+def _merge_data_tokens(tokens: Iterable[HTMLToken]) -> Iterator[HTMLToken]:
+    # Joins all continuous DATA tokens and drops empty ones in a single pass
+    data_token: Optional[HTMLToken] = None
+    data: list[str] = []
+    for t in tokens:
+        if t.token_type == HTMLTokenType.DATA:
+            if data_token is None:
+                data_token = t
+                data.append(t.lexeme)
+            else:
+                data.append(t.lexeme.lstrip("\t"))
             continue
 
-        data_token.lexeme += re.sub(r"^\t+", "", t.lexeme)
-        i += 1
+        if data_token is not None:
+            data_token.lexeme = "".join(data).strip("\n")
+            if data_token.lexeme:
+                yield data_token
+            data_token = None
+            data = []
+
+        if "\n" in t.lexeme:
+            t.lexeme = _NEWLINES.sub(" ", t.lexeme)
+        yield t
 
-    return tokens
+    if data_token is not None:
+        data_token.lexeme = "".join(data).strip("\n")
+        if data_token.lexeme:
+            yield data_token
 
 
-def _tokenize_tags(tokens: list):
-    for i, token in enumerate(tokens):
-        token_data = tokenize_html_token(tokens[i])
-        if token_data:
-            tokens[i] = token_data
+_PYTHON_ESCAPE = re.compile(r"\\(\\|U([0-9a-f]{8}))")
 
 
-def _get_js_name() -> str:
-    global _id
-    n = f"e{_id}"
-    _id += 1
-    return n
+def js_string(value: str) -> str:
+    # repr of value written as a JS string literal, JS has no \U escape for characters above U+FFFF
+    return _PYTHON_ESCAPE.sub(lambda m: f"\\u{{{m[2].lstrip('0')}}}" if m[2] else m[0], repr(value))
 
 
 def create_js_element(name: str, tag: str, namespace_uri: Optional[str] = None) -> str:
     if namespace_uri is None:
         return f"const {name} = document.createElement('{tag}');"
-    return f"const {name} = document.createElementNS({repr(namespace_uri)}, '{tag}');"
+    return f"const {name} = document.createElementNS({js_string(namespace_uri)}, '{tag}');"
 
 
 def set_boolean_property(name: str, tag_property: str) -> str:
-    return f"{name}.setAttribute({repr(tag_property)}, true);"
+    return f"{name}.setAttribute({js_string(tag_property)}, true);"
 
 
-def set_property(name: str, tag_property: str, params: bool = False) -> str:
-    equal_position = tag_property.index("=")
-    prop, value = tag_property[:equal_position], tag_property[equal_position + 1:]
-    if value.startswith("{") or not value.startswith("'") and not value.startswith('"'):
-        value = repr(value)
+def _has_params(value: str, params: bool) -> bool:
+    return bool(params) and re.search(r"\${.*?}", value) is not None
 
-    if params and re.sub(r"\${.*?}", "", value) != value:
-        value = f"`{value[1:-1]}`"
 
-    if prop.startswith("on") and prop[2:] in LISTENERS:
-        if value.startswith('"'):
-            value = value[1:-1]
-        return f"{name}.addEventListener('{prop[2:]}', (evt) => {value});"
+_PARAM_EXPRESSION = re.compile(r"\${(.*?)}")
+_IDENTIFIER = re.compile(r"[A-Za-z_$][\w$]*")
 
-    return f"{name}.setAttribute({repr(prop)}, {value});"
+# Attributes and ${} expressions holding code written by the user
+_USER_CODE = re.compile(r"""\bon[a-z]+\s*=\s*(?:"[^"]*"|'[^']*'|[^\s>]+)|\${[^}]*}""", re.IGNORECASE)
 
 
-def tag_to_js(tag_data: list[TagToken], params: bool = False) -> tuple[str, str, list[str]]:
-    if not tag_data:
-        raise ValueError("tag_data cannot be empty")
+def _user_identifiers(data: Union[str, list[str]]) -> set[str]:
+    # Identifiers user code might refer to, found without tokenizing, so it may find more than there are
+    if not isinstance(data, str):
+        data = "".join(data)
 
-    declared = False
-    element_type = ""
-    name = _get_js_name()
-    js = []
+    names = set()
+    for code in _USER_CODE.findall(data):
+        names.update(_IDENTIFIER.findall(code))
+    return names
 
-    for d in tag_data:
-        if d.data_type == TagInfo.TAG_NAME:
-            if declared:  # This shouldn't happen if the input comes from translate_html
-                raise ValueError(f"Can't create duplicate constant {name}")
 
-            element_type = d.value.lower()
-            if element_type in ["svg", "path"]:
-                js.append(create_js_element(name, element_type, "http://www.w3.org/2000/svg"))
-            else:
-                js.append(create_js_element(name, element_type))
+def set_property(name: str, tag_property: str, value: str, params: bool = False) -> str:
+    if value.startswith("{") or not value.startswith("'") and not value.startswith('"'):
+        value = js_string(value)
 
-            declared = True
-        elif d.data_type == TagInfo.ATTRIBUTE_NAME:
-            js.append(set_boolean_property(name, d.value))
-        else:
-            js.append(set_property(name, d.value, params))
+    if _has_params(value, params):
+        value = f"`{value[1:-1]}`"
 
-    if not declared:
-        raise ValueError("A tag name is required")
+    if tag_property.startswith("on") and tag_property[2:] in LISTENERS:
+        if value.startswith('"'):
+            value = value[1:-1]
+        return f"{name}.addEventListener('{tag_property[2:]}', (evt) => {value});"
 
-    return name, element_type, js
+    return f"{name}.setAttribute({js_string(tag_property)}, {value});"
 
 
 def append_child(parent: str, child: str) -> str:
     return f"{parent}.appendChild({child});"
 
 
-def append_text(name: str, value: str, params: bool = False) -> str:
-    global _html_entity_detected
+class _TemplatePatches:
+    """
+    Lines that must run on every call of a component built from a template.
+
+    Keeps the position of every node inside the template, so patched elements
+    can be reached in the clone through childNodes.
+    """
+
+    def __init__(self, root: str):
+        self.lines: list[str] = []
+        self.positions: dict[str, tuple[str, int]] = {}
+        self.children: dict[str, int] = {}
+        self.defined: set[str] = {root}
+
+    def add_child(self, parent: str, child: Optional[str] = None) -> int:
+        index = self.children.get(parent, 0)
+        self.children[parent] = index + 1
+        if child is not None:
+            self.positions[child] = (parent, index)
+        return index
+
+    def reference(self, name: str) -> str:
+        if name not in self.defined:
+            parent, index = self.positions[name]
+            self.lines.append(f"const {name} = {self.reference(parent)}.childNodes[{index}];")
+            self.defined.add(name)
+        return name
+
+    def add(self, name: str, lines: list[str]):
+        if lines:
+            self.reference(name)
+            self.lines += lines
+
+
+class _Bindings:
+    """
+    Lines that set the attributes and text of a component that use parameters.
+
+    Lines are grouped by the parameters they use, so the update function of the
+    component only runs the lines that use the parameters it was given. Event listeners
+    read the parameters when they run, so they don't need lines of their own.
+    """
+
+    def __init__(self, params: list[str]):
+        self.params: list[str] = params
+        self.lines: dict[tuple[str, ...], list[str]] = {}
+
+    def uses(self, value: str) -> tuple[str, ...]:
+        # Parameters used inside the ${} of value
+        names = set()
+        for expression in _PARAM_EXPRESSION.findall(value):
+            names.update(_IDENTIFIER.findall(expression))
+        return tuple(p for p in self.params if p in names)
+
+    def add(self, used: tuple[str, ...], line: str):
+        if used:
+            self.lines.setdefault(used, []).append(line)
+
+    def update_function(self, base_element: str) -> list[str]:
+        # update takes an object with the parameters that changed, the others keep their last value.
+        # The parameters of the component are assigned again, so event listeners also use the new values
+        values = f"{base_element}_params"
+        changes = f"{base_element}_changes"
+        params = ", ".join(self.params)
+        lines = [
+            f"const {values} = " "{" f"{params}" "};", f"{base_element}.update = ({changes}) => " "{",
+            f"Object.assign({values}, {changes});", "({" f"{params}" "} = " f"{values});"
+        ]
+        for used, bound in self.lines.items():
+            lines.append(f"if ({' || '.join(f'{js_string(p)} in {changes}' for p in used)}) " "{")
+            lines += bound
+            lines.append("}")
+
+        lines.append("};")
+        return lines
+
+
+# Names defined inside generated functions, event listeners using them can't be shared
+_COMPONENT_NAMES = re.compile(r"e\d+(?:_params|_changes)?|myElementToRepl|htmlScripts|currentScript|__i")
+
+# Smallest subtree worth sharing, counting elements, attributes and text nodes
+SHARED_WEIGHT = 3
+
+
+def _shareable(tag: Tag, params: frozenset[str], template: bool) -> bool:
+    # Whether the code creating the element is the same in any component
+    for tag_property, value in tag.attributes:
+        if value is None:
+            continue
+        if "${" in value:
+            return False
+        if tag_property.startswith("on") and tag_property[2:] in LISTENERS:
+            if template:
+                return False
+            names = set(_IDENTIFIER.findall(value))
+            if names & params or any(_COMPONENT_NAMES.fullmatch(n) for n in names):
+                return False
+    return True
+
+
+class Subtree(NamedTuple):
+    # Children are digests of other subtrees or text nodes
+    tag: Tag
+    children: tuple[str, ...]
+
+
+class _OpenElement:
+    def __init__(self, element_id: int, tag: Tag, shareable: bool):
+        self.element_id: int = element_id
+        self.tag: Tag = tag
+        self.shareable: bool = shareable
+        self.weight: int = 1 + len(tag.attributes)
+        self.children: list[str] = []
+
+
+class Subtrees:
+    """
+    Subtrees of a component that could be created by a function shared with other components.
+
+    Subtrees are identified by a digest of their tags, attributes and text, only the ones whose code
+    is the same in any component are kept, so they can't use parameters and, in template mode,
+    event listeners. nodes holds every kept subtree and text node by digest.
+    """
+
+    def __init__(self):
+        # Element id, digest and weight of the subtrees big enough to be shared
+        self.found: list[tuple[int, str, int]] = []
+        self.parents: dict[int, Optional[int]] = {}
+        self.nodes: dict[str, Union[Subtree, str]] = {}
+        # Identifiers user code might refer to, shared functions can't be named after them
+        self.identifiers: set[str] = set()
+        self._open: list[_OpenElement] = []
+
+    def open(self, element_id: int, tag: Tag, shareable: bool):
+        self.parents[element_id] = self._open[-1].element_id if self._open else None
+        self._open.append(_OpenElement(element_id, tag, shareable))
+
+    def _add_child(self, digest: str, shareable: bool, weight: int):
+        if self._open:
+            parent = self._open[-1]
+            parent.shareable = parent.shareable and shareable
+            parent.weight += weight
+            parent.children.append(digest)
+
+    def text(self, value: str):
+        digest = hashlib.sha1(repr(("text", value)).encode()).hexdigest()
+        shareable = "${" not in value
+        if shareable:
+            self.nodes[digest] = value
+        self._add_child(digest, shareable, 1)
+
+    def close(self, depth: int):
+        # Finishes the elements opened deeper than depth
+        while len(self._open) > depth:
+            element = self._open.pop()
+            tag = element.tag
+            digest = hashlib.sha1(repr((tag.name, tag.attributes, element.children)).encode()).hexdigest()
+            if element.shareable:
+                self.nodes[digest] = Subtree(tag, tuple(element.children))
+                if element.weight >= SHARED_WEIGHT:
+                    self.found.append((element.element_id, digest, element.weight))
+            self._add_child(digest, element.shareable, element.weight)
+
+
+class Transcriber:
+    def __init__(self, options: Options = Options(), profile: Optional[Profile] = None):
+        self.options: Options = options
+        self.profile: Optional[Profile] = profile
+        self.tokenizer = create_tokenizer(options)
+        self.tag_tokenizer = TagTokenizer()
+        self.id = 0
+        self.html_entity_detected = False
+        # With DIAGNOSTICS, problems are collected here and the transcription goes on
+        self.diagnostics: Optional[list[Diagnostic]] = None
+        if options.diagnostics != "off":
+            self.diagnostics = []
+            self.tokenizer.diagnostics = self.diagnostics
+            self.tag_tokenizer.diagnostics = self.diagnostics
+
+    def _problem(self, error: type, message: str, line: int = -1):
+        # Raises error, or records it when collecting diagnostics so the caller can recover
+        if self.diagnostics is None:
+            raise error(message)
+        if line != -1 and "line" not in message:
+            message += f", line {line}"
+        self.diagnostics.append(Diagnostic(line, 0, message))
+
+    def tokenize_tags(self, tokens: Iterable[HTMLToken]) -> Iterator[HTMLToken]:
+        # Splits the tags the tokenizer didn't
+        for token in tokens:
+            if token.tag is None:
+                self.tag_tokenizer.tokenize_html_token(token)
+            yield token
+
+    def _get_js_name(self) -> str:
+        n = f"e{self.id}"
+        self.id += 1
+        return n
+
+    def tag_to_js(
+            self, tag: Tag, params: bool = False, dynamic: Optional[list[str]] = None,
+            bindings: Optional[_Bindings] = None
+    ) -> tuple[str, str, list[str]]:
+        # If dynamic is given, lines depending on parameters and event listeners are added to it.
+        # If bindings is given, lines setting attributes that use parameters are added to it
+        name = self._get_js_name()
+        if not tag.name:
+            raise ValueError("A tag name is required")
+
+        if tag.name in SVG_TAGS:
+            js = [create_js_element(name, tag.name, "http://www.w3.org/2000/svg")]
+        else:
+            js = [create_js_element(name, tag.name)]
 
-    value = repr(value)
+        for tag_property, value in tag.attributes:
+            if value is None:
+                js.append(set_boolean_property(name, tag_property))
+                continue
 
-    if params and re.sub(r"\${.*?}", "", value) != value:
-        value = f"`{value[1:-1]}`"
+            line = set_property(name, tag_property, value, params)
+            if bindings is not None and not line.startswith(f"{name}.addEventListener("):
+                bindings.add(bindings.uses(value), line)
 
-    if utilities.AUTOMATICALLY_DECODE_HTML_ENTITIES and re.findall("&.*?;", value):
-        _html_entity_detected = True
-        return f"{name}.appendChild(document.createTextNode(dec({value})));"
+            if dynamic is not None and (_has_params(value, params) or line.startswith(f"{name}.addEventListener(")):
+                dynamic.append(line)
+            else:
+                js.append(line)
+
+        return name, tag.name, js
+
+    def text_value(self, value: str, params: bool = False, decode: bool = True) -> str:
+        has_params = _has_params(value, params)
+        decode = decode and self.options.automatically_decode_html_entities and "&" in value
+        if decode and not has_params:
+            # Entities are decoded now, so the script only holds the resulting text
+            return js_string(html.unescape(value))
+
+        value = js_string(value)
+        if has_params:
+            value = f"`{value[1:-1]}`"
+
+        if decode and re.search("&.*?;", value):
+            # Parameters might be part of an entity, so text using them is decoded when the script runs
+            self.html_entity_detected = True
+            return f"dec({value})"
+
+        return value
+
+    def append_text(self, name: str, value: str, params: bool = False, decode: bool = True) -> str:
+        return f"{name}.appendChild(document.createTextNode({self.text_value(value, params, decode)}));"
+
+    def subtree_to_js(self, js: Code, nodes: dict[str, Union[Subtree, str]], digest: str) -> str:
+        # Writes the code creating a subtree the same way transcribe_to_js does, returns the name of its root
+        root = None
+        pending: list[tuple[str, Optional[str], str]] = [(digest, None, "")]
+        while pending:
+            digest, parent, parent_tag = pending.pop()
+            node = nodes[digest]
+            if isinstance(node, str):
+                js.append_line(self.append_text(parent, node, decode=parent_tag not in RAW_TEXT_TAGS))
+                continue
 
-    return f"{name}.appendChild(document.createTextNode({value}));"
+            name, tag, code = self.tag_to_js(node.tag)
+            js.append_all(code)
+            if parent is None:
+                root = name
+            else:
+                js.append_line(append_child(parent, name))
+            pending += [(child, name, tag) for child in reversed(node.children)]
+
+        return root
+
+    def transcribe_to_js(
+            self, file_name: str, tokens: Iterable[HTMLToken],
+            behavior: str = "", repl_id: Optional[list] = None, un_repl_id: str = "", onload: bool = False,
+            params: Optional[list] = None, stream: Optional[TextIO] = None, helpers: Optional[set[str]] = None,
+            reserved: Iterable[str] = (), shared: Optional[dict[int, str]] = None, subtrees: Optional[Subtrees] = None
+    ) -> Code:
+        # If helpers is given, the names of the helper functions used are added to it instead of being written.
+        # When minifying, names in reserved are not given to internal identifiers.
+        # If shared is given, the elements with those ids are created by calling the shared function named after
+        # them instead. If subtrees is given, the subtrees that could be shared are recorded in it
+        tokens = iter(tokens)
+        first = next(tokens, None)
+        assert first is not None
+
+        if first.token_type != HTMLTokenType.TAG:
+            if first.token_type != HTMLTokenType.DATA or "DOCTYPE HTML" not in first.lexeme.upper():
+                self._problem(ValueError, f"Illegal start of source {first.lexeme}", first.line)
+        else:
+            tokens = itertools.chain([first], tokens)
+
+        defined_active_script = False
+        defined_element_to_replace = False
+        element_id = None
+
+        minifier = None
+        if self.options.minify_code:
+            minifier = Minifier(
+                file_name, itertools.chain(
+                    reserved, params[0] if params else (), HELPERS, [f"{file_name}_template"], (shared or {}).values()
+                )
+            )
+        js = Code(stream, self.options.minify_code, self.profile, minifier)
+
+        # The template is built on the first call, later calls clone it and only
+        # set what depends on parameters and event listeners
+        template = self.options.output_mode == "template"
+        template_name = f"{file_name}_template"
+        patches: Optional[_TemplatePatches] = None
+        dynamic: Optional[list[str]] = None
+        if template:
+            js.append_line(f"let {template_name};")
+
+        # update assigns the parameters again
+        declaration = "let" if self.options.update_function else "const"
+        if params is None:
+            js.append_line(f"function {file_name}()" " {")
+        elif behavior == "return":
+            js.append_line(f"function {file_name}({', '.join(params[0])})" " {")
+        elif (repl_id is None or not repl_id[0]) and not un_repl_id:
+            defined_active_script = True
+            js.append_all([
+                f"function {file_name}()" " {", "let currentScript;",
+                "const htmlScripts = document.querySelectorAll('script');",
+                "for (let __i = 0; __i < htmlScripts.length; __i++) " "{",
+                fr"if (/(.*[/\\]{file_name}\.js)|(^{file_name}\.js)/g.test(htmlScripts[__i].src)) " "{",
+                "currentScript = htmlScripts[__i];", "break;", "}", "}"
+            ])
+
+            for p in params[0]:
+                js.append_line(f"{declaration} {p} = currentScript.getAttribute({js_string(p)});")
+        else:
+            defined_element_to_replace = True
+            js.append_line(f"function {file_name}()" " {")
+            element_id = un_repl_id if un_repl_id != "" else repl_id[0]
+            element_id = js_string(element_id)
+            js.append_line(f"const myElementToRepl = document.getElementById({element_id});")
+            for p in params[0]:
+                js.append_line(f"{declaration} {p} = myElementToRepl.getAttribute({js_string(p)});")
+
+        if template:
+            js.append_line(f"if ({template_name} === undefined) " "{")
+
+        bindings = None
+        if self.options.update_function and params and params[0]:
+            bindings = _Bindings(params[0])
+
+        parent_stack = []
+        tag_stack = []
+        base_element = None
+        base_tag = None
+        parent_is_svg = False
+        # While inside an element created by a shared function, tokens only keep ids and stacks in sync
+        shared_depth = None
+        component_params = frozenset(params[0]) if params else frozenset()
+
+        for token in tokens:
+            if shared_depth is not None and len(parent_stack) < shared_depth:
+                shared_depth = None
+            if subtrees is not None:
+                subtrees.close(len(parent_stack))
+
+            if token.token_type == HTMLTokenType.TAG and shared_depth is not None:
+                element_js_name = self._get_js_name()
+                tag = token.tag.name
+                if tag == "svg":
+                    parent_is_svg = True
+                if tag not in SELF_CLOSING_TAGS and tag != "path":
+                    parent_stack.append(element_js_name)
+                    tag_stack.append(tag)
+                continue
 
+            if token.token_type == HTMLTokenType.TAG:
+                if template:
+                    dynamic = []
+
+                try:
+                    element_js_name, tag, code = self.tag_to_js(token.tag, params and params[0], dynamic, bindings)
+                except ValueError as e:
+                    self._problem(ValueError, str(e), token.line)
+                    continue
+
+                shared_name = shared.get(self.id - 1) if shared else None
+                if shared_name is not None:
+                    code = [f"const {element_js_name} = {shared_name}();"]
+                if subtrees is not None:
+                    subtrees.open(self.id - 1, token.tag, _shareable(token.tag, component_params, template))
+                js.append_all(code)
+
+                if tag == "svg":
+                    parent_is_svg = True
+
+                if parent_stack:
+                    js.append_line(append_child(parent_stack[-1], element_js_name))
+                    if template:
+                        patches.add_child(parent_stack[-1], element_js_name)
+                        patches.add(element_js_name, dynamic)
+                elif base_element is None:
+                    if tag in SELF_CLOSING_TAGS:
+                        self._problem(ValueError, "A self-closing tag cannot be a base component", token.line)
+
+                    base_element = element_js_name
+                    base_tag = tag
+                    if template:
+                        patches = _TemplatePatches(base_element)
+                        patches.add(base_element, dynamic)
+                else:
+                    # When collecting diagnostics, the second component is created without being added
+                    self._problem(
+                        ReferenceError, f"Found two base components: initial '{base_tag}', second '{tag}'",
+                        token.line
+                    )
+
+                if tag not in SELF_CLOSING_TAGS and tag != "path":
+                    # There are probably more problematic SVG tags
+                    parent_stack.append(element_js_name)
+                    tag_stack.append(tag)
+                    if shared_name is not None:
+                        shared_depth = len(parent_stack)
+                continue
 
-def _transcribe_to_js(
-        file_name: str, tokens: list[Union[HTMLToken, list]],
-        behavior: str = "", repl_id: Optional[list] = None, un_repl_id: str = "", onload: bool = False,
-        params: Optional[list] = None
-) -> Code:
-    assert tokens
+            if token.token_type == HTMLTokenType.DATA:
+                if not token.lexeme.strip() or shared_depth is not None:
+                    continue
+
+                if not parent_stack:
+                    self._problem(ValueError, "Found text outside the base component", token.line)
+                    continue
+
+                if subtrees is not None:
+                    subtrees.text(token.lexeme)
+
+                if self.profile is not None:
+                    self.profile.count("text_nodes")
+
+                parent = parent_stack[-1]
+                decode = tag_stack[-1] not in RAW_TEXT_TAGS
+                used = bindings.uses(token.lexeme) if bindings is not None else ()
+                if used:
+                    # The text node is kept to be set again by update
+                    text = self._get_js_name()
+                    value = self.text_value(token.lexeme, params[0], decode)
+                    line = f"{text}.nodeValue = {value};"
+                    bindings.add(used, line)
+                    if not template:
+                        js.append_line(f"const {text} = document.createTextNode({value});")
+                        js.append_line(append_child(parent, text))
+                        continue
+
+                    patches.add_child(parent, text)
+                    js.append_line(f"{parent}.appendChild(document.createTextNode(''));")
+                    patches.add(text, [line])
+                    continue
+
+                if not template:
+                    js.append_line(self.append_text(parent, token.lexeme, params and params[0], decode))
+                    continue
+
+                index = patches.add_child(parent)
+                if _has_params(token.lexeme, params and params[0]):
+                    js.append_line(f"{parent}.appendChild(document.createTextNode(''));")
+                    value = self.text_value(token.lexeme, params and params[0], decode)
+                    patches.add(parent, [f"{parent}.childNodes[{index}].nodeValue = {value};"])
+                else:
+                    js.append_line(self.append_text(parent, token.lexeme, decode=decode))
+                continue
 
-    if isinstance(tokens[0], HTMLToken):
-        if tokens[0].token_type == HTMLTokenType.DATA and "DOCTYPE HTML" in tokens[0].lexeme.upper():
-            tokens.pop(0)
-        else:
-            raise ValueError(f"Illegal start of source {tokens[0].lexeme}")
-
-    defined_active_script = False
-    defined_element_to_replace = False
-    element_id = None
-
-    js = Code()
-    if params is None:
-        js.append_line(f"function {file_name}()" " {")
-    elif behavior == "return":
-        js.append_line(f"function {file_name}({', '.join(params[0])})" " {")
-    elif (repl_id is None or not repl_id[0]) and not un_repl_id:
-        defined_active_script = True
-        js.append_all([
-            f"function {file_name}()" " {", "let currentScript;",
-            "const htmlScripts = document.querySelectorAll('script');",
-            "for (let __i = 0; __i < htmlScripts.length; __i++) " "{",
-            fr"if (/(.*[/\\]{file_name}\.js)|(^{file_name}\.js)/g.test(htmlScripts[__i].src)) " "{",
-            "currentScript = htmlScripts[__i];", "break;", "}", "}"
-        ])
-
-        for p in params[0]:
-            js.append_line(f"const {p} = currentScript.getAttribute({repr(p)});")
-    else:
-        defined_element_to_replace = True
-        js.append_line(f"function {file_name}()" " {")
-        element_id = un_repl_id if un_repl_id != "" else repl_id[0]
-        element_id = repr(element_id)
-        js.append_line(f"const myElementToRepl = document.getElementById({element_id});")
-        for p in params[0]:
-            js.append_line(f"const {p} = myElementToRepl.getAttribute({repr(p)});")
-
-    parent_stack = []
-    tag_stack = []
-    base_element = None
-    base_tag = None
-    parent_is_svg = False
-
-    for token in tokens:
-        if isinstance(token, list):
-            element_js_name, tag, code = tag_to_js(token, params and params[0])
-            js.append_all(code)
+            # HTMLTokenType.CLOSING_TAG
+            tag = token.lexeme[2:-1].lower()
 
+            # After some research, looks like there's no standard way for SVG to represent
+            # self-closing tags and not self-closing tags (some can be both),
+            # so any closing tag will be ignored as long as they are inside an SVG
+            #
             if tag == "svg":
-                parent_is_svg = True
+                parent_is_svg = False
+                if "svg" in tag_stack:
+                    while tag_stack[-1] != "svg":
+                        tag_stack.pop()
+                        parent_stack.pop()
 
-            if parent_stack:
-                js.append_line(append_child(parent_stack[-1], element_js_name))
-            elif base_element is None:
-                if tag in SELF_CLOSING_TAGS:
-                    raise ValueError("A self-closing tag cannot be a base component")
+            if parent_is_svg:
+                continue
+
+            if not tag_stack:
+                self._problem(ValueError, f"Found closing tag for '{tag}' but no tag is open", token.line)
+                continue
 
-                base_element = element_js_name
-                base_tag = tag
+            top = tag_stack.pop()
+            if tag != top:
+                if self.options.ignore_mismatching_closing_tags:
+                    tag_stack.append(top)
+                    continue
+
+                message = f"Found closing tag for '{tag}' but current tag is '{top}', line {token.line}"
+                self._problem(ValueError, message, token.line)
+                if tag not in tag_stack:
+                    tag_stack.append(top)  # Ignored
+                    continue
+
+                # Tags are closed up to the matching one, unless only the base component
+                # matches, then the closing tag most likely has a typo and only closes top
+                if tag in tag_stack[1:]:
+                    parent_stack.pop()
+                    while tag_stack.pop() != tag:
+                        parent_stack.pop()
+
+            parent_stack.pop()
+
+        if subtrees is not None:
+            subtrees.close(0)
+
+        if base_element is None:
+            # There is nothing to create, not even a best-effort script is written
+            self._problem(ValueError, "Found no base component")
+            raise DiagnosticsError(self.diagnostics)
+
+        if template:
+            js.append_line(f"{template_name} = {base_element};")
+            js.append_line("}")
+            js.append_line(f"const {base_element} = {template_name}.cloneNode(true);")
+            js.append_all(patches.lines)
+
+        if bindings is not None:
+            js.append_all(bindings.update_function(base_element))
+
+        if behavior == "return":
+            js.append_line(f"return {base_element};")
+        elif un_repl_id or repl_id[0]:
+            if element_id is None:
+                element_id = un_repl_id if un_repl_id != "" else repl_id[0]
+                element_id = js_string(element_id)
+
+            js.append_line(f"{base_element}.setAttribute('id', {element_id});")
+            if defined_element_to_replace:
+                js.append_line(f"myElementToRepl.replaceWith({base_element});")
             else:
-                raise ReferenceError(f"Found two base components: initial '{base_tag}', second '{tag}'")
+                js.append_line(f"document.getElementById({element_id}).replaceWith({base_element});")
+        elif not defined_active_script:
+            js.append_line(f"document.currentScript.replaceWith({base_element});")
+        else:
+            js.append_line(f"currentScript.replaceWith({base_element});")
 
-            if tag not in SELF_CLOSING_TAGS and tag != "path":
-                # There are probably more problematic SVG tags
-                parent_stack.append(element_js_name)
-                tag_stack.append(tag)
-            continue
+        js.append_line("}")
 
-        if token.token_type == HTMLTokenType.DATA:
-            if token.lexeme.strip():
-                js.append_line(append_text(parent_stack[-1], token.lexeme, params and params[0]))
-            continue
+        if self.options.automatically_decode_html_entities and self.html_entity_detected:
+            if helpers is not None:
+                helpers.add("dec")
+            else:
+                js.append_all(HELPERS["dec"])
 
-        # HTMLTokenType.CLOSING_TAG
-        tag = token.lexeme[2:-1].lower()
-
-        # After some research, looks like there's no standard way for SVG to represent
-        # self-closing tags and not self-closing tags (some can be both),
-        # so any closing tag will be ignored as long as they are inside an SVG
-        #
-        if tag == "svg":
-            parent_is_svg = False
-            if "svg" in tag_stack:
-                while tag_stack[-1] != "svg":
-                    tag_stack.pop()
-                    parent_stack.pop()
+        if onload:
+            js.append_all([
+                "if (document.readyState === 'loading') {",
+                'document.addEventListener("DOMContentLoaded", () => ' f"{file_name}()" ");",
+                "} else {", f"{file_name}();", "}"
+            ])
 
-        if parent_is_svg:
-            continue
+        js.flush()
+        if self.profile is not None:
+            self.profile.count("elements", self.id)
 
-        top = tag_stack.pop()
-        if tag != top:
-            if utilities.IGNORE_MISMATCHING_CLOSING_TAGS:
-                tag_stack.append(top)
-                continue
+        return js
 
-            raise ValueError(f"Found closing tag for '{tag}' but current tag is '{top}', line {token.line}")
 
-        parent_stack.pop()
+def component_name(file_name: str) -> str:
+    # Name of the generated function for a file
+    if "." in file_name:
+        file_name = file_name[:file_name.index(".")]
+    return file_name.replace("-", "_").replace(" ", "_")
 
-    if behavior == "return":
-        js.append_line(f"return {base_element};")
-    elif un_repl_id or repl_id[0]:
-        if element_id is None:
-            element_id = un_repl_id if un_repl_id != "" else repl_id[0]
-            element_id = repr(element_id)
 
-        js.append_line(f"{base_element}.setAttribute('id', {element_id});")
-        if defined_element_to_replace:
-            js.append_line(f"myElementToRepl.replaceWith({base_element});")
-        else:
-            js.append_line(f"document.getElementById({element_id}).replaceWith({base_element});")
-    elif not defined_active_script:
-        js.append_line(f"document.currentScript.replaceWith({base_element});")
+def _transcribe(
+        data: Union[str, list[str]], name: str, config: Optional[dict], options: Options,
+        stream: Optional[TextIO] = None, profile: Optional[Profile] = None, helpers: Optional[set[str]] = None,
+        shared: Optional[dict[int, str]] = None, subtrees: Optional[Subtrees] = None
+) -> Code:
+    # data is a whole buffer or the list of lines of an HTML file
+    if config is not None:
+        config = {key.lower(): value for key, value in config.items() if key in CONFIG_PROPERTIES}
+    else:
+        config = {"behavior": "return", "repl_id": [], "un_repl_id": "", "onload": False, "params": None}
+
+    transcriber = Transcriber(options, profile)
+
+    # Every stage passes tokens to the next one as they are produced
+    if isinstance(data, str):
+        tokens = transcriber.tokenizer.tokenize_buffer(data)
     else:
-        js.append_line(f"currentScript.replaceWith({base_element});")
+        tokens = transcriber.tokenizer.tokenize_file(data)
+
+    tokens = staged(profile, "tokenize", tokens, "tokens")
+    tokens = staged(profile, "merge_data", _merge_data_tokens(tokens))
+    tokens = staged(profile, "tokenize_tags", transcriber.tokenize_tags(tokens))
+    with stage(profile, "generate_js"):
+        reserved = _user_identifiers(data) if options.minify_code or subtrees is not None else ()
+        if subtrees is not None:
+            subtrees.identifiers.update(reserved)
+        js = transcriber.transcribe_to_js(
+            name, tokens, **config, stream=stream, helpers=helpers, reserved=reserved, shared=shared, subtrees=subtrees
+        )
+
+    if transcriber.diagnostics:
+        error = DiagnosticsError(transcriber.diagnostics)
+        if options.diagnostics == "report":
+            raise error
+        logging.warning(f"{name}: {error}")
+
+    return js
+
+
+def _html_data(html: str, options: Options) -> Union[str, list[str]]:
+    # Line endings are normalized the same way as when reading a file
+    if options.tokenize_whole_file:
+        return html.replace("\r\n", "\n").replace("\r", "\n") if "\r" in html else html
+    return io.StringIO(html, newline=None).readlines()
 
+
+def transcribe_html(
+        _file: Path, config: Optional[dict] = None, options: Options = Options(), stream: Optional[TextIO] = None,
+        profile: Optional[Profile] = None, helpers: Optional[set[str]] = None,
+        shared: Optional[dict[int, str]] = None, subtrees: Optional[Subtrees] = None
+) -> Code:
+    # If stream is given, the generated code is written to it while transcribing.
+    # If profile is given, the time spent in every stage is added to it.
+    # If helpers is given, helper functions are not written, their names are added to it.
+    # shared and subtrees are passed to Transcriber.transcribe_to_js
+    with stage(profile, "read"):
+        if options.tokenize_whole_file:
+            data = read_file(_file)
+        else:
+            with open(_file, "r") as f:
+                data = f.readlines()
+
+    return _transcribe(data, component_name(_file.name), config, options, stream, profile, helpers, shared, subtrees)
+
+
+def shared_function(
+        name: str, nodes: dict[str, Union[Subtree, str]], digest: str, options: Options = Options(),
+        reserved: Iterable[str] = ()
+) -> str:
+    # Code of a function that creates the subtree with digest, called by every component containing it.
+    # When minifying, names in reserved are not given to internal identifiers
+    minifier = Minifier(name, reserved) if options.minify_code else None
+    js = Code(minify=options.minify_code, minifier=minifier)
+    js.append_line(f"function {name}()" " {")
+    root = Transcriber(options).subtree_to_js(js, nodes, digest)
+    js.append_line(f"return {root};")
     js.append_line("}")
+    return str(js)
 
-    if utilities.AUTOMATICALLY_DECODE_HTML_ENTITIES and _html_entity_detected:
-        # From https://stackoverflow.com/questions/6155595/how-do-i-convert-an-html-entity-number-into-a-character
-        # -using-plain-javascript-o
-        js.append_all(["function dec(data) {", "const e = document.createElement('p');",
-                       "e.innerHTML = data;", "return e.innerHTML;", "}"])
 
-    if onload:
-        js.append_all([
-            "if (document.readyState === 'loading') {",
-            'document.addEventListener("DOMContentLoaded", () => ' f"{file_name}()" ");",
-            "} else {", f"{file_name}();", "}"
-        ])
+def transcribe_string(html: str, name: str, options: Options = Options(), config: Optional[dict] = None) -> str:
+    """
+    Transcribes HTML held in memory and returns the generated code, without touching the filesystem.
 
-    return js
+    name is used like a file name to name the generated function, config holds the same
+    properties as a config block (BEHAVIOR, PARAMS, ...), by default the function returns the component.
+    Raises the same errors as transcribe_html. Safe to call from several threads at once.
+    """
+    return str(_transcribe(_html_data(html, options), component_name(name), config, options))
 
 
-def transcribe_html(_file: Path, config: Optional[dict] = None):
-    global _id, _html_entity_detected
+def transcribe_bytes(
+        data: bytes, name: str, options: Options = Options(), config: Optional[dict] = None, encoding: str = "utf-8"
+) -> str:
+    # Same as transcribe_string for encoded HTML
+    return transcribe_string(data.decode(encoding), name, options, config)
+
+
+def transcribe_stream(
+        source: TextIO, output: TextIO, name: str, options: Options = Options(), config: Optional[dict] = None
+):
+    # Same as transcribe_string, but HTML is read from source and the generated code is written to output
+    _transcribe(_html_data(source.read(), options), component_name(name), config, options, output)
 
-    if config is not None:
-        required = ["BEHAVIOR", "REPL_ID", "UN_REPL_ID", "ONLOAD", "PARAMS"]
-        config = {key.lower(): value for key, value in config.items() if key in required}
-    else:
-        config = {"behavior": "return", "repl_id": [], "un_repl_id": "", "onload": False, "params": []}
-
-    _id = 0
-    _html_entity_detected = False
-    name = _file.name
-    if "." in name:
-        name = name[:name.index(".")]
-    name = name.replace("-", "_").replace(" ", "_")
-
-    reset_html_tokenize()
-    reset_html_tag_tokenize()
-
-    with open(_file, "r") as f:
-        data = f.readlines()
-        tokens = tokenize_file(data)
-        tokens = _filter_data_tokens(tokens)
-        _tokenize_tags(tokens)
-        return _transcribe_to_js(name, tokens, **config)
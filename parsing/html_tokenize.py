@@ -1,5 +1,8 @@
+from typing import Optional, Iterator, NamedTuple
 from utilities import *
 from enum import Enum
+import bisect
+import sys
 import re
 
 
@@ -9,253 +12,656 @@ class HTMLTokenType(Enum):
     DATA = 2
 
 
-class HTMLToken:
-    def __init__(self, token_type: HTMLTokenType, line: int, column: int, lexeme: str = ""):
-        self.token_type: HTMLTokenType = token_type
-        self.lexeme: str = lexeme
-        self.line: int = line
-        self.column: int = column
+class LineIndex:
+    # Offsets of every new line in a buffer, only built once a position is requested
+    def __init__(self, data: str):
+        self.data: str = data
+        self._newlines: Optional[list[int]] = None
 
-    def __str__(self):
-        return "{" f"{self.token_type.name}, {repr(self.lexeme)}, {self.line}" "}"
+    def _get_newlines(self) -> list[int]:
+        if self._newlines is None:
+            self._newlines = [m.start() for m in re.finditer("\n", self.data)]
+        return self._newlines
 
+    def locate(self, offset: int) -> tuple[int, int]:
+        # Returns the line (starting at 1) and column (starting at 0) of an offset
+        newlines = self._get_newlines()
+        line = bisect.bisect_left(newlines, offset)
+        line_start = newlines[line - 1] + 1 if line else 0
+        return line + 1, offset - line_start
 
-_state = 0
-_lexeme = ""
-_quote = None
+    def line_text(self, line: int) -> str:
+        newlines = self._get_newlines()
+        line_start = newlines[line - 2] + 1 if line > 1 else 0
+        line_end = newlines[line - 1] if line - 1 < len(newlines) else len(self.data)
+        return self.data[line_start:line_end]
 
 
-def generate_tokens(data: str, line: int = -1) -> list[HTMLToken]:
-    global _state, _lexeme, _quote
+class Tag(NamedTuple):
+    # An opening tag split into its parts, names are interned and the tag name is in lowercase.
+    # Values keep their quotes and are None for attributes without one
+    name: str
+    attributes: list[tuple[str, Optional[str]]]
+    self_closing: bool
 
-    if _state not in [0, 4, 11, 15]:
-        if _state != 9 and not ALLOW_ANYTHING_IN_CLOSE_TAGS:
-            raise ValueError(f"Parsing error |{_state=}|")
 
-    generated_tokens: list[HTMLToken] = []
+class HTMLToken:
+    def __init__(
+            self, token_type: HTMLTokenType, line: int, column: int, lexeme: str = "",
+            line_index: Optional[LineIndex] = None
+    ):
+        self.token_type: HTMLTokenType = token_type
+        self.lexeme: str = lexeme
+        # Parts of a TAG token, set by the tokenizer or by TagTokenizer
+        self.tag: Optional[Tag] = None
+        self._line: int = line
+        self._column: int = column
+        # If present, column holds an offset inside the buffer of line_index
+        self.line_index: Optional[LineIndex] = line_index
+
+    def _locate(self):
+        if self.line_index is not None:
+            self._line, self._column = self.line_index.locate(self._column)
+            self.line_index = None
+
+    @property
+    def line(self) -> int:
+        self._locate()
+        return self._line
+
+    @line.setter
+    def line(self, line: int):
+        self._locate()
+        self._line = line
+
+    @property
+    def column(self) -> int:
+        self._locate()
+        return self._column
+
+    @column.setter
+    def column(self, column: int):
+        self._locate()
+        self._column = column
 
-    i = 0
-    is_been_in_13 = False
-    while i < len(data):
-        c = data[i]
-        i += 1
+    def __str__(self):
+        return "{" f"{self.token_type.name}, {repr(self.lexeme)}, {self.line}" "}"
 
-        if _state == 0:
-            _lexeme += c
-            if c == '<':
-                _state = 1
-                continue
 
-            _state = 13
-
-        elif _state == 1:
-            _lexeme += c
-            if c == '!':
-                _state = 2
-            elif c == '/':
-                _state = 8
-            elif c.isalpha():
-                if is_been_in_13:  # State 14 from 11
-                    is_been_in_13 = False
-                    i -= 2
-                    generated_tokens.append(HTMLToken(HTMLTokenType.DATA, line, i, _lexeme[:-2]))
-                    _lexeme = ""
-                    _state = 0
+_LEADING_WHITESPACE = re.compile(r"^[\t ]+", re.MULTILINE)
+_BLANK_LINES = re.compile(r"\n\n+")
+_LINE_START_STATES = frozenset([0, 4, 11, 15])
+_QUOTES = frozenset(['"', "'", '{'])
+
+# Elements whose contents are text up to their closing tag
+_RAW_TEXT_TAG = re.compile(r"<(script|style|textarea|title)[\s/>]", re.IGNORECASE)
+_RAW_TEXT_CLOSE = {
+    tag: re.compile(fr"</{tag}[\s/>]", re.IGNORECASE) for tag in ["script", "style", "textarea", "title"]
+}
+
+
+class HTMLTokenizer:
+    def __init__(self, options: Options = Options()):
+        self.options: Options = options
+        self.state = 0
+        self.lexeme = ""
+        self.quote = None
+        # Used when a whole buffer is tokenized
+        self.line_index: Optional[LineIndex] = None
+        self.stop_at_raw_text = False
+        self.raw_text_tag: Optional[str] = None
+        self.position = 0
+        # Problems are recorded here instead of raised when given
+        self.diagnostics: Optional[list[Diagnostic]] = None
+
+    def reset(self):
+        self.state = 0
+        self.lexeme = ""
+        self.quote = None
+        self.line_index = None
+        self.stop_at_raw_text = False
+        self.raw_text_tag = None
+        self.position = 0
+
+    def _raise_error(self, data: str, c: str, i: int, line: int):
+        # When collecting diagnostics the error is recorded and the caller recovers
+        if self.line_index is not None:
+            line, column = self.line_index.locate(i - 1)
+            data, i = self.line_index.line_text(line), column + 1
+
+        if self.diagnostics is None:
+            raise_error(data, c, i, line)
+        self.diagnostics.append(Diagnostic(line, i, format_error(data, c, i, line)))
+
+    def _problem(self, message: str, line: int = -1):
+        if self.diagnostics is None:
+            raise ValueError(message)
+        self.diagnostics.append(Diagnostic(line, 0, message))
+
+    def _check_state(self, line: int):
+        # Lines can only start in some states
+        if self.state not in _LINE_START_STATES:
+            if self.state != 9 and not self.options.allow_anything_in_close_tags:
+                self._problem(f"Parsing error |state={self.state}|" + (f", line {line}" if line != -1 else ""), line)
+                self.state = 0
+                self.lexeme = ""
+
+    @staticmethod
+    def _skip_tag(data: str, i: int, c: str) -> int:
+        # Position after the rest of a broken tag, a '<' starts the next tag
+        if c == '<':
+            return i - 1
+        if c == '>':
+            return i
+
+        j = data.find('>', i)
+        return len(data) if j == -1 else j + 1
+
+    def _stop_at(self, tag_lexeme: str) -> bool:
+        if not self.stop_at_raw_text:
+            return False
+
+        raw_text = _RAW_TEXT_TAG.match(tag_lexeme)
+        if raw_text is None:
+            return False
+
+        self.raw_text_tag = raw_text.group(1).lower()
+        return True
+
+    def generate_tokens(self, data: str, line: int = -1, start: int = 0) -> Iterator[HTMLToken]:
+        self._check_state(line)
+
+        i = start
+        is_been_in_13 = False
+        while i < len(data):
+            c = data[i]
+            i += 1
+
+            if self.state == 0:
+                self.lexeme += c
+                if c == '<':
+                    self.state = 1
                     continue
 
-                _state = 11
-            else:
-                _state = 13
-
-        elif _state == 2 or _state == 3:
-            _lexeme += c
-            if c == '-':
-                _state += 1
-                continue
+                self.state = 13
+
+            elif self.state == 1:
+                self.lexeme += c
+                if c == '!':
+                    self.state = 2
+                elif c == '/':
+                    self.state = 8
+                elif c.isalpha():
+                    if is_been_in_13:  # State 14 from 11
+                        is_been_in_13 = False
+                        i -= 2
+                        yield HTMLToken(HTMLTokenType.DATA, line, i, self.lexeme[:-2], self.line_index)
+                        self.lexeme = ""
+                        self.state = 0
+                        continue
+
+                    scanned = _scan_tag(data, i - 2)
+                    if scanned is None:
+                        self.state = 11
+                        continue
+
+                    # Well-formed tags are split right away, TagTokenizer only splits the rest
+                    token = HTMLToken(HTMLTokenType.TAG, line, scanned[1], data[i - 2:scanned[1]], self.line_index)
+                    token.tag = scanned[0]
+                    yield token
+                    i = scanned[1]
+                    self.lexeme = ""
+                    self.state = 0
+                    if self._stop_at(token.lexeme):
+                        break
+                else:
+                    self.state = 13
+
+            elif self.state == 2 or self.state == 3:
+                self.lexeme += c
+                if c == '-':
+                    self.state += 1
+                    if self.state == 4 and len(self.lexeme) > 4:  # Text before the comment
+                        yield HTMLToken(HTMLTokenType.DATA, line, i - 4, self.lexeme[:-4], self.line_index)
+                    continue
 
-            _state = 13
+                self.state = 13
 
-        elif _state == 4:
-            if c == '-':
-                _state = 5
+            elif self.state == 4:
+                if c == '-':
+                    self.state = 5
 
-        elif _state == 5:
-            if c == '-':
-                _state = 6
-                continue
-
-            _state = 4
-
-        elif _state == 6:
-            if c == '>':
-                _state = 0
-                _lexeme = ""
-            elif c != '-':
-                _state = 4
-
-        elif _state == 8:
-            _lexeme += c
-            if c.isalpha():
-                if is_been_in_13:  # State 14 from 9
-                    is_been_in_13 = False
-                    i -= 3
-                    generated_tokens.append(HTMLToken(HTMLTokenType.DATA, line, i, _lexeme[:-3]))
-                    _lexeme = ""
-                    _state = 0
+            elif self.state == 5:
+                if c == '-':
+                    self.state = 6
                     continue
 
-                _state = 9
-                continue
-
-            raise_error(data, c, i, line)
-
-        elif _state == 9:
-            _lexeme += c
-            if c == '>':
-                generated_tokens.append(HTMLToken(HTMLTokenType.CLOSING_TAG, line, i, _lexeme))
-                _lexeme = ""
-                _state = 0
-
-            elif not c.isalnum() and c != '-' and not ALLOW_ANYTHING_IN_CLOSE_TAGS:
-                raise_error(data, c, i, line)
-
-        elif _state == 11:
-            _lexeme += c
-            if c in ['"', "'", '{']:
-                _state = 15
-                _quote = c
-            elif c == '>':
-                generated_tokens.append(HTMLToken(HTMLTokenType.TAG, line, i, _lexeme))
-                _lexeme = ""
-                _state = 0
-            elif c == '<':
-                raise_error(data, c, i, line)
-
-        elif _state == 13:
-            is_been_in_13 = True
-            _lexeme += c
-            if c == '<':
-                _state = 1
-
-        elif _state == 15:
-            _lexeme += c
-            if c == _quote != '{' or _quote == '{' and c == '}':
-                _quote = None
-                _state = 11
-
-    if _state == 13:
-        generated_tokens.append(HTMLToken(HTMLTokenType.DATA, line, i, _lexeme))
-        _lexeme = ""
-        _state = 0
-
-    return generated_tokens
-
-
-def reset_html_tokenize():
-    global _state, _lexeme, _quote
-    _state = 0
-    _lexeme = ""
-    _quote = None
-
-
-def tokenize_file(file_data: list[str]) -> list[HTMLToken]:
-    tokens = []
-
-    is_script = False
-    processed_script = []
-    index_difference = 0
-    first_state_4 = -1
-    first_state_15 = -1
-
-    for i, line in enumerate(file_data):
-        if first_state_4 == -1 and _state == 4:
-            first_state_4 = i - 1
-
-        if first_state_15 == -1 and _state == 15:
-            first_state_15 = i - 1
-
-        line = re.sub(r"^[\t ]+", "", line)
-
-        if not line.strip():
-            continue
-
-        # TODO: Find if there's another workaround
-
-        # QuickFix1: if a previous tag was script then anything becomes DATA until the close
-        #            is found
-        # QuickFix2: if the line contains an opening and closing script tag then the
-        #            tag will be processed separately and replaced with <rps>.
-        #            After parsing <rps> the processed tag will be placed back
-        # QuickFix3: if the line contains an opening script tag and JS code, then
-        #            the line is split in two
-
-        # tokens += generate_tokens(line, i + 1)
-
-        # TODO: Implement QuickFixes for style tag
-
-        if "<script" in line and "</script" in line:  # Handle one line script
-            # QF2
-            scripts = re.findall("<script.*?>.*?</script.*?>", line)
-            for s in scripts:
-                data = re.sub(r"^<script.*?>", "", re.sub(r"</script.*?>$", "", s))
-                if not data:
+                self.state = 4
+
+            elif self.state == 6:
+                if c == '>':
+                    self.state = 0
+                    self.lexeme = ""
+                elif c != '-':
+                    self.state = 4
+
+            elif self.state == 8:
+                self.lexeme += c
+                if c.isalpha():
+                    if is_been_in_13:  # State 14 from 9
+                        is_been_in_13 = False
+                        i -= 3
+                        yield HTMLToken(HTMLTokenType.DATA, line, i, self.lexeme[:-3], self.line_index)
+                        self.lexeme = ""
+                        self.state = 0
+                        continue
+
+                    self.state = 9
                     continue
 
-                script_tag, script_tag_close = s.split(data)
-
-                script_tag_start = line.index(script_tag)
-                data_start = script_tag_start + len(script_tag)
-                script_tag_close_start = data_start + len(data)
-
-                line = line.replace(s, "<rps>")
-
-                # This position is required by the following tokens
-                # otherwise following tokens will show an incorrect column position
-                processed_script.append(len(s) - len("<rps>"))
-
-                processed_script.append([
-                    HTMLToken(HTMLTokenType.TAG, i, script_tag_start, script_tag),
-                    HTMLToken(HTMLTokenType.DATA, i, data_start, data),
-                    HTMLToken(HTMLTokenType.CLOSING_TAG, i, script_tag_close_start, script_tag_close)
-                ])
-
-        if is_script and not line.startswith("</script"):  # QF1
-            tokens.append(HTMLToken(HTMLTokenType.DATA, i, 0, line))
-            continue
-
-        if line.startswith("<script"):  # QF3
-            rest = re.sub("^<script.*?>", "", line)
-            if rest:
-                line = line.replace(rest, "")
-                if line:
-                    file_data.insert(i + 1, rest)
-
-        _tokens = generate_tokens(line, i + 1)
-        for t in _tokens:
-            if t.token_type == HTMLTokenType.TAG and t.lexeme == "<rps>":  # QF2
-                index_difference += processed_script.pop(0)
-                for rps in processed_script[0]:
-                    tokens.append(rps)
-                processed_script.pop(0)
+                self._raise_error(data, c, i, line)
+                # Skipped up to the next '>' like a bogus comment
+                if len(self.lexeme) > 3:
+                    yield HTMLToken(HTMLTokenType.DATA, line, i - 3, self.lexeme[:-3], self.line_index)
+                is_been_in_13 = False
+                i = self._skip_tag(data, i, c)
+                self.lexeme = ""
+                self.state = 0
+
+            elif self.state == 9:
+                self.lexeme += c
+                if c == '>':
+                    yield HTMLToken(HTMLTokenType.CLOSING_TAG, line, i, self.lexeme, self.line_index)
+                    self.lexeme = ""
+                    self.state = 0
+
+                elif not c.isalnum() and c != '-' and not self.options.allow_anything_in_close_tags:
+                    self._raise_error(data, c, i, line)
+                    # The rest of the closing tag is skipped
+                    i = self._skip_tag(data, i, c)
+                    yield HTMLToken(HTMLTokenType.CLOSING_TAG, line, i, self.lexeme[:-1] + ">", self.line_index)
+                    self.lexeme = ""
+                    self.state = 0
+
+            elif self.state == 11:
+                self.lexeme += c
+                if c in _QUOTES:
+                    self.state = 15
+                    self.quote = c
+                elif c == '>':
+                    tag = self.lexeme
+                    yield HTMLToken(HTMLTokenType.TAG, line, i, tag, self.line_index)
+                    self.lexeme = ""
+                    self.state = 0
+                    if self._stop_at(tag):
+                        break
+                elif c == '<':
+                    self._raise_error(data, c, i, line)
+                    # The tag ends before the next one
+                    tag = self.lexeme[:-1] + ">"
+                    i -= 1
+                    yield HTMLToken(HTMLTokenType.TAG, line, i, tag, self.line_index)
+                    self.lexeme = ""
+                    self.state = 0
+                    if self._stop_at(tag):
+                        break
+
+            elif self.state == 13:
+                is_been_in_13 = True
+                self.lexeme += c
+                if c == '<':
+                    self.state = 1
+
+            elif self.state == 15:
+                self.lexeme += c
+                if c == self.quote != '{' or self.quote == '{' and c == '}':
+                    self.quote = None
+                    self.state = 11
+
+        self.position = i
+
+        if self.state == 13:
+            yield HTMLToken(HTMLTokenType.DATA, line, i, self.lexeme, self.line_index)
+            self.lexeme = ""
+            self.state = 0
+
+    def tokenize_file(self, file_data: list[str]) -> Iterator[HTMLToken]:
+        self.stop_at_raw_text = True
+        first_state_4 = -1
+        first_state_15 = -1
+
+        # Lines inside a raw text element, kept until its closing tag is found
+        raw_text: list[str] = []
+        raw_text_line = -1
+        raw_text_column = 0
+
+        for i, line in enumerate(file_data):
+            if first_state_4 == -1 and self.state == 4:
+                first_state_4 = i - 1
+
+            if first_state_15 == -1 and self.state == 15:
+                first_state_15 = i - 1
+
+            line = _LEADING_WHITESPACE.sub("", line, 1)
+
+            if not line.strip():
                 continue
 
-            if t.token_type == HTMLTokenType.TAG and t.lexeme.startswith("<script"):  # QF1
-                is_script = True
-            if t.token_type == HTMLTokenType.CLOSING_TAG and t.lexeme.startswith("</script"):  # QF1
-                is_script = False
-
-            t.column += index_difference
-            tokens.append(t)
+            start = 0
+            while True:
+                if self.raw_text_tag is None:
+                    yield from self.generate_tokens(line, i + 1, start)
+                    if self.raw_text_tag is None:
+                        break
+
+                    start = self.position
+                    raw_text_line = i + 1
+                    raw_text_column = start
+
+                # Anything up to the closing tag becomes a single DATA token
+                closing_tag = _RAW_TEXT_CLOSE[self.raw_text_tag].search(line, start)
+                if closing_tag is None:
+                    raw_text.append(line[start:])
+                    break
+
+                raw_text.append(line[start:closing_tag.start()])
+                if any(raw_text):
+                    yield HTMLToken(HTMLTokenType.DATA, raw_text_line, raw_text_column, "".join(raw_text))
+                raw_text = []
+                self.raw_text_tag = None
+                start = closing_tag.start()
+
+        if any(raw_text):
+            yield HTMLToken(HTMLTokenType.DATA, raw_text_line, raw_text_column, "".join(raw_text))
+
+        if self.state == 4:
+            self._problem(
+                "Source contains unclosed comments" + (f" near line {first_state_4}" if first_state_4 != -1 else ""),
+                first_state_4
+            )
+
+        if self.state == 15:
+            self._problem(
+                "Source contains unbalanced quotes or curly braces"
+                + (f" near line {first_state_15}" if first_state_15 != -1 else ""),
+                first_state_15
+            )
+
+    def tokenize_buffer(self, data: str) -> Iterator[HTMLToken]:
+        # Tokenizes a whole file at once, line and column numbers are only
+        # worked out from the LineIndex when a token position is requested
+        data = _LEADING_WHITESPACE.sub("", data)
+        self.line_index = LineIndex(data)
+        self.stop_at_raw_text = True
+
+        position = 0
+        while position < len(data):
+            for t in self.generate_tokens(data, -1, position):
+                if t.token_type == HTMLTokenType.DATA and "\n\n" in t.lexeme:
+                    t.lexeme = _BLANK_LINES.sub("\n", t.lexeme)
+                yield t
+            position = self.position
+
+            if self.raw_text_tag is None:
+                break
+
+            # Anything up to the closing tag becomes a single DATA token
+            closing_tag = _RAW_TEXT_CLOSE[self.raw_text_tag].search(data, position)
+            self.raw_text_tag = None
+            end = closing_tag.start() if closing_tag is not None else len(data)
+            if end > position:
+                raw_text = _BLANK_LINES.sub("\n", data[position:end])
+                yield HTMLToken(HTMLTokenType.DATA, -1, position, raw_text, self.line_index)
+            position = end
+
+        if self.state == 4:
+            line, _ = self.line_index.locate(data.rfind("<!--"))
+            self._problem(f"Source contains unclosed comments near line {line}", line)
+
+        if self.state == 15:
+            line, _ = self.line_index.locate(data.rfind(self.quote))
+            self._problem(f"Source contains unbalanced quotes or curly braces near line {line}", line)
+
+
+_TAG_STOP = re.compile(r"[\"'{<>]")
+_CLOSE_TAG_NAME = re.compile(r"(?:[^\W_]|-)*")
+_NEWLINES = re.compile(r"\n+")
+
+# Tags TagTokenizer would split without errors, anything else is left to it.
+# New lines inside tags work as spaces
+_TAG_OPEN = re.compile(r"<([A-Za-z][-A-Za-z0-9]*)(?:(/?>)|[ \n])")
+_TAG_ATTRIBUTE = re.compile(
+    r"""[ \n]*(?:([A-Za-z][-:A-Za-z0-9]*)"""
+    r"""(?:[ \n]*=[ \n]*("[^"]*"|'[^']*'|{[^}]*}|[^ \n<=>"'{}][^ \n<>"'{}]*))?|(/?>))"""
+)
+
+
+def _scan_tag(data: str, start: int) -> Optional[tuple[Tag, int]]:
+    # Splits the tag at start in a single pass, returns it with the position after it
+    match = _TAG_OPEN.match(data, start)
+    if match is None:
+        return None
+
+    name = sys.intern(match.group(1).lower())
+    end = match.group(2)
+    position = match.end()
+    attributes = []
+    while end is None:
+        match = _TAG_ATTRIBUTE.match(data, position)
+        if match is None:
+            return None
+
+        attribute, value, end = match.groups()
+        position = match.end()
+        if attribute is not None:
+            if value is not None and "\n" in value:
+                value = _NEWLINES.sub(" ", value)
+            attributes.append((sys.intern(attribute), value))
+
+    return Tag(name, attributes, end == "/>"), position
+
+
+class RegexHTMLTokenizer(HTMLTokenizer):
+    # Same states as HTMLTokenizer, but text runs, comments, tags, quoted values
+    # and closing tags are consumed in bulk with str.find and compiled regexes.
+    # Lexemes are collected as slices and joined once per token
+
+    def generate_tokens(self, data: str, line: int = -1, start: int = 0) -> Iterator[HTMLToken]:
+        self._check_state(line)
+
+        state = self.state
+        lexeme = [self.lexeme] if self.lexeme else []
+        n = len(data)
+        i = start
+        is_been_in_13 = False
+        while i < n:
+            if state == 13:
+                is_been_in_13 = True
+                j = data.find('<', i)
+                if j == -1:
+                    lexeme.append(data[i:])
+                    i = n
+                    break
+
+                lexeme.append(data[i:j + 1])
+                i = j + 1
+                state = 1
+
+            elif state == 11:
+                match = _TAG_STOP.search(data, i)
+                if match is None:
+                    lexeme.append(data[i:])
+                    i = n
+                    break
+
+                j = match.start()
+                c = data[j]
+                lexeme.append(data[i:j + 1])
+                i = j + 1
+                if c == '>':
+                    tag = "".join(lexeme)
+                    yield HTMLToken(HTMLTokenType.TAG, line, i, tag, self.line_index)
+                    lexeme = []
+                    state = 0
+                    if self._stop_at(tag):
+                        break
+                elif c == '<':
+                    self._raise_error(data, c, i, line)
+                    # The tag ends before the next one
+                    tag = "".join(lexeme)[:-1] + ">"
+                    i -= 1
+                    yield HTMLToken(HTMLTokenType.TAG, line, i, tag, self.line_index)
+                    lexeme = []
+                    state = 0
+                    if self._stop_at(tag):
+                        break
+                else:
+                    state = 15
+                    self.quote = c
+
+            elif state == 15:
+                j = data.find('}' if self.quote == '{' else self.quote, i)
+                if j == -1:
+                    lexeme.append(data[i:])
+                    i = n
+                    break
+
+                lexeme.append(data[i:j + 1])
+                i = j + 1
+                self.quote = None
+                state = 11
+
+            elif state == 4:
+                j = data.find("-->", i)
+                if j == -1:
+                    rest = data[i:]
+                    state = 6 if rest.endswith("--") else 5 if rest.endswith("-") else 4
+                    i = n
+                    break
+
+                i = j + 3
+                lexeme = []
+                state = 0
+
+            elif state == 9:
+                if self.options.allow_anything_in_close_tags:
+                    j = data.find('>', i)
+                else:
+                    j = _CLOSE_TAG_NAME.match(data, i).end()
+
+                if j == -1 or j == n:
+                    lexeme.append(data[i:])
+                    i = n
+                    break
+
+                c = data[j]
+                lexeme.append(data[i:j + 1])
+                i = j + 1
+                if c != '>':
+                    self._raise_error(data, c, i, line)
+                    # The rest of the closing tag is skipped
+                    lexeme[-1] = lexeme[-1][:-1] + ">"
+                    i = self._skip_tag(data, i, c)
+
+                yield HTMLToken(HTMLTokenType.CLOSING_TAG, line, i, "".join(lexeme), self.line_index)
+                lexeme = []
+                state = 0
 
-    if _state == 4:
-        raise ValueError(
-            "Source contains unclosed comments" + (f" near line {first_state_4}" if first_state_4 != -1 else "")
-        )
-
-    if _state == 15:
-        raise ValueError(
-            "Source contains unbalanced quotes or curly braces"
-            + (f" near line {first_state_15}" if first_state_15 != -1 else "")
-        )
-
-    return tokens
+            else:
+                # States with only a few characters to check are stepped one by one
+                c = data[i]
+                i += 1
+
+                if state == 0:
+                    lexeme.append(c)
+                    state = 1 if c == '<' else 13
+
+                elif state == 1:
+                    lexeme.append(c)
+                    if c == '!':
+                        state = 2
+                    elif c == '/':
+                        state = 8
+                    elif c.isalpha():
+                        if is_been_in_13:
+                            is_been_in_13 = False
+                            i -= 2
+                            yield HTMLToken(HTMLTokenType.DATA, line, i, "".join(lexeme)[:-2], self.line_index)
+                            lexeme = []
+                            state = 0
+                            continue
+
+                        scanned = _scan_tag(data, i - 2)
+                        if scanned is None:
+                            state = 11
+                            continue
+
+                        # Well-formed tags are split right away
+                        token = HTMLToken(HTMLTokenType.TAG, line, scanned[1], data[i - 2:scanned[1]], self.line_index)
+                        token.tag = scanned[0]
+                        yield token
+                        i = scanned[1]
+                        lexeme = []
+                        state = 0
+                        if self._stop_at(token.lexeme):
+                            break
+                    else:
+                        state = 13
+
+                elif state == 2 or state == 3:
+                    lexeme.append(c)
+                    state = state + 1 if c == '-' else 13
+                    if state == 4:
+                        text = "".join(lexeme)[:-4]
+                        if text:  # Text before the comment
+                            yield HTMLToken(HTMLTokenType.DATA, line, i - 4, text, self.line_index)
+
+                elif state == 5:
+                    state = 6 if c == '-' else 4
+
+                elif state == 6:
+                    if c == '>':
+                        state = 0
+                        lexeme = []
+                    elif c != '-':
+                        state = 4
+
+                elif state == 8:
+                    lexeme.append(c)
+                    if not c.isalpha():
+                        self._raise_error(data, c, i, line)
+                        # Skipped up to the next '>' like a bogus comment
+                        text = "".join(lexeme)[:-3]
+                        if text:
+                            yield HTMLToken(HTMLTokenType.DATA, line, i - 3, text, self.line_index)
+                        is_been_in_13 = False
+                        i = self._skip_tag(data, i, c)
+                        lexeme = []
+                        state = 0
+                        continue
+
+                    if is_been_in_13:
+                        is_been_in_13 = False
+                        i -= 3
+                        yield HTMLToken(HTMLTokenType.DATA, line, i, "".join(lexeme)[:-3], self.line_index)
+                        lexeme = []
+                        state = 0
+                        continue
+
+                    state = 9
+
+        self.lexeme = "".join(lexeme)
+        self.state = state
+        self.position = i
+
+        if self.state == 13:
+            yield HTMLToken(HTMLTokenType.DATA, line, i, self.lexeme, self.line_index)
+            self.lexeme = ""
+            self.state = 0
+
+
+TOKENIZER_ENGINES = {"state": HTMLTokenizer, "regex": RegexHTMLTokenizer}
+
+
+def create_tokenizer(options: Options = Options()) -> HTMLTokenizer:
+    return TOKENIZER_ENGINES[options.tokenizer_engine](options)
@@ -0,0 +1,284 @@
+"""
+Transcriber benchmark over a reproducible synthetic corpus.
+
+Usage (from the PyWST directory):
+    python3 -m tools.benchmark                          # Print results
+    python3 -m tools.benchmark --save baseline.json     # Store results as a baseline
+    python3 -m tools.benchmark --baseline baseline.json # Exit with 1 if any stage regressed
+
+Every stage of the transcription is timed separately, the best of --repeat runs is kept.
+Stages pass tokens to each other one by one, the time spent producing every token is added
+to its stage, which makes profiled runs slightly slower than plain ones.
+Peak memory of the whole transcription is measured in a separate run with tracemalloc,
+so it does not affect timings.
+"""
+
+from parsing.html_to_js import _transcribe
+from utilities import get_options, Options
+from tools.profiling import Profile
+from typing import Optional, Union
+from pathlib import Path
+import tracemalloc
+import argparse
+import platform
+import random
+import json
+import sys
+
+STAGES = ["tokenize", "merge_data", "tokenize_tags", "generate_js", "stringify"]
+
+_WORDS = [
+    "lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do", "eiusmod",
+    "tempor", "incididunt", "ut", "labore", "et", "dolore", "magna", "aliqua", "&amp;", "&pound;", "&lt;"
+]
+
+_TAILWIND = [
+    "flex", "grid", "items-center", "justify-between", "p-4", "px-6", "py-2", "m-2", "mt-4", "rounded-lg",
+    "shadow-md", "bg-white", "bg-slate-100", "text-sm", "text-gray-700", "font-semibold", "hover:bg-sky-700",
+    "dark:bg-slate-800", "md:flex-row", "lg:w-1/2", "transition", "duration-150", "ease-in-out", "border"
+]
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def _classes(rng: random.Random, amount: int) -> str:
+    return " ".join(rng.sample(_TAILWIND, amount))
+
+
+def component(rng: random.Random) -> str:
+    return "\n".join([
+        "<!DOCTYPE html>",
+        f'<div class="{_classes(rng, 4)}">',
+        f'\t<h2 class="{_classes(rng, 3)}">{_text(rng, 4)}</h2>',
+        f"\t<p>{_text(rng, 20)}</p>",
+        f'\t<img src="img/{rng.randrange(100)}.png" alt="{_text(rng, 2)}">',
+        f'\t<button type="button" onclick="select(evt)" disabled>{_text(rng, 1)}</button>',
+        "</div>", ""
+    ])
+
+
+def nested_svg(rng: random.Random, depth: int = 60, paths: int = 8) -> str:
+    lines = ['<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24" fill="none">']
+    for level in range(depth):
+        lines.append("\t" * (level + 1) + f'<g transform="translate({rng.randrange(24)} {rng.randrange(24)})">')
+        for _ in range(paths):
+            d = " ".join(f"L{rng.randrange(24)} {rng.randrange(24)}" for _ in range(6))
+            lines.append("\t" * (level + 2) + f'<path stroke-linecap="round" d="M0 0 {d} Z"></path>')
+    for level in reversed(range(depth)):
+        lines.append("\t" * (level + 1) + "</g>")
+    lines.append("</svg>")
+    return "\n".join(["<div>", *lines, "</div>", ""])
+
+
+def attribute_heavy(rng: random.Random, rows: int = 400) -> str:
+    lines = [f'<section class="{_classes(rng, 8)}">']
+    for i in range(rows):
+        lines.append(
+            f'\t<div id="row-{i}" class="{_classes(rng, 12)}" data-index="{i}" aria-label="{_text(rng, 3)}" '
+            f'role="listitem" tabindex="0" style="width: {rng.randrange(100)}%;">'
+        )
+        lines.append(f'\t\t<span class="{_classes(rng, 6)}" hidden>{_text(rng, 2)}</span>')
+        lines.append("\t</div>")
+    lines.append("</section>")
+    return "\n".join(lines + [""])
+
+
+def long_text(rng: random.Random, paragraphs: int = 200) -> str:
+    lines = ["<article>"]
+    for _ in range(paragraphs):
+        lines.append("\t<p>")
+        for _ in range(8):
+            lines.append(f"\t\t{_text(rng, 30)}")
+        lines.append("\t</p>")
+    lines.append("</article>")
+    return "\n".join(lines + [""])
+
+
+def inline_scripts(rng: random.Random, scripts: int = 150) -> str:
+    lines = ["<div>"]
+    for i in range(scripts):
+        lines.append(f"\t<script>var v{i} = {rng.randrange(1000)};</script>")
+        lines.append("\t<script>")
+        for j in range(20):
+            lines.append(f"\t\tfunction f{i}_{j}(a, b) " "{ " f"return a * {j} + b; " "}")
+        lines.append("\t</script>")
+        lines.append(f"\t<p>{_text(rng, 10)}</p>")
+    lines.append("</div>")
+    return "\n".join(lines + [""])
+
+
+def scraped_page(rng: random.Random, size: int = 2 << 20) -> str:
+    # Mix of everything above, similar to a page saved from a browser
+    parts = ["<!DOCTYPE html>\n<div>\n"]
+    length = 0
+    while length < size:
+        part = rng.choice([
+            component(rng).replace("<!DOCTYPE html>\n", ""), nested_svg(rng, 4, 2), attribute_heavy(rng, 5),
+            long_text(rng, 3), "<!-- " + _text(rng, 10) + " -->\n"
+        ])
+        parts.append(part)
+        length += len(part)
+    parts.append("</div>\n")
+    return "".join(parts)
+
+
+def generate_corpus(seed: int = 0, scale: float = 1) -> dict[str, str]:
+    # The same seed and scale always generate the same files
+    rng = random.Random(seed)
+    corpus = {f"component_{i}": component(rng) for i in range(int(50 * scale) or 1)}
+    corpus["nested_svg"] = nested_svg(rng, int(60 * scale) or 1)
+    corpus["attribute_heavy"] = attribute_heavy(rng, int(400 * scale) or 1)
+    corpus["long_text"] = long_text(rng, int(200 * scale) or 1)
+    corpus["inline_scripts"] = inline_scripts(rng, int(150 * scale) or 1)
+    corpus["scraped_page"] = scraped_page(rng, int((2 << 20) * scale) or 1)
+    return corpus
+
+
+def _category(name: str) -> str:
+    return "components" if name.startswith("component_") else name
+
+
+def _html_data(data: str, options: Options) -> Union[str, list[str]]:
+    return data if options.tokenize_whole_file else data.splitlines(keepends=True)
+
+
+def run_stages(name: str, data: str, options: Options) -> dict[str, float]:
+    # Seconds spent in every stage of a single transcription
+    profile = Profile(name)
+    code = _transcribe(_html_data(data, options), name, None, options, profile=profile)
+    with profile.stage("stringify"):
+        str(code)
+    return {stage: profile.stages.get(stage, 0) for stage in STAGES}
+
+
+def peak_memory(name: str, data: str, options: Options) -> int:
+    data = _html_data(data, options)
+    tracemalloc.start()
+    try:
+        str(_transcribe(data, name, None, options))
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(corpus: dict[str, str], options: Options, repeat: int = 3) -> dict[str, dict]:
+    # Results grouped by category, times are the sum of the best run of every file
+    results = {}
+    for name, data in corpus.items():
+        best = None
+        for _ in range(repeat):
+            times = run_stages(name, data, options)
+            best = times if best is None else {stage: min(best[stage], times[stage]) for stage in STAGES}
+
+        category = results.setdefault(_category(name), {"files": 0, "bytes": 0, "peak_memory": 0, "stages": {}})
+        category["files"] += 1
+        category["bytes"] += len(data.encode())
+        category["peak_memory"] = max(category["peak_memory"], peak_memory(name, data, options))
+        for stage in STAGES:
+            category["stages"][stage] = category["stages"].get(stage, 0) + best[stage]
+
+    for category in results.values():
+        category["total"] = sum(category["stages"].values())
+        category["throughput"] = category["bytes"] / category["total"] if category["total"] else 0
+
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_time: float = 0.005) -> list[str]:
+    # Returns a message for every stage or peak memory that got worse than the tolerance allows,
+    # stages faster than min_time seconds are too noisy to compare
+    regressions = []
+    for category, result in results.items():
+        if category not in baseline:
+            continue
+
+        old = baseline[category]
+        for stage in STAGES:
+            if stage not in old["stages"]:
+                continue  # Stored before the stage was named like this
+
+            new_time, old_time = result["stages"][stage], old["stages"][stage]
+            if max(new_time, old_time) >= min_time and new_time > old_time * (1 + tolerance):
+                regressions.append(f"{category}.{stage}: {old_time * 1000:.1f} ms -> {new_time * 1000:.1f} ms")
+
+        if result["peak_memory"] > old["peak_memory"] * (1 + tolerance):
+            regressions.append(
+                f"{category}.peak_memory: {old['peak_memory'] / 1024:.0f} KiB -> {result['peak_memory'] / 1024:.0f} KiB"
+            )
+
+    return regressions
+
+
+def print_results(results: dict):
+    header = f"{'category':<16}{'files':>6}{'KiB':>9}" + "".join(f"{stage:>20}" for stage in STAGES)
+    print(header + f"{'total ms':>10}{'MiB/s':>8}{'peak KiB':>10}")
+    for category, result in results.items():
+        stages = "".join(f"{result['stages'][stage] * 1000:>20.1f}" for stage in STAGES)
+        print(
+            f"{category:<16}{result['files']:>6}{result['bytes'] / 1024:>9.0f}{stages}{result['total'] * 1000:>10.1f}"
+            f"{result['throughput'] / (1 << 20):>8.2f}{result['peak_memory'] / 1024:>10.0f}"
+        )
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args_parser = argparse.ArgumentParser(prog="benchmark", description="PyWST transcriber benchmark")
+    args_parser.add_argument("--seed", type=int, default=0, help="Seed used to generate the corpus")
+    args_parser.add_argument("--scale", type=float, default=1, help="Multiplier for the size of the corpus")
+    args_parser.add_argument("--repeat", type=int, default=3, help="Runs per file, the fastest one is kept")
+    args_parser.add_argument("--engine", choices=["state", "regex"], help="HTML tokenizer implementation")
+    args_parser.add_argument("--wholefile", action="store_true", help="Tokenize every file as a single buffer")
+    args_parser.add_argument("--output", choices=["elements", "template"], help="Output mode")
+    args_parser.add_argument("--save", type=Path, help="Store results as a baseline")
+    args_parser.add_argument("--baseline", type=Path, help="Compare results against a stored baseline")
+    args_parser.add_argument("--tolerance", type=float, default=0.25,
+                             help="Allowed slowdown against the baseline, 0.25 is 25%%")
+    args_parser.add_argument("--corpus", type=Path, help="Also write the corpus HTML files to this directory")
+    arguments = args_parser.parse_args(argv)
+
+    config = {"TOKENIZE_WHOLE_FILE": arguments.wholefile}
+    if arguments.engine is not None:
+        config["TOKENIZER_ENGINE"] = arguments.engine
+    if arguments.output is not None:
+        config["OUTPUT_MODE"] = arguments.output
+    options = get_options(config)
+
+    corpus = generate_corpus(arguments.seed, arguments.scale)
+    if arguments.corpus is not None:
+        arguments.corpus.mkdir(parents=True, exist_ok=True)
+        for name, data in corpus.items():
+            arguments.corpus.joinpath(f"{name}.html").write_text(data)
+
+    results = benchmark(corpus, options, arguments.repeat)
+    print_results(results)
+
+    if arguments.save is not None:
+        with open(arguments.save, "w") as f:
+            json.dump({
+                "seed": arguments.seed, "scale": arguments.scale, "options": options._asdict(),
+                "python": platform.python_version(), "results": results
+            }, f, indent=2)
+
+    if arguments.baseline is None:
+        return 0
+
+    with open(arguments.baseline, "r") as f:
+        baseline = json.load(f)
+
+    if baseline["seed"] != arguments.seed or baseline["scale"] != arguments.scale:
+        print("Baseline was generated with a different corpus", file=sys.stderr)
+        return 1
+
+    if baseline["options"] != options._asdict():
+        print("Warning: baseline was generated with different options", file=sys.stderr)
+
+    regressions = compare(results, baseline["results"], arguments.tolerance)
+    for regression in regressions:
+        print(f"Regression in {regression}", file=sys.stderr)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+from parsing.html_to_js import HELPERS, Subtrees, component_name, shared_function
+from typing import NamedTuple, Iterator, Iterable, Optional
+from utilities import Options, OutputFile
+from tools.code import Code, indent
+from pathlib import Path
+
+
+class BundledComponent(NamedTuple):
+    name: str
+    code: str
+    helpers: frozenset[str]
+    # Names of the shared functions it calls
+    shared: frozenset[str] = frozenset()
+
+
+def _inside_shared(parents: dict[int, Optional[int]], shared: dict[int, str], element_id: int) -> bool:
+    parent = parents[element_id]
+    while parent is not None:
+        if parent in shared:
+            return True
+        parent = parents[parent]
+    return False
+
+
+def share_subtrees(
+        subtrees: dict[Path, Subtrees], options: Options = Options(), reserved: Iterable[str] = ()
+) -> tuple[dict[Path, dict[int, str]], dict[str, str]]:
+    """
+    Picks the subtrees repeated across the components of a bundle that are created by shared functions.
+
+    Bigger subtrees are picked first, a subtree is shared when it's found at least twice outside
+    the ones already picked. Functions are named after the digest of their subtree, so components
+    transcribed in different builds call the same function for the same subtree.
+    Returns the shared function called by every element of each file, and the code of every function.
+    """
+    occurrences: dict[str, list[tuple[Path, int]]] = {}
+    weights: dict[str, int] = {}
+    reserved = set(reserved)
+    for _file in sorted(subtrees):
+        reserved |= subtrees[_file].identifiers
+        for element_id, digest, weight in subtrees[_file].found:
+            occurrences.setdefault(digest, []).append((_file, element_id))
+            weights[digest] = weight
+
+    shared: dict[Path, dict[int, str]] = {_file: {} for _file in subtrees}
+    functions: dict[str, str] = {}
+    repeated = [digest for digest, found in occurrences.items() if len(found) > 1]
+    for digest in sorted(repeated, key=lambda d: (-weights[d], d)):
+        found = [(_f, i) for _f, i in occurrences[digest] if not _inside_shared(subtrees[_f].parents, shared[_f], i)]
+        if len(found) < 2:
+            continue
+
+        length = 8
+        while f"shared_{digest[:length]}" in reserved:
+            length += 1
+        name = f"shared_{digest[:length]}"
+        functions[name] = shared_function(name, subtrees[found[0][0]].nodes, digest, options, reserved)
+        for _f, element_id in found:
+            shared[_f][element_id] = name
+
+    return shared, functions
+
+
+class Bundle:
+    """
+    Components of a config block written into a single script.
+
+    Components are defined inside a function, so their names can't clash with other scripts,
+    and are exposed as properties of window.<namespace>, the namespace is named after the
+    bundle file. Helper functions are written once, and components are written in the order
+    of their file paths, so the same files always produce the same bundle.
+    Shared functions are kept from every build, only the ones called by components are written.
+    """
+
+    def __init__(self, output: Path, minify: bool = False):
+        self.output: Path = output
+        self.namespace: str = component_name(output.name)
+        self.minify: bool = minify
+        self.components: dict[Path, BundledComponent] = {}
+        self.shared_functions: dict[str, str] = {}
+
+    def add(self, _file: Path, component: BundledComponent):
+        for other, c in self.components.items():
+            if other != _file and c.name == component.name:
+                raise ValueError(
+                    f"{_file.name} and {other.name} would both define '{component.name}' in {self.output.name}"
+                )
+
+        self.components[_file] = component
+
+    def _indented(self, code: str) -> str:
+        if self.minify:
+            return code
+        return "\n".join(indent + line if line else line for line in code.split("\n"))
+
+    def _chunks(self) -> Iterator[str]:
+        yield "(function (ns) {"
+
+        helpers = Code(minify=self.minify)
+        for name in sorted(set().union(*[c.helpers for c in self.components.values()])):
+            helpers.append_all(HELPERS[name])
+        if helpers.source:
+            yield self._indented(str(helpers))
+
+        components = [self.components[_file] for _file in sorted(self.components)]
+        for name in sorted(set().union(*[c.shared for c in components])):
+            yield self._indented(self.shared_functions[name])
+
+        for c in components:
+            yield self._indented(c.code)
+
+        yield self._indented(("" if self.minify else "\n").join(f"ns.{c.name} = {c.name};" for c in components))
+        yield f"}})(window.{self.namespace} = window.{self.namespace} || {{}});"
+
+    def write(self) -> str:
+        # Returns the SHA-256 of the bundle
+        output = OutputFile(self.output)
+        try:
+            output.write(("" if self.minify else "\n").join(self._chunks()))
+        except BaseException:
+            output.discard()
+            raise
+
+        return output.commit()
+
+    def report(self) -> dict:
+        # Size of every component in bytes, biggest first
+        sizes = [
+            {"component": c.name, "file": str(_file), "bytes": len(c.code.encode())}
+            for _file, c in self.components.items()
+        ]
+        sizes.sort(key=lambda size: size["bytes"], reverse=True)
+        return {
+            "bundle": str(self.output), "namespace": self.namespace, "bytes": self.output.stat().st_size,
+            "components": sizes
+        }
@@ -0,0 +1,142 @@
+from typing import Optional
+from pathlib import Path
+import threading
+import hashlib
+import json
+import time
+import os
+
+
+# Manifests of CLI runs, one for every directory whose files are transcribed
+MANIFESTS_DIR = Path.home().joinpath(".cache", "pywst", "manifests")
+# Once the manifests inside MANIFESTS_DIR take more bytes, the least recently used are removed
+MANIFESTS_MAX_BYTES = 32 * 1024 * 1024
+
+
+def digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def project_manifest(project: Path) -> Path:
+    return MANIFESTS_DIR.joinpath(digest(str(project.resolve()).encode())[:32] + ".json")
+
+
+def evict_manifests(directory: Path, max_bytes: int, keep: Path):
+    # Removes the manifests of directory used the longest time ago until they take at most max_bytes, keep stays
+    manifests = []
+    for entry in os.scandir(directory):
+        try:
+            if entry.name.endswith(".json") and entry.is_file():
+                st = entry.stat()
+                manifests.append((st.st_mtime, st.st_size, entry.path))
+        except OSError:
+            pass  # Removed by another run
+
+    total = sum(size for _, size, _ in manifests)
+    for _, size, path in sorted(manifests):
+        if total <= max_bytes:
+            break
+        if path != str(keep):
+            Path(path).unlink(missing_ok=True)
+            total -= size
+
+
+class BuildCache:
+    """
+    Persistent manifest that maps every transcribed file to the hash of its contents
+    plus the options used, and to the hash of the generated output.
+
+    Files whose contents, options and output did not change since the last run are skipped.
+    Once the manifest holds more than max_entries files, the least recently used are evicted.
+    With max_directory_bytes, the manifest shares its directory with others, and the least
+    recently used manifests are removed once they take more bytes, see evict_manifests.
+    """
+
+    def __init__(
+            self, manifest: Path, version: str, max_entries: int = 50000, max_directory_bytes: Optional[int] = None
+    ):
+        self.manifest: Path = manifest
+        self.version: str = version
+        self.max_entries: int = max_entries
+        self.max_directory_bytes: Optional[int] = max_directory_bytes
+        self.entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._changed = False
+
+        try:
+            with open(manifest, "r") as f:
+                data = json.load(f)
+            if data["version"] == version:
+                self.entries = data["entries"]
+            if max_directory_bytes is not None:
+                os.utime(manifest)  # Reading it counts as using it
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def check(self, _file: Path, output: Path, options_key: str) -> Optional[dict]:
+        # Returns None when output is up-to-date, otherwise the entry to store once transcribed
+        st = _file.stat()
+        file_stat = [st.st_mtime_ns, st.st_size]
+        with self._lock:
+            entry = self.entries.get(str(_file))
+
+        if entry is not None and entry["stat"] == file_stat:
+            file_digest = entry["digest"]
+        else:
+            file_digest = digest(_file.read_bytes())
+
+        key = digest(f"{file_digest}{options_key}".encode())
+        pending = {"stat": file_stat, "digest": file_digest, "key": key}
+        if entry is None or entry["key"] != key or entry["output"] != str(output):
+            return pending
+
+        try:
+            st = output.stat()
+        except OSError:
+            return pending
+
+        output_stat = [st.st_mtime_ns, st.st_size]
+        if output_stat != entry["output_stat"] and digest(output.read_bytes()) != entry["output_digest"]:
+            return pending
+
+        with self._lock:
+            entry["output_stat"] = output_stat
+            entry["used"] = time.time()
+            self._changed = True
+
+        return None
+
+    def store(self, _file: Path, pending: dict, output: Path, output_digest: str):
+        st = output.stat()
+        entry = dict(pending)
+        entry.update({
+            "output": str(output), "output_stat": [st.st_mtime_ns, st.st_size], "output_digest": output_digest,
+            "used": time.time()
+        })
+
+        with self._lock:
+            self.entries[str(_file)] = entry
+            self._changed = True
+
+    def save(self):
+        with self._lock:
+            if not self._changed:
+                return
+
+            if len(self.entries) > self.max_entries:
+                by_use = sorted(self.entries.items(), key=lambda item: item[1]["used"], reverse=True)
+                self.entries = dict(by_use[:self.max_entries])
+
+            data = json.dumps({"version": self.version, "entries": self.entries})
+            self._changed = False
+
+        # Watched blocks save from several threads
+        with self._save_lock:
+            self.manifest.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.manifest.with_name(f"{self.manifest.name}.tmp")
+            with open(tmp, "w") as f:
+                f.write(data)
+            os.replace(tmp, self.manifest)
+            if self.max_directory_bytes is not None:
+                evict_manifests(self.manifest.parent, self.max_directory_bytes, self.manifest)
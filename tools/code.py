@@ -1,14 +1,34 @@
+from tools.profiling import Profile, stage
+from tools.minify import Minifier
+from typing import Optional, TextIO
 
 indent = "    "
 
 
 class Code:
-    def __init__(self):
+    def __init__(
+            self, stream: Optional[TextIO] = None, minify: bool = False, profile: Optional[Profile] = None,
+            minifier: Optional[Minifier] = None
+    ):
         self.source: list = list()
         self.indent_times = 0
-        self.minify = False
+        self.minify = minify
+        # If minify, lines are minified as they're appended
+        self.minifier: Optional[Minifier] = None
+        if minify:
+            self.minifier = minifier if minifier is not None else Minifier()
+        # If present, lines are written to stream as they're appended instead of being kept in source
+        self.stream: Optional[TextIO] = stream
+        self._lines_written = 0
+        self.profile: Optional[Profile] = profile
 
     def append_line(self, line: str):
+        if self.minifier is not None:
+            self.source.append(self.minifier.line(line))
+            if self.stream is not None and len(self.source) >= 512:
+                self.flush()
+            return
+
         if line.endswith("}") or line.startswith("}"):
             self.indent_times -= 1
 
@@ -17,6 +37,8 @@ class Code:
             line = line[1:]
 
         self.source.append(("\n" if extra_newline else "") + f"{indent * self.indent_times}{line}")
+        if self.stream is not None and len(self.source) >= 512:
+            self.flush()
 
         for struct in ["if", "for", "while", "function"]:
             # if not re.sub(struct + r" *?\(.+?\) *?{?.*?", "", line):
@@ -34,14 +56,23 @@ class Code:
     def modify_indent(self, increase: bool):
         self.indent_times += 1 if increase else -1
 
+    def flush(self):
+        # Writes pending lines to stream
+        if self.stream is None or not self.source:
+            return
+
+        with stage(self.profile, "stringify"):
+            chunk = str(self)
+            if not self.minify and self._lines_written:
+                chunk = "\n" + chunk
+
+        with stage(self.profile, "write"):
+            self.stream.write(chunk)
+        self._lines_written += len(self.source)
+        self.source.clear()
+
     def __str__(self):
         if self.minify:
-            min_source = []
-            for line in self.source:
-                if not line:
-                    continue
-                min_source.append(line.strip())
-
-            return "".join(min_source)
+            return "".join(self.source)
 
         return "\n".join(self.source)
@@ -0,0 +1,222 @@
+from typing import NamedTuple, Optional, Iterable, Iterator
+import itertools
+import string
+import re
+
+KEYWORDS = frozenset([
+    "await", "break", "case", "catch", "class", "const", "continue", "debugger", "default", "delete", "do", "else",
+    "enum", "export", "extends", "false", "finally", "for", "function", "if", "implements", "import", "in",
+    "instanceof", "interface", "let", "new", "null", "package", "private", "protected", "public", "return", "static",
+    "super", "switch", "this", "throw", "true", "try", "typeof", "var", "void", "while", "with", "yield", "arguments",
+    "eval", "undefined", "NaN", "Infinity"
+])
+
+# Globals used by generated code
+_GLOBALS = frozenset(["document", "window", "globalThis", "Object", "evt"])
+
+# Identifiers created by the transcriber, these are the only ones renamed
+_INTERNAL = re.compile(r"e\d+(?:_params|_changes)?|myElementToRepl|htmlScripts|currentScript|__i")
+
+_TOKEN = re.compile(r"""'(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*"|`(?:\\.|[^`\\])*`|[A-Za-z_$][\w$]*|\d+|\s+|.""")
+_WORD = re.compile(r"[\w$]")
+
+
+class _Shape(NamedTuple):
+    # A statement generated by the transcriber, groups in names hold identifiers
+    pattern: str
+    names: tuple[int, ...]
+    inline: str
+    alias: Optional[str] = None
+    definition: Optional[str] = None
+
+
+_SVG = "'http://www.w3.org/2000/svg'"
+
+# Written as {alias} inside the function that uses them, definitions are hoisted
+_SHAPES = {
+    "createElement": _Shape(
+        r"const (\w+) = document\.createElement\(('[^'\\]*')\);", (1,),
+        "const {1}=document.createElement({2})", "const {1}={alias}({2})",
+        "function {alias}(t){{return document.createElement(t)}}"
+    ),
+    "createElementNS": _Shape(
+        r"const (\w+) = document\.createElementNS\(" + re.escape(_SVG) + r", ('[^'\\]*')\);", (1,),
+        "const {1}=document.createElementNS(" + _SVG + ",{2})", "const {1}={alias}({2})",
+        "function {alias}(t){{return document.createElementNS(" + _SVG + ",t)}}"
+    ),
+    "createTextNode": _Shape(
+        r"(\w+)\.appendChild\(document\.createTextNode\((.+)\)\);", (1,),
+        "{1}.appendChild(document.createTextNode({2}))", "{alias}({1},{2})",
+        "function {alias}(p,v){{p.appendChild(document.createTextNode(v))}}"
+    ),
+    "appendChild": _Shape(
+        r"(\w+)\.appendChild\((\w+)\);", (1, 2),
+        "{1}.appendChild({2})", "{alias}({1},{2})", "function {alias}(p,c){{p.appendChild(c)}}"
+    ),
+    "setAttribute": _Shape(
+        r"""(\w+)\.setAttribute\(('[^'\\]*'|"[^"\\]*"), (.+)\);""", (1,),
+        "{1}.setAttribute({2},{3})", "{alias}({1},{2},{3})", "function {alias}(e,n,v){{e.setAttribute(n,v)}}"
+    ),
+    "addEventListener": _Shape(
+        # The listener is written by the user, so it's kept as is
+        r"(\w+)\.addEventListener\(('\w+'), \(evt\) => (.*)\);", (1,),
+        "{1}.addEventListener({2},(evt)=>{3})", "{alias}({1},{2},(evt)=>{3})",
+        "function {alias}(e,...a){{e.addEventListener(...a)}}"
+    ),
+    "childNodes": _Shape(
+        r"const (\w+) = (\w+)\.childNodes\[(\d+)];", (1, 2), "const {1}={2}.childNodes[{3}]"
+    ),
+    "nodeValue": _Shape(
+        r"(\w+)((?:\.childNodes\[\d+])?)\.nodeValue = (.+);", (1,), "{1}{2}.nodeValue={3}"
+    )
+}
+
+# Matches any shape, the groups of a shape follow the one named after it
+_STATEMENT = re.compile("|".join(f"(?P<{shape_name}>{shape.pattern})" for shape_name, shape in _SHAPES.items()))
+_GROUPS = {}
+for _name, _shape in _SHAPES.items():
+    _GROUPS[_name] = (_STATEMENT.groupindex[_name], _STATEMENT.groupindex[_name] + re.compile(_shape.pattern).groups)
+
+
+def _short_names() -> Iterator[str]:
+    for length in itertools.count(1):
+        for first in string.ascii_letters:
+            for rest in itertools.product(string.ascii_letters + string.digits, repeat=length - 1):
+                yield first + "".join(rest)
+
+
+class Minifier:
+    """
+    Minifies code generated by the transcriber one line at a time, so it can be streamed.
+
+    Besides removing whitespace and redundant semicolons, inside the function named scope
+    internal identifiers are shortened, consecutive const declarations are merged and DOM
+    calls repeated on every element go through short functions defined at its end.
+    A short function is only used once its calls have saved more than its definition takes.
+
+    Names in reserved are never given, they must include every identifier user code
+    (event listeners and ${} expressions) might refer to.
+    """
+
+    def __init__(self, scope: Optional[str] = None, reserved: Iterable[str] = ()):
+        self.scope: Optional[str] = scope
+        self.reserved: set[str] = set(reserved) | KEYWORDS | _GLOBALS
+        if scope is not None:
+            self.reserved.add(scope)
+
+        self.names: dict[str, str] = {}
+        self.aliases: dict[str, str] = {}
+        self.calls: dict[str, int] = {}
+        self._short_names = _short_names()
+        self.depth = 0
+        self.scope_depth: Optional[int] = None
+        # Written before the next statement
+        self.separator = ""
+        self.const = False
+
+    def _new_name(self) -> str:
+        for name in self._short_names:
+            if name not in self.reserved and not _INTERNAL.fullmatch(name):
+                return name
+
+    def _rename(self, name: str) -> str:
+        renamed = self.names.get(name)
+        if renamed is None:
+            # Other identifiers are kept, but also stored to skip matching them again
+            renamed = self._new_name() if _INTERNAL.fullmatch(name) else name
+            self.names[name] = renamed
+        return renamed
+
+    def _alias(self, shape_name: str, shape: _Shape, groups: list) -> Optional[str]:
+        # Calls written in full until they would have saved the size of the definition
+        calls = self.calls.get(shape_name, 0) + 1
+        self.calls[shape_name] = calls
+        saving = len(shape.inline.format(*groups)) - len(shape.alias.format(*groups, alias="a"))
+        if saving * calls <= 3 * len(shape.definition.format(alias="a")):
+            return None
+
+        self.aliases[shape_name] = self._new_name()
+        return self.aliases[shape_name]
+
+    def _statement(self, line: str) -> str:
+        if self.scope_depth is not None:
+            match = _STATEMENT.fullmatch(line)
+            if match is not None:
+                shape_name = match.lastgroup
+                shape = _SHAPES[shape_name]
+                start, end = _GROUPS[shape_name]
+                groups = [None, *match.groups()[start:end]]
+                for i in shape.names:
+                    groups[i] = self._rename(groups[i])
+
+                alias = self.aliases.get(shape_name)
+                if alias is None and shape.alias is not None:
+                    alias = self._alias(shape_name, shape, groups)
+                if alias is None:
+                    return shape.inline.format(*groups)
+                return shape.alias.format(*groups, alias=alias)
+
+        words = []
+        after_dot = False
+        for token in _TOKEN.finditer(line):
+            text = token.group()
+            if text[0].isspace():
+                continue
+
+            if len(text) == 1 and text in "'\"`":
+                # Unterminated string, the rest is kept as is
+                words.append(line[token.start():].rstrip(";"))
+                break
+
+            if self.scope_depth is not None and not after_dot and _WORD.match(text):
+                text = self._rename(text)
+            after_dot = text == "."
+
+            if words and _WORD.match(text[0]) and _WORD.match(words[-1][-1]):
+                words.append(" ")
+            words.append(text)
+
+        if words and words[-1] == ";":
+            words.pop()
+        return "".join(words)
+
+    def _helpers(self) -> str:
+        return "".join(_SHAPES[shape_name].definition.format(alias=alias) for shape_name, alias in self.aliases.items())
+
+    def line(self, line: str) -> str:
+        # Returns the minified line, the semicolon ending it is only written if another statement follows
+        line = line.strip()
+        if not line:
+            return ""
+
+        separator = self.separator
+        if line[0] == "}":
+            self.depth -= 1
+            separator = ""
+            if self.depth == self.scope_depth:
+                # The hoisted definitions are written when the function ends
+                helpers = self._helpers()
+                if helpers:
+                    separator = self.separator + helpers
+                self.scope_depth = None
+
+        statement = self._statement(line)
+        opens = line[-1] == "{"
+        if opens:
+            if self.depth == 0 and self.scope is not None and line.startswith(f"function {self.scope}("):
+                self.scope_depth = 0
+            self.depth += 1
+
+        declares = statement[:6] in ("const ", "const{")
+        if declares and self.const and separator == ";":
+            separator = ","
+            statement = statement[5:].lstrip()
+
+        if opens or line == "}":
+            self.separator = ""
+            self.const = False
+        else:
+            self.separator = ";"
+            self.const = declares
+
+        return separator + statement
@@ -0,0 +1,88 @@
+from contextlib import contextmanager, nullcontext
+from typing import Optional, Iterator, Iterable, TypeVar
+import time
+
+# Stages in the order they run, JS generation doesn't include the time
+# spent turning code into text and writing it while streaming
+STAGES = ["read", "tokenize", "merge_data", "tokenize_tags", "generate_js", "stringify", "write"]
+
+
+class Profile:
+    """
+    Time spent in every stage of the transcription of a single file, plus some counts.
+
+    Stages can be nested, the time of an inner stage is not added to the outer one.
+    """
+
+    def __init__(self, name: str):
+        self.name: str = name
+        self.stages: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+        self.transcribed = False
+        self._children: list[float] = []
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        self._children.append(0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self._children.pop()
+            self.stages[name] = self.stages.get(name, 0) + elapsed - children
+            if self._children:
+                self._children[-1] += elapsed
+
+    def count(self, name: str, amount: int = 1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def to_dict(self) -> dict:
+        return {
+            "file": self.name, "transcribed": self.transcribed, "total": sum(self.stages.values()),
+            "stages": {stage: self.stages[stage] for stage in STAGES if stage in self.stages}, "counts": self.counts
+        }
+
+
+def stage(profile: Optional[Profile], name: str):
+    # Shortcut for code that may run without a profile
+    return nullcontext() if profile is None else profile.stage(name)
+
+
+T = TypeVar("T")
+_END = object()
+
+
+def staged(profile: Optional[Profile], name: str, items: Iterable[T], count: Optional[str] = None) -> Iterator[T]:
+    # Adds the time spent producing every item to a stage, so stages chained as generators are
+    # timed separately. If count is given, the amount of items is added to that count
+    if profile is None:
+        return iter(items)
+    return _staged(profile, name, iter(items), count)
+
+
+def _staged(profile: Profile, name: str, items: Iterator[T], count: Optional[str]) -> Iterator[T]:
+    while True:
+        with profile.stage(name):
+            item = next(items, _END)
+        if item is _END:
+            return
+        if count is not None:
+            profile.count(count)
+        yield item
+
+
+def summarize(profiles: list[dict]) -> dict:
+    # Files are sorted from slowest to fastest
+    stages = {}
+    counts = {}
+    for p in profiles:
+        for name, elapsed in p["stages"].items():
+            stages[name] = stages.get(name, 0) + elapsed
+        for name, amount in p["counts"].items():
+            counts[name] = counts.get(name, 0) + amount
+
+    return {
+        "total": sum(stages.values()), "stages": {name: stages[name] for name in STAGES if name in stages},
+        "counts": counts, "files": sorted(profiles, key=lambda p: p["total"], reverse=True)
+    }
@@ -0,0 +1,449 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Callable
+from utilities import IgnoreRules
+from functools import partial
+from pathlib import Path
+import itertools
+import threading
+import operator
+import asyncio
+import logging
+import signal
+import time
+import os
+
+# Edits are transcribed before the files of the initial build
+_EDIT = 0
+_BUILD = 1
+
+
+_stat_key = operator.attrgetter("st_mtime_ns", "st_size", "st_ino")
+
+
+def _file_key(path: str) -> Optional[tuple[int, int, int]]:
+    try:
+        return _stat_key(os.stat(path))
+    except OSError:
+        return None
+
+
+class StatIndex:
+    """
+    In-memory index of the HTML files inside a directory that finds changes by polling.
+
+    Every file is mapped to its (mtime_ns, size, inode). Directories are only listed
+    again when their own mtime changes, which happens when entries are created, removed
+    or renamed, while files are stat'ed on every rescan since writing to a file doesn't
+    change the mtime of its directory.
+    """
+
+    def __init__(self, directory: Path, rules: IgnoreRules):
+        self.directory = str(directory)
+        self.rules = rules
+        # Every directory is mapped to [(mtime_ns, inode), relative path, files, subdirectories]
+        self._dirs: dict[str, list] = {}
+        self._files: dict[str, tuple[int, int, int]] = {}
+        self._list(self.directory, "", None)
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def _forget(self, directory: str):
+        _, _, files, subdirectories = self._dirs.pop(directory)
+        for _file in files:
+            self._files.pop(_file, None)
+        for subdirectory in subdirectories:
+            if subdirectory in self._dirs:
+                self._forget(subdirectory)
+
+    def _list(self, directory: str, relative: str, changed: Optional[list[str]]):
+        # Lists directory and the new subdirectories inside it, adding the files created since the
+        # last listing to changed. When changed is None, files are indexed without being reported
+        try:
+            key = _stat_key(os.stat(directory))[::2]
+            entries = list(os.scandir(directory))
+        except OSError:
+            if directory in self._dirs:
+                self._forget(directory)
+            return
+
+        previous = self._dirs.get(directory)
+        old_files, old_subdirectories = (previous[2], previous[3]) if previous is not None else (set(), set())
+        files = set()
+        subdirectories = set()
+        for entry in entries:
+            entry_relative = f"{relative}/{entry.name}" if relative else entry.name
+            try:
+                if entry.is_dir():
+                    if not self.rules.ignored(entry_relative, entry.name, True):
+                        subdirectories.add(entry.path)
+                        if entry.path not in old_subdirectories:
+                            self._list(entry.path, entry_relative, changed)
+                elif entry.name.lower().endswith(".html") and entry.is_file():
+                    if not self.rules.ignored(entry_relative, entry.name, False):
+                        files.add(entry.path)
+                        if entry.path not in old_files:
+                            self._files[entry.path] = _stat_key(entry.stat())
+                            if changed is not None:
+                                changed.append(entry.path)
+            except OSError:
+                pass  # Removed while listing, the next rescan lists the directory again
+
+        for _file in old_files - files:
+            self._files.pop(_file, None)
+        for subdirectory in old_subdirectories - subdirectories:
+            if subdirectory in self._dirs:
+                self._forget(subdirectory)
+
+        self._dirs[directory] = [key, relative, files, subdirectories]
+
+    def rescan(self) -> list[str]:
+        # Returns the files created or modified since the last scan
+        changed = []
+        for directory in list(self._dirs):
+            known = self._dirs.get(directory)
+            if known is None:
+                continue  # Inside a directory removed during this rescan
+
+            try:
+                key = _stat_key(os.stat(directory))[::2]
+            except OSError:
+                self._forget(directory)
+                continue
+
+            if key != known[0]:
+                self._list(directory, known[1], changed)
+
+        paths = list(self._files)
+        try:
+            keys = list(map(_stat_key, map(os.stat, paths)))
+        except OSError:
+            keys = [_file_key(path) for path in paths]  # Removed after its directory was checked
+
+        files = self._files
+        for path, key, previous in zip(paths, keys, files.values()):
+            if key != previous and key is not None:
+                files[path] = key
+                changed.append(path)
+
+        return changed
+
+
+class _PollingObserver:
+    """
+    Calls push(path) for every HTML file created or modified inside directory,
+    rescanning its StatIndex every interval seconds from a thread.
+    """
+
+    def __init__(self, directory: Path, rules: IgnoreRules, push: Callable[[str], None], interval: float):
+        self.directory = directory
+        self.rules = rules
+        self.push = push
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+
+    def start(self):
+        # The first scan is done before returning, so no change made afterwards is missed
+        start_time = time.perf_counter()
+        self._index = StatIndex(self.directory, self.rules)
+        elapsed_time = (time.perf_counter() - start_time) * 1000
+        logging.info(f"Polling {len(self._index)} files in {self.directory}, indexed in {elapsed_time: .0f} ms")
+        self._thread.start()
+
+    def _poll(self):
+        warned = False
+        while not self._stopped.wait(self.interval):
+            start_time = time.perf_counter()
+            for path in self._index.rescan():
+                self.push(path)
+
+            elapsed_time = time.perf_counter() - start_time
+            if elapsed_time > self.interval and not warned:
+                warned = True
+                logging.warning(
+                    f"Rescanning {self.directory} took {elapsed_time * 1000: .0f} ms, "
+                    f"consider a longer POLL_INTERVAL or EXCLUDE"
+                )
+
+    def stop(self):
+        self._stopped.set()
+
+    def join(self):
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+class _WatchedDirectory:
+    """
+    Transcribes the files of a watched directory from an asyncio loop.
+
+    Changes are debounced per file, then queued for jobs workers that run
+    process(path, is_current) in a bounded executor. The initial build runs in
+    its own thread and submits files while the directory is already observed,
+    waiting for room in the queue instead of queuing every file at once.
+
+    Edits are queued ahead of the initial build, and the build skips files that
+    were already edited. Changes received while a file is queued are merged,
+    changes received while it's being processed make is_current return False
+    and the file is processed again.
+    """
+
+    def __init__(
+            self, directory: Path, accepts: Callable[[str], Optional[Path]],
+            process: Callable[[Path, Callable[[], bool]], None], build: Callable[[Callable[[Path], bool]], None],
+            built: Optional[Callable[[], None]], delay: float, jobs: int, watcher: str, poll_interval: float,
+            rules: IgnoreRules
+    ):
+        self.directory = directory
+        self.accepts = accepts
+        self.process = process
+        self.build = build
+        self.built = built
+        self.delay = delay
+        self.jobs = jobs
+        self.watcher = watcher
+        self.poll_interval = poll_interval
+        self.rules = rules
+
+        self._generations: dict[Path, int] = {}
+        self._timers: dict[Path, asyncio.TimerHandle] = {}
+        self._queued: set[Path] = set()
+        self._running: set[Path] = set()
+        self._rerun: set[Path] = set()
+        self._order = itertools.count()
+        self._slots = threading.Semaphore(jobs * 2)
+        self._stopping = threading.Event()
+        self._building = 0  # Files of the initial build queued or being processed
+        self._build_done = False
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._executor = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="pywst-watch")
+        self._workers = [loop.create_task(self._work()) for _ in range(self.jobs)]
+
+        self._observer = self._watchdog_observer() if self.watcher != "poll" else None
+        if self._observer is None:
+            self._observer = _PollingObserver(self.directory, self.rules, self._push, self.poll_interval)
+        self._observer.start()
+
+        self._start_time = time.perf_counter()
+        self._builder = threading.Thread(target=self._build, daemon=True)
+        self._builder.start()
+
+    def _watchdog_observer(self):
+        # Returns None with WATCHER = auto when watchdog isn't installed
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            if self.watcher == "watchdog":
+                raise
+            logging.info(f"watchdog isn't installed, polling {self.directory} instead")
+            return None
+
+        watched = self
+
+        class TranscriptEventHandler(FileSystemEventHandler):
+            def on_modified(self, event):
+                if not event.is_directory:
+                    watched._push(event.src_path)
+
+            def on_created(self, event):
+                if not event.is_directory:
+                    watched._push(event.src_path)
+
+            def on_moved(self, event):
+                # Some editors save by renaming a temporary file
+                if not event.is_directory:
+                    watched._push(event.dest_path)
+
+        observer = Observer()
+        observer.schedule(TranscriptEventHandler(), str(self.directory), recursive=True)
+        return observer
+
+    def _push(self, src_path: str):
+        # Called from the observer thread
+        path = self.accepts(src_path)
+        if path is not None and not self._stopping.is_set():
+            self._loop.call_soon_threadsafe(self._changed, path)
+
+    def _changed(self, path: Path):
+        self._generations[path] = self._generations.get(path, 0) + 1
+        timer = self._timers.pop(path, None)
+        if timer is not None:
+            timer.cancel()
+        self._timers[path] = self._loop.call_later(self.delay, self._due, path)
+
+    def _due(self, path: Path):
+        self._timers.pop(path, None)
+        if path in self._running:
+            self._rerun.add(path)
+        elif path not in self._queued:
+            self._queue_path(path, _EDIT)
+
+    def _queue_path(self, path: Path, kind: int):
+        self._queued.add(path)
+        self._queue.put_nowait((kind, next(self._order), path))
+
+    def _build(self):
+        try:
+            self.build(self._submit)
+        except Exception as e:
+            logging.info("Error produced in " + str(self.directory))
+            logging.fatal(e.__str__())
+        finally:
+            if not self._stopping.is_set():
+                self._loop.call_soon_threadsafe(self._build_submitted)
+
+    def _submit(self, path: Path) -> bool:
+        # Called from the build thread, waits until the queue has room.
+        # Returns False once stopping, so the build can end early
+        while not self._slots.acquire(timeout=0.1):
+            if self._stopping.is_set():
+                return False
+
+        if self._stopping.is_set():
+            self._slots.release()
+            return False
+
+        self._loop.call_soon_threadsafe(self._build_path, path)
+        return True
+
+    def _build_path(self, path: Path):
+        if path in self._generations or path in self._queued or path in self._running:
+            self._slots.release()  # Already transcribed or about to be
+            return
+
+        self._building += 1
+        self._queue_path(path, _BUILD)
+
+    def _build_submitted(self):
+        self._build_done = True
+        self._check_built()
+
+    def _check_built(self):
+        if not self._build_done or self._building:
+            return
+
+        self._build_done = False
+        elapsed_time = time.perf_counter() - self._start_time
+        logging.info(f"Initial build of {self.directory} finished in {elapsed_time: .2f} seconds")
+        if self.built is not None:
+            self._loop.run_in_executor(self._executor, self.built)
+
+    def _is_current(self, path: Path, generation: int) -> bool:
+        # Called from the executor, reading a dict doesn't need the loop
+        return self._generations.get(path, 0) == generation
+
+    async def _work(self):
+        while True:
+            kind, _, path = await self._queue.get()
+            self._queued.discard(path)
+            if kind == _BUILD:
+                self._slots.release()
+
+            self._running.add(path)
+            generation = self._generations.get(path, 0)
+            try:
+                await self._loop.run_in_executor(
+                    self._executor, self.process, path, partial(self._is_current, path, generation)
+                )
+            except Exception as e:  # A broken job must not stop the worker
+                logging.info("Error produced in " + str(path))
+                logging.fatal(e.__str__())
+            finally:
+                self._running.discard(path)
+                if kind == _BUILD:
+                    self._building -= 1
+                    self._check_built()
+
+            if path in self._rerun:
+                self._rerun.discard(path)
+                self._queue_path(path, _EDIT)
+
+    async def stop(self):
+        # Queued files are dropped, running jobs are waited for
+        self._stopping.set()
+        self._observer.stop()
+        for timer in self._timers.values():
+            timer.cancel()
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+        await asyncio.to_thread(self._observer.join)
+        await asyncio.to_thread(self._builder.join)
+        await asyncio.to_thread(self._executor.shutdown)
+
+
+class WatchService:
+    """
+    Watches directories and transcribes their files from an asyncio loop until stopped.
+
+    Every directory has its own workers, see _WatchedDirectory.
+    SIGINT and SIGTERM stop the service once running jobs finish.
+    """
+
+    def __init__(self):
+        self._directories: list[_WatchedDirectory] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop_event: Optional[asyncio.Event] = None
+
+    def watch(
+            self, directory: Path, accepts: Callable[[str], Optional[Path]],
+            process: Callable[[Path, Callable[[], bool]], None], build: Callable[[Callable[[Path], bool]], None],
+            built: Optional[Callable[[], None]] = None, delay: float = 0.2, jobs: int = 1, watcher: str = "auto",
+            poll_interval: float = 0.5, rules: Optional[IgnoreRules] = None
+    ):
+        """
+        accepts maps the path of a filesystem event to the file to process, or None to ignore it.
+        build runs in a thread once observing starts and calls submit(path) for every file of
+        the initial build, submit returns False once the service is stopping.
+        built is called when every submitted file was processed.
+        watcher is auto, watchdog or poll, polling skips the directories ignored by rules.
+        """
+        self._directories.append(_WatchedDirectory(
+            directory, accepts, process, build, built, delay, jobs, watcher, poll_interval,
+            rules if rules is not None else IgnoreRules([])
+        ))
+
+    @property
+    def watching(self) -> bool:
+        return bool(self._directories)
+
+    def run(self):
+        # Blocks until stop is called or the process is interrupted
+        if not self._directories:
+            return
+
+        try:
+            asyncio.run(self._run())
+        except KeyboardInterrupt:
+            pass
+
+    async def _run(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        for sig in [signal.SIGINT, signal.SIGTERM]:
+            try:
+                self._loop.add_signal_handler(sig, self._stop_event.set)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass  # Not supported on this platform or outside the main thread
+
+        for directory in self._directories:
+            directory.start(self._loop)
+
+        try:
+            await self._stop_event.wait()
+        finally:
+            logging.info("Stopping, waiting for running jobs to finish")
+            await asyncio.gather(*[directory.stop() for directory in self._directories])
+            logging.info("Stopped watching")
+
+    def stop(self):
+        # Can be called from any thread
+        if self._loop is not None and self._stop_event is not None:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
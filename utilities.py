@@ -1,9 +1,17 @@
+from typing import Optional, NamedTuple, Callable, Iterator
 from argparse import Namespace
-from typing import Optional
-from pathlib import Path
+from pathlib import Path, PurePath
+import tempfile
+import fnmatch
+import hashlib
 import logging
+import json
+import mmap
+import os
 import re
 
+VERSION = "0.0.9-4"
+
 # Setting this property will allow any character inside a closing tag.
 #
 # Normally, all closing tags should only include letters, digits and hyphens,
@@ -20,45 +28,113 @@ IGNORE_MISMATCHING_CLOSING_TAGS = False
 
 # Some pages (mostly old) might include HTML entities to represent
 # UTF-8 characters such as &pound; (£). Setting this property to True will
-# create a function to automatically decode HTML entities when detected.
+# decode HTML entities found in text while transcribing, text using PARAMS
+# is decoded by a function added to the script when the component is created.
 #
 # This depends on the web browser character rendering capabilities.
 #
 AUTOMATICALLY_DECODE_HTML_ENTITIES = True
 
-# Minifying code will reduce file size by removing new lines and indentation.
+# Minifying code will reduce file size by removing new lines and indentation,
+# shortening the names of the variables of components and calling the DOM
+# methods used for every element through short functions.
 #
 # Might improve load times with bigger files.
 #
 MINIFY_CODE = True
 
+# How generated functions create components.
+#
+# "elements" creates every element and attribute on each call, "template" builds
+# the component once and clones it on later calls, only setting parameters and
+# event listeners. Cloning is much faster for components used many times.
+#
+OUTPUT_MODE = "elements"
 
-_PROPERTIES = {
-    "ALLOW_ANYTHING_IN_CLOSE_TAGS": False,
-    "IGNORE_MISMATCHING_CLOSING_TAGS": False,
-    "AUTOMATICALLY_DECODE_HTML_ENTITIES": True,
-    "MINIFY_CODE": True
-}
+# Whether components with PARAMS get an update function.
+#
+# The returned element gets update(newParams), which takes an object with the parameters
+# that changed and only sets the attributes and text that use them, instead of rebuilding
+# the whole component.
+#
+UPDATE_FUNCTION = False
 
+# The implementation used to split HTML into tokens, both produce the same tokens.
+#
+# "state" steps through every character, "regex" jumps between tag boundaries,
+# comments and quotes using compiled regexes, which is much faster on big files.
+#
+TOKENIZER_ENGINE = "regex"
 
-def _set_property(n: int, b: bool):
-    global ALLOW_ANYTHING_IN_CLOSE_TAGS, IGNORE_MISMATCHING_CLOSING_TAGS
-    global AUTOMATICALLY_DECODE_HTML_ENTITIES, MINIFY_CODE
+# Report every problem found in a file at once instead of stopping at the first one.
+#
+# "off" stops at the first problem. "report" recovers from problems, skipping the rest
+# of broken tags and closing mismatched tags, then reports all of them without writing
+# the script, "emit" also writes the best-effort script.
+#
+DIAGNOSTICS = "off"
 
-    if n == 0:
-        ALLOW_ANYTHING_IN_CLOSE_TAGS = b
-    elif n == 1:
-        IGNORE_MISMATCHING_CLOSING_TAGS = b
-    elif n == 2:
-        AUTOMATICALLY_DECODE_HTML_ENTITIES = b
-    else:
-        MINIFY_CODE = b
+# Tokenize every file as a single buffer instead of line by line,
+# big files are memory-mapped and line numbers are only computed for errors.
+#
+# Whitespace-only lines inside text are dropped the same way as line by line.
+#
+TOKENIZE_WHOLE_FILE = False
 
+# Milliseconds watch mode waits for more changes in a file before transcribing it.
+#
+# Editors and tools usually write a file several times when saving.
+#
+WATCH_DELAY = 200
 
-def update_properties(data_block: dict):
-    for i, name_default in enumerate(_PROPERTIES.items()):
-        name, default = name_default
-        _set_property(i, data_block[name] if name in data_block else default)
+# How watch mode finds changes: auto, watchdog or poll.
+#
+# poll rescans watched directories every POLL_INTERVAL milliseconds instead of
+# using watchdog, auto uses watchdog when it's installed.
+#
+WATCHER = "auto"
+POLL_INTERVAL = 500
+
+# Skip files whose contents and options did not change since the last run.
+#
+# The manifest is stored next to the config file. When using CLI arguments, every
+# directory has its own inside ~/.cache/pywst/manifests, the least recently used are
+# removed once they take more than 32 MB.
+#
+CACHE = False
+
+# Directories and files skipped when searching a directory for HTML files, along with
+# the patterns in EXCLUDE and in a .pywstignore file inside the searched directory.
+#
+# Patterns without a slash match any file or directory name, patterns with a slash
+# match the path relative to the searched directory and a trailing slash only
+# matches directories.
+#
+DEFAULT_EXCLUDE = [".git/", ".hg/", ".svn/", "node_modules/", "__pycache__/", ".venv/", "venv/", "dist/", "build/"]
+
+
+_PROPERTIES = [
+    "ALLOW_ANYTHING_IN_CLOSE_TAGS", "IGNORE_MISMATCHING_CLOSING_TAGS", "AUTOMATICALLY_DECODE_HTML_ENTITIES",
+    "MINIFY_CODE", "OUTPUT_MODE", "UPDATE_FUNCTION", "TOKENIZER_ENGINE", "DIAGNOSTICS", "TOKENIZE_WHOLE_FILE"
+]
+
+
+class Options(NamedTuple):
+    # Immutable set of properties used while transcribing a single file,
+    # defaults are the values defined above
+    allow_anything_in_close_tags: bool = ALLOW_ANYTHING_IN_CLOSE_TAGS
+    ignore_mismatching_closing_tags: bool = IGNORE_MISMATCHING_CLOSING_TAGS
+    automatically_decode_html_entities: bool = AUTOMATICALLY_DECODE_HTML_ENTITIES
+    minify_code: bool = MINIFY_CODE
+    output_mode: str = OUTPUT_MODE
+    update_function: bool = UPDATE_FUNCTION
+    tokenizer_engine: str = TOKENIZER_ENGINE
+    diagnostics: str = DIAGNOSTICS
+    tokenize_whole_file: bool = TOKENIZE_WHOLE_FILE
+
+
+def get_options(data_block: dict) -> Options:
+    return Options(**{name.lower(): data_block[name] for name in _PROPERTIES if name in data_block})
 
 
 def remove_whitespace(data: str) -> str:
@@ -67,7 +143,26 @@ def remove_whitespace(data: str) -> str:
     return data
 
 
-def raise_error(data: str, c: str, i: int, line: int = -1):
+class Diagnostic(NamedTuple):
+    # A problem found with DIAGNOSTICS enabled, line is -1 when unknown
+    line: int
+    column: int
+    message: str
+
+
+class DiagnosticsError(ValueError):
+    """
+    Every problem found in a file with DIAGNOSTICS enabled, in the order they appear.
+    """
+
+    def __init__(self, diagnostics: list[Diagnostic]):
+        self.diagnostics: list[Diagnostic] = sorted(diagnostics, key=lambda d: (d.line, d.column))
+        problems = "\n".join("    " + d.message.replace("\n", "\n    ") for d in self.diagnostics)
+        amount = len(self.diagnostics)
+        super().__init__(f"Found {amount} problem{'s' if amount != 1 else ''}\n{problems}")
+
+
+def format_error(data: str, c: str, i: int, line: int = -1) -> str:
     data = remove_whitespace(data)
     c = repr(c)
 
@@ -84,24 +179,163 @@ def raise_error(data: str, c: str, i: int, line: int = -1):
     else:
         ex += f"\n    {data}" + f"\n    " + "-" * (i - 1) + "^"
 
-    raise ValueError(ex)
+    return ex
+
+
+def raise_error(data: str, c: str, i: int, line: int = -1):
+    raise ValueError(format_error(data, c, i, line))
+
+
+_MMAP_THRESHOLD = 1 << 20
+
+
+def read_file(_file: Path) -> str:
+    with open(_file, "rb") as f:
+        if _file.stat().st_size < _MMAP_THRESHOLD:
+            data = f.read().decode()
+        else:
+            # Decoded straight from the mapped pages without an intermediate copy
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                data = str(m, "utf-8")
+
+    if "\r" in data:
+        data = data.replace("\r\n", "\n").replace("\r", "\n")
+
+    return data
+
+
+class OutputFile:
+    """
+    Writable stream that saves text into a temporary file next to _file while hashing it.
+
+    commit() moves it into place unless _file already holds the same bytes,
+    discard() removes the temporary file. Once closed, it can be sent to
+    another process that commits or discards it.
+    """
+
+    def __init__(self, _file: Path):
+        self.file: Path = _file
+        fd, tmp = tempfile.mkstemp(prefix=f".{_file.name}.", suffix=".tmp", dir=_file.parent)
+        self.tmp: Path = Path(tmp)
+        self._f = os.fdopen(fd, "wb")
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.digest: Optional[str] = None
+
+    def write(self, data: str):
+        encoded = data.encode()
+        self._hash.update(encoded)
+        self.size += len(encoded)
+        self._f.write(encoded)
+
+    def close(self) -> str:
+        # Returns the SHA-256 of the written data
+        if self.digest is None:
+            self._f.close()
+            self.digest = self._hash.hexdigest()
+            self._f = self._hash = None
+        return self.digest
+
+    def commit(self) -> str:
+        # Returns the SHA-256 of the written data
+        output_digest = self.close()
+        try:
+            if self.file.stat().st_size == self.size:
+                if hashlib.sha256(self.file.read_bytes()).hexdigest() == output_digest:
+                    self.tmp.unlink()
+                    return output_digest
+        except OSError:
+            pass
+
+        os.replace(self.tmp, self.file)
+        return output_digest
+
+    def discard(self):
+        self.close()
+        self.tmp.unlink(missing_ok=True)
+
+
+class IgnoreRules:
+    """
+    Glob patterns of files and directories skipped when searching for HTML files,
+    see DEFAULT_EXCLUDE for their syntax.
+    """
+
+    def __init__(self, patterns: list[str]):
+        # Every rule is (pattern, matches the relative path, only matches directories)
+        self.rules: list[tuple[str, bool, bool]] = []
+        for pattern in patterns:
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            if pattern:
+                self.rules.append((pattern.lstrip("/"), "/" in pattern, dir_only))
+
+    @classmethod
+    def for_directory(cls, initial_dir: Path, exclude: Optional[list[str]] = None) -> "IgnoreRules":
+        patterns = DEFAULT_EXCLUDE + (exclude or [])
+        try:
+            with open(initial_dir.joinpath(".pywstignore"), "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        patterns.append(line)
+        except OSError:
+            pass
+
+        return cls(patterns)
+
+    def ignored(self, relative: str, name: str, is_dir: bool) -> bool:
+        # relative is the path from the searched directory using slashes
+        for pattern, match_path, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if fnmatch.fnmatch(relative if match_path else name, pattern):
+                return True
+        return False
+
+    def ignored_path(self, relative: PurePath) -> bool:
+        # Whether a file or any of its parent directories is ignored
+        parts = relative.parts
+        for i, name in enumerate(parts):
+            if self.ignored("/".join(parts[:i + 1]), name, i < len(parts) - 1):
+                return True
+        return False
+
+
+def _scan_html_files(directory: str, rules: IgnoreRules) -> Iterator[Path]:
+    # Depth-first search using scandir, relative paths start at directory and use slashes
+    stack = [(directory, "")]
+    while stack:
+        directory, relative = stack.pop()
+        try:
+            entries = sorted(os.scandir(directory), key=lambda e: e.name)
+        except OSError as e:
+            logging.warning(f"Couldn't search {directory}: {e}")
+            continue
 
+        directories = []
+        for entry in entries:
+            entry_relative = f"{relative}/{entry.name}" if relative else entry.name
+            if entry.is_dir():
+                if not rules.ignored(entry_relative, entry.name, True):
+                    directories.append((entry.path, entry_relative))
+            elif entry.name.lower().endswith(".html") and entry.is_file():
+                if not rules.ignored(entry_relative, entry.name, False):
+                    yield Path(entry.path)
 
-def list_html_files(initial_dir: Path) -> list[Path]:
+        stack += reversed(directories)
+
+
+def iter_html_files(initial_dir: Path, exclude: Optional[list[str]] = None) -> Iterator[Path]:
+    # Yields the HTML files inside initial_dir as they're found, skipping the ignored ones
     if not initial_dir.is_dir():
-        return []
+        return
 
-    directories = [initial_dir]
-    files = []
-    while directories:
-        directory = directories.pop(0)
-        for element in directory.iterdir():
-            if element.is_file() and element.suffix.lower() == ".html":
-                files.append(element)
-            elif element.is_dir():
-                directories.append(element)
+    yield from _scan_html_files(str(initial_dir), IgnoreRules.for_directory(initial_dir, exclude))
 
-    return files
+
+def list_html_files(initial_dir: Path, exclude: Optional[list[str]] = None) -> list[Path]:
+    return list(iter_html_files(initial_dir, exclude))
 
 
 def _verify_name(name: str):
@@ -127,9 +361,8 @@ def _valid_js_params(_params: str) -> tuple[list, bool]:
     return params, True
 
 
-def _verify_property(prop_value: str, data: dict) -> any:
-    equal_index = prop_value.index("=")
-    prop, value = prop_value[:equal_index].strip(), prop_value[equal_index + 1:].strip()
+def _verify_property(prop: str, value: str, data: dict) -> any:
+    value = value.strip()
 
     if prop not in ["FILE", "REPL_ID"] and prop in data:
         raise ValueError(f"Duplicated key '{prop}'")
@@ -145,24 +378,6 @@ def _verify_property(prop_value: str, data: dict) -> any:
             raise ValueError(f"Specified PATH is not a directory or doesn't exist in {data['NAME']}\n    {p}")
 
         return p.resolve()
-    elif prop == "FILE":
-        if value == "*":
-            if data['BEHAVIOR'] == "return" or "UN_REPL_ID" in data:
-                return value
-
-            raise ValueError(f"FILE = * is not allowed with behavior = replace or undefined UN_REPL_ID property "
-                             f"for {data['NAME']}")
-
-        p = data['PATH']
-        f = Path(value)
-        if f.exists() and f.is_file():
-            return f.resolve()
-
-        f = p.joinpath(value)
-        if f.exists() and f.is_file():
-            return f.resolve()
-
-        raise ValueError(f"Specified FILE is not a file or doesn't exist in {data['NAME']}\n    {value}")
     elif prop == "REPL_ID" or prop == "UN_REPL_ID":
         if data['BEHAVIOR'] == "return":
             raise ValueError(f"REPL_ID or UN_REPL_ID cannot be used with BEHAVIOR = return for {data['NAME']}")
@@ -175,6 +390,50 @@ def _verify_property(prop_value: str, data: dict) -> any:
 
         raise ValueError(f"Invalid REPL_ID or UN_REPL_ID value '{value}' for {data['NAME']}")
 
+    elif prop == "OUTPUT_MODE":
+        if value not in ["elements", "template"]:
+            raise ValueError(f"Invalid value '{value}' for OUTPUT_MODE in {data['NAME']}")
+
+        return value
+    elif prop == "DIAGNOSTICS":
+        if value not in ["off", "report", "emit"]:
+            raise ValueError(f"Invalid value '{value}' for DIAGNOSTICS in {data['NAME']}")
+
+        return value
+    elif prop == "TOKENIZER_ENGINE":
+        if value not in ["state", "regex"]:
+            raise ValueError(f"Invalid value '{value}' for TOKENIZER_ENGINE in {data['NAME']}")
+
+        return value
+    elif prop == "JOBS":
+        if not value.isdigit() or int(value) < 1:
+            raise ValueError(f"JOBS must be a positive integer, found '{value}' in {data['NAME']}")
+
+        return int(value)
+    elif prop == "WATCH_DELAY":
+        if not value.isdigit():
+            raise ValueError(f"WATCH_DELAY must be an amount of milliseconds, found '{value}' in {data['NAME']}")
+
+        return int(value)
+    elif prop == "WATCHER":
+        if value not in ["auto", "watchdog", "poll"]:
+            raise ValueError(f"Invalid value '{value}' for WATCHER in {data['NAME']}")
+
+        return value
+    elif prop == "POLL_INTERVAL":
+        if not value.isdigit() or int(value) < 1:
+            raise ValueError(f"POLL_INTERVAL must be an amount of milliseconds, found '{value}' in {data['NAME']}")
+
+        return int(value)
+    elif prop == "EXCLUDE":
+        return [pattern.strip() for pattern in value.split(",") if pattern.strip()]
+    elif prop == "BUNDLE":
+        p = data["PATH"].joinpath(value)
+        if not value or not p.parent.is_dir():
+            raise ValueError(f"BUNDLE must be a file inside an existing directory in {data['NAME']}\n    {value}")
+
+        return p.resolve()
+
     elif prop == "PARAMS":
         parameters, valid = _valid_js_params(value)
         if not valid:
@@ -188,30 +447,109 @@ def _verify_property(prop_value: str, data: dict) -> any:
     raise ValueError(f"Invalid value '{value}' for {data['NAME']}")
 
 
-def _parse_block(block) -> dict:
-    data = {"NAME": re.findall(r"\[.+]", block)[0]}
+class _DirectoryListings:
+    """
+    Answers whether paths are files by listing every directory once,
+    instead of calling exists() and is_file() for every path.
+    """
+
+    def __init__(self):
+        self._listings: dict[str, dict[str, bool]] = {}
+        self._resolved: dict[str, Path] = {}
+
+    def _listing(self, directory: str) -> dict[str, bool]:
+        # Maps the name of every file to whether it is a symbolic link
+        listing = self._listings.get(directory)
+        if listing is None:
+            listing = {}
+            try:
+                with os.scandir(directory or ".") as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            listing[entry.name] = entry.is_symlink()
+            except OSError:
+                pass
+            self._listings[directory] = listing
+        return listing
+
+    def resolve_file(self, path: str) -> Optional[Path]:
+        # Same as Path(path).resolve() if path is a file, otherwise None
+        directory, name = os.path.split(path)
+        is_symlink = self._listing(directory).get(name)
+        if is_symlink is None:
+            return None
+        if is_symlink:
+            return Path(path).resolve()
+
+        resolved = self._resolved.get(directory)
+        if resolved is None:
+            resolved = self._resolved[directory] = Path(directory).resolve()
+        return resolved.joinpath(name)
+
+
+def _verify_files(values: list[str], data: dict) -> list[Path]:
+    # A FILE is looked up relative to the working directory first, then relative to PATH
+    listings = _DirectoryListings()
+    files = []
+    for value in values:
+        value = value.strip()
+        f = listings.resolve_file(value) or listings.resolve_file(os.path.join(data["PATH"], value))
+        if f is None:
+            # Listings are case-sensitive even if the filesystem is not
+            for candidate in [Path(value), data["PATH"].joinpath(value)]:
+                if candidate.is_file():
+                    f = candidate.resolve()
+                    break
+            else:
+                raise ValueError(f"Specified FILE is not a file or doesn't exist in {data['NAME']}\n    {value}")
+
+        files.append(f)
+
+    return files
+
+
+# Properties that can be defined more than once in a block
+_LIST_PROPERTIES = ["FILE", "REPL_ID", "PARAMS"]
+
+# Properties read after PATH, BEHAVIOR, UN_REPL_ID, FILE, REPL_ID and PARAMS
+_BLOCK_PROPERTIES = [
+    "ONLOAD", "WATCH", "WATCH_DELAY", "WATCHER", "POLL_INTERVAL", "JOBS", "CACHE", "EXCLUDE", "BUNDLE",
+    "BUNDLE_REPORT", "SHARED_SUBTREES", "MINIFY_CODE", "OUTPUT_MODE", "UPDATE_FUNCTION",
+    "ALLOW_ANYTHING_IN_CLOSE_TAGS", "IGNORE_MISMATCHING_CLOSING_TAGS", "AUTOMATICALLY_DECODE_HTML_ENTITIES",
+    "TOKENIZER_ENGINE", "DIAGNOSTICS", "TOKENIZE_WHOLE_FILE"
+]
+
+_KNOWN_PROPERTIES = ["PATH", "BEHAVIOR", "UN_REPL_ID"] + _LIST_PROPERTIES + _BLOCK_PROPERTIES
+
 
-    path = re.findall(r"PATH ?= ?.+", block)
+def _parse_block(name: str, properties: dict[str, list[str]]) -> dict:
+    # properties maps every property found in the block to its values in order
+    data = {"NAME": name}
+
+    for prop in properties:
+        if prop not in _KNOWN_PROPERTIES:
+            logging.warning(f"Unknown property '{prop}' in {name}")
+
+    path = properties.get("PATH", [])
     if len(path) != 1:
         raise ValueError(f"Missing PATH property or found multiple definitions for {data['NAME']}")
-    data["PATH"] = _verify_property(path[0], data)
+    data["PATH"] = _verify_property("PATH", path[0], data)
 
-    behavior = re.findall("BEHAVIOR ?= ?.+", block)
+    behavior = properties.get("BEHAVIOR")
     if not behavior:
         raise ValueError(f"Missing BEHAVIOR property for {data['NAME']}")
-    data["BEHAVIOR"] = _verify_property(behavior[0], data)
+    data["BEHAVIOR"] = _verify_property("BEHAVIOR", behavior[0], data)
 
-    un_repl_id = re.findall("UN_REPL_ID ?= ?.+", block)
+    un_repl_id = properties.get("UN_REPL_ID")
     if un_repl_id:
-        data["UN_REPL_ID"] = _verify_property(un_repl_id[0], data)
+        data["UN_REPL_ID"] = _verify_property("UN_REPL_ID", un_repl_id[0], data)
 
-    files = re.findall("FILE ?= ?.+", block)
+    files = properties.get("FILE")
     if not files:
         raise ValueError(f"Missing FILE property for {data['NAME']}")
-    data["FILE"] = "*" if files[0][-1] == "*" else [_verify_property(f, data) for f in files]
+    data["FILE"] = "*" if files[0].strip().endswith("*") else _verify_files(files, data)
 
-    block = re.sub("UN_REPL_ID ?= ?.+", "", block)
-    repl_id = re.findall("REPL_ID ?= ?.*", block)
+    repl_id = properties.get("REPL_ID", [])
     files_l, repl_id_l = len(files), len(repl_id)
     if repl_id:
         if "UN_REPL_ID" in data:
@@ -221,14 +559,14 @@ def _parse_block(block) -> dict:
         if files_l > repl_id_l:
             raise ValueError(f"Too few REPL_ID properties in {data['NAME']} (FILE={files_l}, REPL_ID={repl_id_l})")
 
-        data["REPL_ID"] = [_verify_property(r, data) for r in repl_id]
+        data["REPL_ID"] = [_verify_property("REPL_ID", r, data) for r in repl_id]
     elif data["BEHAVIOR"] == "replace" and "UN_REPL_ID" not in data:
         raise ValueError(f"BEHAVIOR = replace requires a REPL_ID for every FILE "
                          f"or UN_REPL_ID must have a value in {data['NAME']}")
 
-    params = re.findall("PARAMS ?= ?.*", block)
+    params = properties.get("PARAMS")
     if params:
-        data["PARAMS"] = [_verify_property(p, data) for p in params]
+        data["PARAMS"] = [_verify_property("PARAMS", p, data) for p in params]
         params_l = len(params)
         if params_l != 1:
             if files_l < params_l:
@@ -238,44 +576,233 @@ def _parse_block(block) -> dict:
         elif params_l == 1:
             logging.info(f"All FILE will use the specified PARAMS in {data['NAME']}")
 
-    for prop in ["ONLOAD", "WATCH", "MINIFY_CODE", "ALLOW_ANYTHING_IN_CLOSE_TAGS",
-                 "IGNORE_MISMATCHING_CLOSING_TAGS", "AUTOMATICALLY_DECODE_HTML_ENTITIES"]:
-        found = re.findall(f"{prop} ?= ?.+", block)
+    for prop in _BLOCK_PROPERTIES:
+        found = properties.get(prop)
         if found:
-            data[prop] = _verify_property(found[0], data)
+            data[prop] = _verify_property(prop, found[0], data)
 
     if "ONLOAD" in data and data["ONLOAD"] and data["BEHAVIOR"] == "return":
         raise ValueError(f"ONLOAD = True cannot be used with BEHAVIOR = return for {data['NAME']}")
 
+    if "BUNDLE" in data and "UN_REPL_ID" not in data and "" in data.get("REPL_ID", []):
+        # Components would look for their own script, which is the bundle
+        raise ValueError(f"BUNDLE cannot be used with an empty REPL_ID in {data['NAME']}")
+
+    if "SHARED_SUBTREES" in data and data["SHARED_SUBTREES"] and "BUNDLE" not in data:
+        # Shared functions are written inside the bundle
+        raise ValueError(f"SHARED_SUBTREES = True requires BUNDLE in {data['NAME']}")
+
     return data
 
 
-def parse_config(_file: Path) -> list[dict]:
-    with open(_file, "r") as f:
-        data = f.read()
+def _property_value(prop: str, value: any, name: str) -> str:
+    # Value of a property as written in a config file
+    if isinstance(value, (bool, int)):
+        return str(value)
+    if isinstance(value, str):
+        return value
+    if prop == "PARAMS" and isinstance(value, list) and all(isinstance(p, str) for p in value):
+        return ", ".join(value)
+
+    raise ValueError(f"Invalid value '{value}' for {prop} in {name}")
+
+
+def verify_config(config: dict, name: str) -> dict:
+    """
+    Verifies the properties of a single file given as a dict, like the ones sent to the daemon,
+    the same way as a config block with one FILE.
+
+    REPL_ID and PARAMS are lists with a value for the file, like in parsed blocks,
+    PATH and FILE can't be given. Raises ValueError if a property is unknown or invalid.
+    """
+    properties = {"PATH": ["."], "FILE": ["*"]}
+    for prop, value in config.items():
+        if prop not in _KNOWN_PROPERTIES or prop in ["PATH", "FILE"]:
+            raise ValueError(f"Unknown property '{prop}' in {name}")
+
+        if prop in _LIST_PROPERTIES:
+            if value is None:
+                continue
+            if not isinstance(value, list):
+                raise ValueError(f"{prop} must be a list in {name}")
+            if value:
+                properties[prop] = [_property_value(prop, v, name) for v in value]
+            continue
 
-    config_blocks = []
-    data = re.sub(r"#.*\n", "", data)
-    data = data.split("\n")
+        properties[prop] = [_property_value(prop, value, name)]
 
-    for line in data:
-        if not line:
+    data = _parse_block(name, properties)
+    for prop in ["NAME", "PATH", "FILE"]:
+        del data[prop]
+    return data
+
+
+def _read_blocks(data: str, comments: bool = True) -> list[tuple[str, dict[str, list[str]]]]:
+    # Single pass over the lines of a config file, returns the name of every block
+    # along with the values of its properties
+    blocks = []
+    for line in data.split("\n"):
+        comment = line.find("#") if comments else -1
+        if comment != -1:
+            line = line[:comment]
+
+        if not line.strip():
             continue
 
         if line.startswith("["):
+            line = line.rstrip()
             _verify_name(line)
-            config_blocks.append(line)
+            blocks.append((line, {}))
             continue
 
-        if not config_blocks:
+        if not blocks:
             raise ValueError("Missing block name")
 
-        config_blocks[-1] += f"\n{line}"
+        equal_index = line.find("=")
+        if equal_index == -1:
+            continue
+
+        prop, value = line[:equal_index].strip(), line[equal_index + 1:]
+        if not value and prop not in ["REPL_ID", "PARAMS"]:
+            continue
+
+        blocks[-1][1].setdefault(prop, []).append(value)
 
+    return blocks
+
+
+def _encode_blocks(blocks: list[dict]) -> list[dict]:
+    # JSON compatible copy of parsed blocks
+    encoded = []
+    for block in blocks:
+        block = dict(block, PATH=str(block["PATH"]))
+        if "BUNDLE" in block:
+            block["BUNDLE"] = str(block["BUNDLE"])
+        if block["FILE"] != "*":
+            block["FILE"] = [str(f) for f in block["FILE"]]
+        encoded.append(block)
+    return encoded
+
+
+def _decode_blocks(encoded: list[dict]) -> list[dict]:
+    blocks = []
+    for block in encoded:
+        block = dict(block, PATH=Path(block["PATH"]))
+        if "BUNDLE" in block:
+            block["BUNDLE"] = Path(block["BUNDLE"])
+        if block["FILE"] != "*":
+            block["FILE"] = [Path(f) for f in block["FILE"]]
+        for prop in ["REPL_ID", "PARAMS"]:
+            if prop in block:
+                block[prop] = [list(value) if isinstance(value, list) else value for value in block[prop]]
+        blocks.append(block)
+    return blocks
+
+
+# Parsed configs by path, the same entries stored next to configs with a block using CACHE
+_parsed_configs: dict[str, dict] = {}
+
+
+class _LoggedMessages(logging.Filter):
+    # Remembers what is logged while parsing a config, so a cached config logs it again
+    def __init__(self):
+        super().__init__()
+        self.messages: list[list] = []
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        self.messages.append([record.levelno, record.getMessage()])
+        return True
+
+
+def _config_cache_file(_file: Path) -> Path:
+    return _file.with_name(f".{_file.name}.pywstconfig")
+
+
+def _cached_config(_file: Path, file_stat: list[int], read_data: Callable[[], bytes]) -> Optional[list[dict]]:
+    # Returns the parsed blocks if the config is unchanged, logging what was logged while parsing it
+    entry = _parsed_configs.get(str(_file))
+    if entry is None:
+        try:
+            with open(_config_cache_file(_file), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    if entry.get("version") != VERSION or entry.get("cwd") != str(Path.cwd()):
+        return None
+
+    if entry["stat"] != file_stat and entry["digest"] != hashlib.sha256(read_data()).hexdigest():
+        return None
+
+    _parsed_configs[str(_file)] = entry
+    for level, message in entry["log"]:
+        logging.log(level, message)
+
+    blocks = _decode_blocks(entry["blocks"])
+    for block, files in zip(blocks, entry["files"]):
+        # Files may have been removed since the config was parsed
+        if files is not None:
+            block["FILE"] = _verify_files(files, block)
+    return blocks
+
+
+def _store_config(_file: Path, file_stat: list[int], data: bytes, blocks: list[dict], entry: dict):
+    # entry holds the FILE values and the messages logged of every block
+    entry.update({
+        "version": VERSION, "cwd": str(Path.cwd()), "stat": file_stat, "digest": hashlib.sha256(data).hexdigest(),
+        "blocks": _encode_blocks(blocks)
+    })
+    _parsed_configs[str(_file)] = entry
+
+    cache_file = _config_cache_file(_file)
+    try:
+        if not any("CACHE" in block and block["CACHE"] for block in blocks):
+            cache_file.unlink(missing_ok=True)
+            return
+
+        tmp = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp, cache_file)
+    except OSError:
+        pass  # Parsing again next time is fine
+
+
+def parse_config(_file: Path) -> list[dict]:
+    # Parsed configs are cached by modification time and contents, on disk only if a block uses CACHE
+    _file = _file.resolve()
+    st = _file.stat()
+    file_stat = [st.st_mtime_ns, st.st_size]
+
+    data = None
+
+    def read_data() -> bytes:
+        nonlocal data
+        if data is None:
+            data = _file.read_bytes()
+        return data
+
+    blocks = _cached_config(_file, file_stat, read_data)
+    if blocks is not None:
+        return blocks
+
+    config_blocks = _read_blocks(read_data().decode())
     if not config_blocks:
         raise ValueError("No data")
 
-    return [_parse_block(block) for block in config_blocks]
+    logged = _LoggedMessages()
+    root = logging.getLogger()
+    root.addFilter(logged)
+    try:
+        blocks = [_parse_block(name, properties) for name, properties in config_blocks]
+    finally:
+        root.removeFilter(logged)
+
+    files = [
+        None if block["FILE"] == "*" else properties["FILE"] for block, (_, properties) in zip(blocks, config_blocks)
+    ]
+    _store_config(_file, file_stat, read_data(), blocks, {"files": files, "log": logged.messages})
+    return blocks
 
 
 def args_to_config(args: Namespace) -> Optional[dict]:
@@ -303,12 +830,15 @@ def args_to_config(args: Namespace) -> Optional[dict]:
     config_block += f"BEHAVIOR = {args.behavior}\n"
 
     options = [
-        args.uidrepl, args.params, args.onload, args.watch, args.minify, args.ictag,
-        args.mctag, args.entdec
+        args.uidrepl, args.params, args.onload, args.watch, args.watchdelay, args.watcher, args.pollinterval,
+        args.jobs, args.cache, args.exclude, args.bundle, args.bundlereport, args.shared, args.minify, args.output,
+        args.update, args.ictag, args.mctag, args.entdec, args.engine, args.diagnostics, args.wholefile
     ]
     config_options = [
-        "UN_REPL_ID", "PARAMS", "ONLOAD", "WATCH", "MINIFY_CODE", "ALLOW_ANYTHING_IN_CLOSE_TAGS",
-        "IGNORE_MISMATCHING_CLOSING_TAGS", "AUTOMATICALLY_DECODE_HTML_ENTITIES"
+        "UN_REPL_ID", "PARAMS", "ONLOAD", "WATCH", "WATCH_DELAY", "WATCHER", "POLL_INTERVAL", "JOBS", "CACHE",
+        "EXCLUDE", "BUNDLE", "BUNDLE_REPORT", "SHARED_SUBTREES", "MINIFY_CODE", "OUTPUT_MODE", "UPDATE_FUNCTION",
+        "ALLOW_ANYTHING_IN_CLOSE_TAGS", "IGNORE_MISMATCHING_CLOSING_TAGS", "AUTOMATICALLY_DECODE_HTML_ENTITIES",
+        "TOKENIZER_ENGINE", "DIAGNOSTICS", "TOKENIZE_WHOLE_FILE"
     ]
 
     for option, config_option in zip(options, config_options):
@@ -324,4 +854,5 @@ def args_to_config(args: Namespace) -> Optional[dict]:
 
     # print(config_block)
 
-    return _parse_block(config_block)
+    name, properties = _read_blocks(config_block, comments=False)[0]
+    return _parse_block(name, properties)